@@ -0,0 +1,158 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from config import cfg
+import metrics
+
+def _sha(*parts: str) -> str:
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+class AnswerKey:
+    """Everything a cached answer is looked up and invalidated by.
+
+    `prompt_hash` (final prompt + LLM model) is the exact tier. The semantic tier groups
+    answers by `context_hash` (LLM model, embedding model of the query vector, ordered
+    chunk ids of the prompt's passages and the earlier chat messages) and matches query
+    vectors by cosine similarity inside a group.
+    """
+
+    def __init__(self, prompt: str, model: str, chunk_ids: List[str], history: List[str],
+                 query_vec=None, query_model: str = '', doc_ids: Iterable[str] = ()):
+        self.prompt_hash = _sha(model, prompt)
+        self.context_hash = _sha(model, query_model, *chunk_ids, '', *history)
+        self.doc_ids = frozenset(doc_ids)
+        self.query_vec = None
+        if query_vec is not None:
+            vec = np.asarray(query_vec, dtype=np.float32)
+            norm = float(np.linalg.norm(vec))
+            self.query_vec = vec / norm if norm else None
+
+class AnswerCache:
+    """Bounded LRU of LLM answers with a TTL, reachable by exact prompt or by a similar query.
+
+    One store of at most `max_entries` answers backs both tiers; the semantic index and
+    the per-document index are kept in step with it, so eviction, expiry and document
+    invalidation remove an answer from both.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, min_cosine: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_cosine = min_cosine
+        self._entries = OrderedDict()  # prompt hash -> (answer, expires, key)
+        self._groups: Dict[str, Dict[str, np.ndarray]] = {}  # context hash -> {prompt hash: query vec}
+        self._by_doc: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self.stats = {'exact_hits': 0, 'semantic_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _count(self, stat: str, n: int = 1):
+        if n:
+            self.stats[stat] += n
+            metrics.inc('answer_cache_events_total', n, event=stat)
+
+    def _drop(self, prompt_hash: str):
+        """Remove one answer from every index; caller holds the lock"""
+        _, _, key = self._entries.pop(prompt_hash)
+        group = self._groups.get(key.context_hash)
+        if group is not None:
+            group.pop(prompt_hash, None)
+            if not group:
+                del self._groups[key.context_hash]
+        for doc_id in key.doc_ids:
+            hashes = self._by_doc.get(doc_id)
+            if hashes is not None:
+                hashes.discard(prompt_hash)
+                if not hashes:
+                    del self._by_doc[doc_id]
+
+    def _live(self, prompt_hash: str) -> Optional[str]:
+        """Answer for prompt_hash unless missing or expired; caller holds the lock"""
+        entry = self._entries.get(prompt_hash)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            self._drop(prompt_hash)
+            return None
+        self._entries.move_to_end(prompt_hash)
+        return entry[0]
+
+    def get(self, key: AnswerKey):
+        """(answer, tier) with tier 'exact' or 'semantic', or (None, None) on a miss"""
+        with self._lock:
+            answer = self._live(key.prompt_hash)
+            if answer is not None:
+                self._count('exact_hits')
+                return answer, 'exact'
+            group = self._groups.get(key.context_hash)
+            if group and key.query_vec is not None:
+                best, best_cos = None, self.min_cosine
+                for prompt_hash, vec in group.items():
+                    cos = float(vec @ key.query_vec)
+                    if cos >= best_cos:
+                        best, best_cos = prompt_hash, cos
+                answer = self._live(best) if best is not None else None
+                if answer is not None:
+                    self._count('semantic_hits')
+                    return answer, 'semantic'
+            self._count('misses')
+            return None, None
+
+    def put(self, key: AnswerKey, answer: str):
+        with self._lock:
+            if key.prompt_hash in self._entries:
+                self._drop(key.prompt_hash)
+            self._entries[key.prompt_hash] = (answer, time.monotonic() + self.ttl, key)
+            if key.query_vec is not None:
+                self._groups.setdefault(key.context_hash, {})[key.prompt_hash] = key.query_vec
+            for doc_id in key.doc_ids:
+                self._by_doc.setdefault(doc_id, set()).add(key.prompt_hash)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                evicted += 1
+            self._count('evictions', evicted)
+
+    def invalidate(self, doc_ids: Iterable[str]) -> int:
+        """Drop every answer whose prompt drew on one of doc_ids"""
+        with self._lock:
+            hashes = set()
+            for doc_id in doc_ids:
+                hashes |= self._by_doc.get(doc_id, set())
+            for prompt_hash in hashes:
+                self._drop(prompt_hash)
+            self._count('invalidations', len(hashes))
+            return len(hashes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+            self._by_doc.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, 'entries': len(self._entries)}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Process-wide answer cache, or None when ANSWER_CACHE is off"""
+    global _cache
+    if not cfg.ANSWER_CACHE:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache(cfg.ANSWER_CACHE_SIZE, cfg.ANSWER_CACHE_TTL, cfg.ANSWER_CACHE_MIN_COSINE)
+        return _cache
+
+def invalidate_documents(doc_ids: Iterable[str]) -> int:
+    """Called by db_store when a document's chunks are written or deleted"""
+    if _cache is None:
+        return 0
+    return _cache.invalidate(doc_ids)
+
+metrics.describe('answer_cache_events_total', 'Answer cache hits by tier, misses, evictions and invalidated answers')
@@ -1,7 +1,10 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
+import asyncio
+import math
 import sys
+import time
 import os
 
 # Add parent directory to path to import modules
@@ -9,6 +12,10 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import cfg
 from db_store import chroma_client, list_all_documents
+import llm
+import metrics
+from executors import Overloaded, chroma_pool
+from ingest_jobs import get_ingest_queue
 
 # Import routers
 from backend.routes import auth, documents, chat
@@ -31,6 +38,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def server_timing(request, call_next):
+    """Per-stage durations of this request in a Server-Timing header (streams: stages done before the first byte)"""
+    if not cfg.METRICS_ENABLED:
+        return await call_next(request)
+    started = time.perf_counter()
+    token = metrics.start_request()
+    try:
+        response = await call_next(request)
+    finally:
+        timing = metrics.end_request(token)
+    total = f"total;dur={(time.perf_counter() - started) * 1000:.1f}"
+    response.headers["Server-Timing"] = f"{timing}, {total}" if timing else total
+    return response
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc: Overloaded):
+    """Backpressure: tell clients when to come back instead of queueing forever"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(documents.router)
@@ -39,6 +70,18 @@ app.include_router(chat.router)
 # Initialize ChromaDB client
 client = chroma_client()
 
+@app.on_event("startup")
+def resume_ingestion():
+    """Re-queue uploads that were spooled but not indexed before the last shutdown"""
+    recovered = get_ingest_queue().recover()
+    if recovered:
+        print(f"Re-queued {recovered} spooled uploads")
+
+@app.on_event("shutdown")
+def close_llm_client():
+    """Release pooled OpenRouter connections"""
+    llm.close()
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -52,19 +95,32 @@ async def root():
 async def health_check():
     """Detailed health check"""
     try:
-        docs = list_all_documents(client)
+        docs = await asyncio.wait_for(chroma_pool().run(list_all_documents, client), timeout=cfg.HEALTH_TIMEOUT)
         return {
             "status": "healthy",
             "database": "connected",
             "documents_count": len(docs),
             "api_configured": bool(cfg.OPENROUTER_API_KEY)
         }
+    except (asyncio.TimeoutError, Overloaded):
+        # The API itself is responsive; the database pool is just saturated
+        return {
+            "status": "degraded",
+            "database": "busy",
+            "documents_count": None,
+            "api_configured": bool(cfg.OPENROUTER_API_KEY)
+        }
     except Exception as e:
         return JSONResponse(
             status_code=503,
             content={"status": "unhealthy", "error": str(e)}
         )
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics, including per-stage latency histograms (stage_duration_seconds)"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,4 +1,7 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from starlette.background import BackgroundTask
+from contextlib import aclosing
+import math
 import sys
 import os
 
@@ -6,7 +9,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from backend.schemas import ChatRequest, ChatResponse, ChatMessage
 from db_store import chroma_client
-from pipeline import run_rag
+from executors import Overloaded, chat_limiter
+from llm import LLMError, UpstreamUnavailable
+from pipeline import coalesced_rag, coalesced_stream_rag
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
@@ -27,18 +32,41 @@ async def chat_query(request: ChatRequest):
             for msg in request.chat_history
         ] if request.chat_history else []
         
-        # Run RAG
-        answer = run_rag(
-            query=request.query,
-            client=client,
-            top_k=request.top_k,
-            chat_history=chat_history
-        )
+        # Run RAG (blocking stages run on dedicated executors; identical concurrent
+        # questions share one execution)
+        report = {}
+        async with chat_limiter():
+            answer = await coalesced_rag(
+                query=request.query,
+                client=client,
+                top_k=request.top_k,
+                chat_history=chat_history,
+                report=report
+            )
         
         return ChatResponse(
             answer=answer,
-            sources=[]  # Can be enhanced to return actual sources
+            sources=[],  # Can be enhanced to return actual sources
+            timings={
+                'rerank_ms': round(report.get('rerank_ms', 0.0), 1),
+                'rerank_skipped': report.get('rerank_skipped'),
+                'prompt_tokens': report.get('prompt_tokens'),
+                'prompt_tokens_saved': report.get('prompt_tokens_saved'),
+                'prompt_over_budget': report.get('prompt_over_budget', False),
+                'answer_cache': report.get('answer_cache'),
+                'coalesced': report.get('coalesced', False),
+                'coalesced_ms': report.get('coalesced_ms'),
+                'collections_skipped': report.get('collections_skipped', []),
+                'collections_failed': report.get('collections_failed', [])
+            },
+            partial=report.get('partial', False)
         )
+    except Overloaded:
+        raise
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except LLMError as e:
+        raise HTTPException(status_code=502, detail=f"Language model error: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
@@ -50,13 +78,26 @@ async def chat(request: ChatRequest):
     return await chat_query(request)
 
 @router.post("/stream")
-async def chat_stream(request: ChatRequest):
+async def chat_stream(request: ChatRequest, http_request: Request):
     """
-    Streaming chat endpoint for faster perceived response time
+    Streaming chat endpoint: sends the retrieved sources first, then relays
+    LLM tokens as OpenRouter produces them. Stops all upstream work if the
+    client disconnects.
     """
     from fastapi.responses import StreamingResponse
     import json
     
+    # Reject before sending headers so busy servers still answer 429 + Retry-After
+    limiter = chat_limiter()
+    await limiter.acquire()
+    released = False
+    
+    async def release_slot():
+        nonlocal released
+        if not released:
+            released = True
+            await limiter.release()
+    
     async def generate():
         try:
             # Convert chat history to expected format
@@ -65,26 +106,35 @@ async def chat_stream(request: ChatRequest):
                 for msg in request.chat_history
             ] if request.chat_history else []
             
-            # Run RAG (this still takes time but we can stream the result)
-            answer = run_rag(
+            events = coalesced_stream_rag(
                 query=request.query,
                 client=client,
                 top_k=request.top_k,
                 chat_history=chat_history
             )
-            
-            # Stream the answer word by word for better UX
-            words = answer.split()
-            for i, word in enumerate(words):
-                chunk = word + (" " if i < len(words) - 1 else "")
-                yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+            async with aclosing(events):
+                async for kind, payload in events:
+                    if await http_request.is_disconnected():
+                        # Closing the generator cancels retrieval and the OpenRouter call
+                        # (once no other identical request is subscribed to it)
+                        return
+                    if kind == 'sources':
+                        yield f"data: {json.dumps({'sources': payload})}\n\n"
+                    elif kind == 'timings':
+                        yield f"data: {json.dumps({'timings': payload})}\n\n"
+                    else:
+                        yield f"data: {json.dumps({'chunk': payload})}\n\n"
             
             # Send done signal
             yield f"data: {json.dumps({'done': True})}\n\n"
             
+        except (Overloaded, UpstreamUnavailable) as e:
+            yield f"data: {json.dumps({'error': str(e), 'retry_after': e.retry_after})}\n\n"
         except Exception as e:
             error_msg = f"Error processing query: {str(e)}"
             yield f"data: {json.dumps({'error': error_msg})}\n\n"
+        finally:
+            await release_slot()
     
-    return StreamingResponse(generate(), media_type="text/event-stream")
-
+    # The background task frees the slot even if the body is never iterated
+    return StreamingResponse(generate(), media_type="text/event-stream", background=BackgroundTask(release_slot))
@@ -1,5 +1,7 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Header, Depends
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Header, Depends
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
+import asyncio
 import sys
 import os
 
@@ -8,13 +10,24 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from backend.schemas import DocumentInfo, DocumentListResponse, DeleteResponse, UploadResponse
 from backend.auth import verify_token
 from db_store import chroma_client, list_all_documents, delete_document
-from pipeline import index_file_bytes
+from ingest_jobs import get_ingest_queue
+from embeddings import get_cache_stats, get_available_models, loaded_models
+from answer_cache import get_answer_cache
+from llm import hedge_stats
+from executors import Overloaded, chroma_pool
 
 router = APIRouter(prefix="/documents", tags=["Documents"])
 
 # Initialize client
 client = chroma_client()
 
+def validate_model(model: Optional[str]) -> Optional[str]:
+    """Accept an AVAILABLE_MODELS key or one of their model names"""
+    available = get_available_models()
+    if model and model not in available and model not in available.values():
+        raise HTTPException(status_code=400, detail=f"Unknown embedding model '{model}'. Choose from: {', '.join(available)}")
+    return model
+
 def require_auth(authorization: Optional[str] = Header(None)):
     """Dependency to require authentication"""
     if not authorization:
@@ -30,12 +43,13 @@ async def list_documents():
     Public endpoint - no auth required
     """
     try:
-        docs = list_all_documents(client)
+        docs = await chroma_pool().run(list_all_documents, client)
         doc_list = [
             DocumentInfo(
                 collection_name=doc['collection_name'],
                 display_name=doc['display_name'],
-                chunk_count=doc['chunk_count']
+                chunk_count=doc['chunk_count'],
+                embed_model=doc.get('embed_model')
             )
             for doc in docs
         ]
@@ -44,48 +58,78 @@ async def list_documents():
             documents=doc_list,
             total=len(doc_list)
         )
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing documents: {str(e)}")
 
+async def _wait_for(job):
+    """Block (without holding the event loop) until a job finishes"""
+    await asyncio.wrap_future(job.future)
+    return job
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_document(
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    model: Optional[str] = Form(None),
+    wait: bool = False
 ):
     """
-    Upload and index a PDF document
+    Upload a PDF document and queue it for indexing
+    Returns a job_id right away; poll /documents/jobs/{job_id} for progress.
+    Pass ?wait=true to block until indexing finishes.
     Public endpoint - no auth required for demo
     """
     # Validate file type
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    validate_model(model)
     
     try:
-        # Read file bytes
-        file_bytes = await file.read()
-        
-        # Index the document
-        collection = index_file_bytes(file_bytes, file.filename)
-        chunk_count = collection.count()
+        # Spool to disk and hand over to the ingestion workers
+        job = await run_in_threadpool(get_ingest_queue().submit_file, file.file, file.filename, model)
+        if not wait:
+            return UploadResponse(
+                success=True,
+                filename=file.filename,
+                message=f"Queued {file.filename} for indexing",
+                job_id=job.id,
+                status=job.status
+            )
         
+        await _wait_for(job)
+        if job.status == 'failed':
+            raise HTTPException(status_code=500, detail=f"Error indexing document: {job.error}")
+        message = f"Successfully indexed {file.filename}"
+        if job.result.get('unchanged'):
+            message = f"{file.filename} is unchanged; existing index kept"
         return UploadResponse(
             success=True,
             filename=file.filename,
-            message=f"Successfully indexed {file.filename}",
-            chunk_count=chunk_count
+            message=message,
+            job_id=job.id,
+            status=job.status,
+            **job.result
         )
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error indexing document: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error queueing document: {str(e)}")
 
 @router.post("/upload-multiple")
 async def upload_multiple_documents(
-    files: List[UploadFile] = File(...)
+    files: List[UploadFile] = File(...),
+    model: Optional[str] = Form(None),
+    wait: bool = False
 ):
     """
-    Upload and index multiple PDF documents
+    Upload multiple PDF documents and queue them for indexing
     Public endpoint - no auth required for demo
     """
+    validate_model(model)
     results = []
     errors = []
+    jobs = []
     
     for file in files:
         if not file.filename.endswith('.pdf'):
@@ -93,18 +137,24 @@ async def upload_multiple_documents(
             continue
         
         try:
-            file_bytes = await file.read()
-            collection = index_file_bytes(file_bytes, file.filename)
-            chunk_count = collection.count()
-            
-            results.append({
-                "success": True,
-                "filename": file.filename,
-                "chunk_count": chunk_count
-            })
+            jobs.append(await run_in_threadpool(get_ingest_queue().submit_file, file.file, file.filename, model))
         except Exception as e:
             errors.append({"filename": file.filename, "error": str(e)})
     
+    for job in jobs:
+        if wait:
+            await _wait_for(job)
+        if job.status == 'failed':
+            errors.append({"filename": job.filename, "error": job.error, "job_id": job.id})
+            continue
+        results.append({
+            "success": True,
+            "filename": job.filename,
+            "job_id": job.id,
+            "status": job.status,
+            **job.result
+        })
+    
     return {
         "total_files": len(files),
         "successful": len(results),
@@ -113,6 +163,22 @@ async def upload_multiple_documents(
         "errors": errors
     }
 
+@router.get("/jobs")
+async def list_jobs():
+    """Recent ingestion jobs with per-stage progress"""
+    return {"jobs": [job.to_dict() for job in get_ingest_queue().list()]}
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Status of one ingestion job: pages extracted, chunks embedded,
+    vectors written and throughput
+    """
+    job = get_ingest_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
 @router.delete("/{collection_name}", response_model=DeleteResponse)
 async def delete_doc(
     collection_name: str
@@ -122,7 +188,7 @@ async def delete_doc(
     Public endpoint - no auth required for demo
     """
     try:
-        success = delete_document(client, collection_name)
+        success = await chroma_pool().run(delete_document, client, collection_name)
         
         if success:
             return DeleteResponse(
@@ -131,6 +197,8 @@ async def delete_doc(
             )
         else:
             raise HTTPException(status_code=404, detail="Document not found or could not be deleted")
+    except (HTTPException, Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
 
@@ -138,13 +206,20 @@ async def delete_doc(
 async def get_stats():
     """Get system statistics"""
     try:
-        docs = list_all_documents(client)
+        docs = await chroma_pool().run(list_all_documents, client)
+        answer_cache = get_answer_cache()
         total_chunks = sum(doc['chunk_count'] for doc in docs)
         
         return {
             "total_documents": len(docs),
             "total_chunks": total_chunks,
-            "average_chunks": total_chunks // len(docs) if docs else 0
+            "average_chunks": total_chunks // len(docs) if docs else 0,
+            "embedding_cache": get_cache_stats(),
+            "answer_cache": answer_cache.snapshot() if answer_cache is not None else None,
+            "llm_hedging": hedge_stats(),
+            "embedding_models": loaded_models()
         }
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting stats: {str(e)}")
@@ -20,11 +20,15 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     sources: Optional[List[Dict[str, Any]]] = []
+    timings: Optional[Dict[str, Any]] = None
+    # True when some collections timed out or failed, so the answer drew on fewer documents
+    partial: bool = False
 
 class DocumentInfo(BaseModel):
     collection_name: str
     display_name: str
     chunk_count: int
+    embed_model: Optional[str] = None
 
 class DocumentListResponse(BaseModel):
     documents: List[DocumentInfo]
@@ -39,6 +43,14 @@ class UploadResponse(BaseModel):
     filename: str
     message: str
     chunk_count: Optional[int] = 0
+    job_id: Optional[str] = None
+    status: Optional[str] = None
+    chunks_reused: Optional[int] = None
+    chunks_embedded: Optional[int] = None
+    chunks_deleted: Optional[int] = None
+    unchanged: Optional[bool] = None
+    tokens_total: Optional[int] = None
+    tokens_truncated: Optional[int] = None
 
 class SystemStats(BaseModel):
     total_documents: int
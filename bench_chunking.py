@@ -0,0 +1,47 @@
+# Benchmark: character-window vs tokenizer-aware chunking on one PDF
+#
+#   python bench_chunking.py --pdf contract.pdf --model sentence-transformers/all-MiniLM-L6-v2
+#
+# Reports chunk counts, tokens the encoder would truncate, and encode time for each chunker.
+import argparse
+import time
+
+from config import cfg
+cfg.EMBED_CACHE_DISK = False
+
+from chunking import TokenChunker, char_chunks
+from embeddings import _get_model, count_tokens, max_tokens, resolve_model_name
+from pdf_extract import extract_pages
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunking truncation benchmark")
+    parser.add_argument("--pdf", required=True)
+    parser.add_argument("--model", default=cfg.HUGGINGFACE_EMBED_MODEL)
+    parser.add_argument("--overlap-tokens", type=int, default=cfg.CHUNK_OVERLAP_TOKENS)
+    args = parser.parse_args()
+
+    model_name = resolve_model_name(args.model)
+    model = _get_model(model_name)
+    limit = max_tokens(model_name)
+    pages = [(p['page_num'], p['text']) for p in extract_pages(args.pdf)]
+    counter = lambda texts: count_tokens(texts, model_name=model_name)
+    chunkers = {
+        'chars': char_chunks,
+        'tokens': TokenChunker(counter, limit, args.overlap_tokens).chunks,
+    }
+    print(f"Model: {model_name}  token limit: {limit}  pages: {len(pages)}")
+    print(f"{'chunker':>7} {'chunks':>7} {'mean_tok':>9} {'tokens':>8} {'truncated':>9} {'trunc_%':>7} {'encode_s':>9}")
+    for name, chunker in chunkers.items():
+        chunks = list(chunker(pages))
+        texts = [c['text'] for c in chunks]
+        tokens = counter(texts)
+        truncated = sum(max(0, t - limit) for t in tokens)
+        started = time.perf_counter()
+        model.encode(texts, batch_size=32, show_progress_bar=False)
+        encode = time.perf_counter() - started
+        total = sum(tokens)
+        print(f"{name:>7} {len(chunks):>7} {total / max(len(chunks), 1):>9.1f} {total:>8} {truncated:>9} "
+              f"{100 * truncated / max(total, 1):>7.1f} {encode:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Benchmark: ingestion embedding chunks/sec vs number of worker processes
+#
+#   python bench_embed_workers.py --chunks 2048 --workers 1 2 4 --threads 0
+#
+# "in-process" is today's single-process embed_texts path; pool rows start their workers and
+# load the model before timing. Chunks are unique synthetic ~200-token paragraphs.
+import argparse
+import os
+import time
+import uuid
+
+from config import cfg
+cfg.EMBED_CACHE_DISK = False
+
+from embed_workers import EmbeddingWorkerPool
+
+PARAGRAPH = ("The Lessee shall give the Lessor not less than ninety days written notice of termination, "
+             "and any notice under this clause must reference section {} of the agreement. ") * 6
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion embedding worker pool benchmark")
+    parser.add_argument("--chunks", type=int, default=2048)
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks per submitted batch")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=0, help="Threads per worker (0 = cores / workers)")
+    parser.add_argument("--model", default=cfg.HUGGINGFACE_EMBED_MODEL)
+    args = parser.parse_args()
+
+    texts = [PARAGRAPH.format(uuid.uuid4().hex[:8]) for _ in range(args.chunks)]
+    batches = [texts[i:i + args.batch_size] for i in range(0, len(texts), args.batch_size)]
+    print(f"Model: {args.model}  chunks: {len(texts)}  cores: {os.cpu_count()}")
+    print(f"{'workers':>10} {'threads':>7} {'chunks/s':>9} {'speedup':>8}")
+
+    from embeddings import _get_model
+    model = _get_model(args.model)
+    model.encode(texts[:8], show_progress_bar=False)
+    started = time.perf_counter()
+    for batch in batches:
+        model.encode(batch, batch_size=32, show_progress_bar=False)
+    baseline = len(texts) / (time.perf_counter() - started)
+    print(f"{'in-process':>10} {'-':>7} {baseline:>9.1f} {1.0:>8.2f}")
+
+    for workers in args.workers:
+        pool = EmbeddingWorkerPool(workers, args.threads or None)
+        try:
+            pool.warmup(args.model)
+            started = time.perf_counter()
+            done = sum(len(v) for v in pool.embed_ordered(batches, args.model))
+            rate = done / (time.perf_counter() - started)
+        finally:
+            pool.shutdown()
+        print(f"{workers:>10} {pool.threads:>7} {rate:>9.1f} {rate / baseline:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Benchmark: LLM answer latency with and without hedging against a local fake OpenRouter
+#
+#   python bench_llm_hedging.py --requests 200 --concurrency 8 --slow-rate 0.1 --slow-ttft 4 --hedge-after-ms 800
+#
+# The primary model usually sends its first token after --ttft seconds but a --slow-rate share
+# of requests stalls for --slow-ttft (the tail of a free model); the fallback is steady.
+import argparse
+import asyncio
+import time
+
+from config import cfg
+from fake_openrouter import FakeOpenRouter
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+async def run(requests: int, concurrency: int):
+    import llm
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with gate:
+            started = time.perf_counter()
+            try:
+                await llm.achat(f"Question {i}: how much notice ends the lease?", max_tokens=64)
+            except llm.LLMError as e:
+                print(e)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Hedged LLM request benchmark")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Primary time to first token (s)")
+    parser.add_argument("--slow-rate", type=float, default=0.1)
+    parser.add_argument("--slow-ttft", type=float, default=4.0)
+    parser.add_argument("--fallback-ttft", type=float, default=0.6)
+    parser.add_argument("--hedge-after-ms", type=float, default=800)
+    args = parser.parse_args()
+
+    fake = FakeOpenRouter({
+        'primary': {'ttft': args.ttft, 'slow_rate': args.slow_rate, 'slow_ttft': args.slow_ttft, 'fail_rate': 0.0},
+        'fallback': {'ttft': args.fallback_ttft, 'slow_rate': 0.0, 'slow_ttft': 0.0, 'fail_rate': 0.0},
+    }).start()
+    cfg.OPENROUTER_BASE_URL = fake.url
+    cfg.OPENROUTER_API_KEY = 'fake'
+    cfg.LLM_MODEL = 'primary'
+    cfg.LLM_HEDGE_AFTER_MS = args.hedge_after_ms
+    cfg.LLM_RATE_PER_MIN = 0
+    import llm
+
+    print(f"{'mode':>8} {'p50_s':>6} {'p95_s':>6} {'p99_s':>6} {'max_s':>6} {'hedge%':>7} {'fb_win%':>7}")
+    for mode, fallback in (("single", ""), ("hedged", "fallback")):
+        cfg.LLM_FALLBACK_MODEL = fallback
+        before = llm.hedge_stats()
+        latencies = asyncio.run(run(args.requests, args.concurrency))
+        after = llm.hedge_stats()
+        hedged = after['hedged'] - before['hedged']
+        eligible = after['requests'] - before['requests']
+        wins = after['fallback_wins'] - before['fallback_wins']
+        print(f"{mode:>8} {percentile(latencies, 0.5):>6.2f} {percentile(latencies, 0.95):>6.2f} "
+              f"{percentile(latencies, 0.99):>6.2f} {max(latencies):>6.2f} "
+              f"{100 * hedged / eligible if eligible else 0:>7.1f} {100 * wins / hedged if hedged else 0:>7.1f}")
+    print(f"requests served by the fake: {fake.requests}, cancelled mid-stream: {fake.cancelled}")
+    fake.stop()
+
+if __name__ == "__main__":
+    main()
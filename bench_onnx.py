@@ -0,0 +1,93 @@
+# Benchmark: torch (sentence-transformers) vs int8 ONNX Runtime for embeddings and reranking
+#
+#   python export_onnx.py --model sentence-transformers/all-MiniLM-L6-v2
+#   python export_onnx.py --model cross-encoder/ms-marco-MiniLM-L-6-v2 --cross-encoder
+#   python bench_onnx.py
+#
+# Each backend runs in a fresh interpreter so import time and peak RSS are its own. Parity is
+# checked against the tolerances in onnx_backend (EMBED_MIN_COSINE, RERANK_MAX_SCORE_DIFF).
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+TEXTS = [f"Clause {i}: the tenant shall give {30 + i % 60} days written notice before terminating the lease, "
+         f"and the deposit is returned within {10 + i % 20} business days of inspection." for i in range(512)]
+QUERY = "How much notice is needed to terminate the lease?"
+
+def child(backend: str, out: str):
+    import resource
+    os.environ['EMBED_BACKEND'] = backend
+    os.environ['RERANK_BACKEND'] = backend
+    os.environ['EMBED_CACHE_DISK'] = 'false'
+    started = time.perf_counter()
+    from embeddings import _get_model
+    from retriever import _get_rerank_model
+    model = _get_model()
+    reranker = _get_rerank_model()
+    load_s = time.perf_counter() - started
+
+    import numpy as np
+    latencies = []
+    for text in TEXTS[:50]:
+        t = time.perf_counter()
+        model.encode([text], show_progress_bar=False)
+        latencies.append((time.perf_counter() - t) * 1000)
+    latencies.sort()
+    t = time.perf_counter()
+    vectors = np.asarray(model.encode(TEXTS, batch_size=32, show_progress_bar=False), dtype=np.float32)
+    throughput = len(TEXTS) / (time.perf_counter() - t)
+    pairs = [[QUERY, text] for text in TEXTS[:64]]
+    t = time.perf_counter()
+    scores = np.asarray(reranker.predict(pairs), dtype=np.float32)
+    rerank_ms = (time.perf_counter() - t) * 1000
+    np.savez(out, vectors=vectors, scores=scores)
+    print(json.dumps({
+        'load_s': load_s, 'p50_ms': latencies[len(latencies) // 2], 'p95_ms': latencies[int(len(latencies) * 0.95) - 1],
+        'texts_per_s': throughput, 'rerank64_ms': rerank_ms,
+        'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description="torch vs ONNX int8 benchmark")
+    parser.add_argument("--child", choices=["torch", "onnx"], help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.out)
+        return
+
+    import numpy as np
+    from onnx_backend import EMBED_MIN_COSINE, RERANK_MAX_SCORE_DIFF
+    results, arrays = {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ("torch", "onnx"):
+            out = os.path.join(tmp, f"{backend}.npz")
+            proc = subprocess.run([sys.executable, __file__, "--child", backend, "--out", out],
+                                  capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"{backend} failed:\n{proc.stderr[-2000:]}")
+                return
+            results[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+            arrays[backend] = dict(np.load(out))
+
+    print(f"{'backend':>7} {'load_s':>7} {'p50_ms':>7} {'p95_ms':>7} {'texts/s':>8} {'rerank64_ms':>11} {'rss_mb':>7}")
+    for backend, r in results.items():
+        print(f"{backend:>7} {r['load_s']:>7.2f} {r['p50_ms']:>7.2f} {r['p95_ms']:>7.2f} {r['texts_per_s']:>8.1f} "
+              f"{r['rerank64_ms']:>11.1f} {r['rss_mb']:>7.0f}")
+
+    a, b = arrays['torch']['vectors'], arrays['onnx']['vectors']
+    cos = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    diff = np.abs(arrays['torch']['scores'] - arrays['onnx']['scores'])
+    top_t = set(np.argsort(-arrays['torch']['scores'])[:5])
+    top_o = set(np.argsort(-arrays['onnx']['scores'])[:5])
+    print(f"embedding cosine: min {cos.min():.4f} mean {cos.mean():.4f} (need >= {EMBED_MIN_COSINE}) "
+          f"{'PASS' if cos.min() >= EMBED_MIN_COSINE else 'FAIL'}")
+    print(f"rerank score diff: max {diff.max():.4f} (need <= {RERANK_MAX_SCORE_DIFF}) "
+          f"{'PASS' if diff.max() <= RERANK_MAX_SCORE_DIFF else 'FAIL'}; top-5 overlap {len(top_t & top_o)}/5")
+
+if __name__ == "__main__":
+    main()
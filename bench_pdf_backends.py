@@ -0,0 +1,51 @@
+# Benchmark: PDF extraction backends on pages/sec and text parity with pypdf
+#
+#   python bench_pdf_backends.py --pdf contract.pdf --backends pypdf pymupdf pdfium
+#
+# Runs each backend in-process without the page cache, then a second pass through the cache.
+# Parity compares each page's words with the pypdf output (1.0 = identical word sequence).
+import argparse
+import difflib
+import os
+import tempfile
+import time
+
+from config import cfg
+cfg.PDF_PAGE_CACHE_PATH = os.path.join(tempfile.mkdtemp(), 'page_cache.sqlite')
+
+from pdf_extract import BACKENDS, available_backends, extract_pages
+
+def parity(reference, pages) -> float:
+    ratios = [difflib.SequenceMatcher(None, ref.split(), page.split(), autojunk=False).ratio() if ref or page else 1.0
+              for ref, page in zip(reference, pages)]
+    return sum(ratios) / len(ratios) if ratios else 1.0
+
+def timed(path: str, backend: str, use_cache: bool):
+    started = time.perf_counter()
+    pages = list(extract_pages(path, backend=backend, use_cache=use_cache, min_pages=1 << 30))
+    return pages, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF extraction backend benchmark")
+    parser.add_argument("--pdf", required=True)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS))
+    args = parser.parse_args()
+
+    installed = set(available_backends())
+    reference = [p['text'] for p in timed(args.pdf, 'pypdf', False)[0]]
+    print(f"Pages: {len(reference)}")
+    print(f"{'backend':>8} {'pages/s':>9} {'cached/s':>10} {'failed':>6} {'chars':>9} {'parity':>7}")
+    for backend in args.backends:
+        if backend not in installed:
+            print(f"{backend:>8}  not installed")
+            continue
+        pages, elapsed = timed(args.pdf, backend, False)
+        timed(args.pdf, backend, True)  # fill the cache
+        _, cached = timed(args.pdf, backend, True)
+        texts = [p['text'] for p in pages]
+        failed = sum(1 for p in pages if p['error'])
+        print(f"{backend:>8} {len(pages) / elapsed:>9.1f} {len(pages) / cached:>10.1f} {failed:>6} "
+              f"{sum(map(len, texts)):>9} {parity(reference, texts):>7.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Benchmark: PDF text extraction pages/sec vs number of worker processes
+#
+#   python bench_pdf_extract.py --pdf contract.pdf --repeat 20 --workers 1 2 4 8
+#
+# --repeat concatenates the PDF with itself so short documents still give a stable measurement.
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pypdf
+
+from pdf_extract import extract_pages
+
+def build_pdf(path: str, repeat: int) -> str:
+    if repeat <= 1:
+        return path
+    writer = pypdf.PdfWriter()
+    for _ in range(repeat):
+        writer.append(path)
+    fd, out = tempfile.mkstemp(suffix='.pdf')
+    with os.fdopen(fd, 'wb') as f:
+        writer.write(f)
+    return out
+
+def run(path: str, workers: int, shard_pages: int):
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        # Start the workers before timing; spawn start-up is paid once per server, not per PDF
+        list(pool.map(abs, range(workers)))
+        started = time.perf_counter()
+        pages = list(extract_pages(path, shard_pages=shard_pages, executor=pool,
+                                   workers=workers, use_cache=False))
+        elapsed = time.perf_counter() - started
+    return pages, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF extraction scaling benchmark")
+    parser.add_argument("--pdf", required=True)
+    parser.add_argument("--repeat", type=int, default=1, help="Concatenate the PDF this many times")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--shard-pages", type=int, default=8)
+    args = parser.parse_args()
+
+    path = build_pdf(args.pdf, args.repeat)
+    try:
+        started = time.perf_counter()
+        baseline = [page.extract_text() or '' for page in pypdf.PdfReader(path).pages]
+        serial = time.perf_counter() - started
+        print(f"Pages: {len(baseline)}  cores: {os.cpu_count()}")
+        print(f"{'workers':>7} {'pages/s':>9} {'speedup':>8} {'failed':>6} {'same_text':>9}")
+        print(f"{'serial':>7} {len(baseline) / serial:>9.1f} {1.0:>8.2f} {0:>6} {'yes':>9}")
+        for workers in sorted(set(args.workers)):
+            pages, elapsed = run(path, workers, args.shard_pages)
+            failed = sum(1 for p in pages if p['error'])
+            same = [p['text'] for p in pages] == baseline
+            print(f"{workers:>7} {len(pages) / elapsed:>9.1f} {serial / elapsed:>8.2f} {failed:>6} {'yes' if same else 'NO':>9}")
+    finally:
+        if path != args.pdf:
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# Benchmark: query embedding throughput vs added latency with and without micro-batching
+#
+#   python bench_query_batching.py --concurrency 1 8 32 --windows 0 2 5 10
+#
+# Every query text is unique so the embedding cache never short-circuits the model.
+import argparse
+import statistics
+import threading
+import time
+import uuid
+
+from config import cfg
+cfg.EMBED_CACHE_DISK = False
+
+from embeddings import embed_texts, _get_model
+from query_batcher import QueryBatcher
+
+parser = argparse.ArgumentParser(description="Query embedding micro-batching benchmark")
+parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+parser.add_argument("--windows", type=float, nargs="+", default=[0, 2, 5, 10], help="Batch windows in ms (0 = no batching)")
+parser.add_argument("--requests", type=int, default=256, help="Queries per run")
+parser.add_argument("--max-batch", type=int, default=cfg.EMBED_BATCH_MAX)
+args = parser.parse_args()
+
+QUERY = "What are the termination clauses and notice periods under section {}?"
+
+def run(concurrency: int, window_ms: float):
+    batcher = QueryBatcher(window_ms=window_ms, max_batch=args.max_batch) if window_ms > 0 else None
+    latencies = []
+    lock = threading.Lock()
+    remaining = [args.requests]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            text = QUERY.format(uuid.uuid4().hex[:8])
+            started = time.perf_counter()
+            if batcher is not None:
+                batcher.embed(text)
+            else:
+                embed_texts([text])
+            with lock:
+                latencies.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    return args.requests / elapsed, statistics.median(latencies), p95
+
+print(f"Model: {cfg.HUGGINGFACE_EMBED_MODEL}")
+_get_model()
+embed_texts([QUERY.format("warmup")])
+print(f"{'concurrency':>11} {'window_ms':>9} {'queries/s':>10} {'p50_ms':>8} {'p95_ms':>8}")
+for concurrency in args.concurrency:
+    for window in args.windows:
+        qps, p50, p95 = run(concurrency, window)
+        print(f"{concurrency:>11} {window:>9g} {qps:>10.1f} {p50:>8.1f} {p95:>8.1f}")
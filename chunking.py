@@ -0,0 +1,118 @@
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+# Pages come in as (page number, text) pairs; chunks go out as
+# {'text', 'page_start', 'page_end', 'tokens'} ('tokens' is None when not measured).
+Pages = Iterable[Tuple[int, str]]
+
+_PARAGRAPH_SPLIT = re.compile(r'\n\s*\n')
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+
+def char_chunks(pages: Pages, chunk_size: int = 1000, overlap: int = 200) -> Iterator[Dict]:
+    """Fixed-size overlapping character windows over "[Page n] text" joined by newlines.
+
+    The original chunker, kept for CHUNKING=chars. Windows are produced page by page
+    while only the unfinished tail of the text is held in memory.
+    """
+    step = chunk_size - overlap
+    buf, buf_start = '', 0
+    page_starts = []  # (offset in the joined text, page number) of pages still in buf
+
+    def chunk_at(offset: int, text: str) -> Dict:
+        covered = [num for start, num in page_starts if start < offset + len(text)]
+        first = [num for start, num in page_starts if start <= offset]
+        return {'text': text, 'page_start': first[-1] if first else covered[0],
+                'page_end': covered[-1], 'tokens': None}
+
+    for i, (num, txt) in enumerate(pages):
+        if i:
+            buf += '\n'
+        page_starts.append((buf_start + len(buf), num))
+        buf += f"[Page {num}] {txt}"
+        while len(buf) >= chunk_size:
+            chunk = buf[:chunk_size]
+            if chunk.strip():
+                yield chunk_at(buf_start, chunk)
+            buf, buf_start = buf[step:], buf_start + step
+            while len(page_starts) > 1 and page_starts[1][0] <= buf_start:
+                page_starts.pop(0)
+    for i in range(0, len(buf), step):
+        chunk = buf[i:i+chunk_size]
+        if chunk.strip():
+            yield chunk_at(buf_start + i, chunk)
+
+class TokenChunker:
+    """Packs paragraphs into chunks that fit the embedding model's sequence length.
+
+    Length is measured with the model's own tokenizer (`count_tokens` maps a list of
+    texts to token counts), so no chunk is silently truncated at encode time. Like
+    smart_chunk_text in legal_agent_team.py, whole paragraphs are kept together where
+    they fit, oversized paragraphs fall back to sentences (and a sentence longer than
+    the limit to word windows), and trailing units of up to `overlap_tokens` are
+    repeated at the start of the next chunk. Page breaks are paragraph boundaries;
+    each chunk records the first and last page it draws from.
+    """
+
+    def __init__(self, count_tokens: Callable[[List[str]], List[int]], max_tokens: int, overlap_tokens: int = 0):
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+
+    def _words(self, sentence: str) -> Iterator[Tuple[str, int]]:
+        words = sentence.split()
+        piece, size = [], 0
+        for word, n in zip(words, self.count_tokens(words)):
+            if piece and size + n > self.max_tokens:
+                yield ' '.join(piece), size
+                piece, size = [], 0
+            piece.append(word)
+            size += n
+        if piece:
+            yield ' '.join(piece), size
+
+    def _units(self, text: str) -> Iterator[Tuple[str, int, str]]:
+        """(text, tokens, separator before it) for each paragraph, or its sentences if it is too long"""
+        paragraphs = [p.strip() for p in _PARAGRAPH_SPLIT.split(text) if p.strip()]
+        for para, n in zip(paragraphs, self.count_tokens(paragraphs) if paragraphs else []):
+            if n <= self.max_tokens:
+                yield para, n, '\n\n'
+                continue
+            sentences = [s for s in _SENTENCE_SPLIT.split(para) if s]
+            sep = '\n\n'
+            for sentence, m in zip(sentences, self.count_tokens(sentences)):
+                if m <= self.max_tokens:
+                    yield sentence, m, sep
+                else:
+                    for words, k in self._words(sentence):
+                        yield words, k, sep
+                        sep = ' '
+                sep = ' '
+
+    def _emit(self, units) -> Dict:
+        text = units[0][0] + ''.join(sep + t for t, _, _, sep in units[1:])
+        return {'text': text, 'page_start': units[0][2], 'page_end': units[-1][2],
+                'tokens': sum(n for _, n, _, _ in units)}
+
+    def _overlap(self, units):
+        tail, size = [], 0
+        for unit in reversed(units):
+            if size + unit[1] > self.overlap_tokens:
+                break
+            tail.insert(0, unit)
+            size += unit[1]
+        return tail
+
+    def chunks(self, pages: Pages) -> Iterator[Dict]:
+        current, size = [], 0
+        for page_num, text in pages:
+            for piece, n, sep in self._units(text):
+                if current and size + n > self.max_tokens:
+                    yield self._emit(current)
+                    current = self._overlap(current)
+                    size = sum(u[1] for u in current)
+                    if size + n > self.max_tokens:
+                        current, size = [], 0
+                current.append((piece, n, page_num, sep))
+                size += n
+        if current:
+            yield self._emit(current)
@@ -8,10 +8,100 @@ load_dotenv()
 class Config:
     OPENROUTER_API_KEY: str = os.getenv('OPENROUTER_API_KEY')
     LLM_MODEL: str = os.getenv('LLM_MODEL','google/gemma-3-27b-it:free')
+    OPENROUTER_BASE_URL: str = os.getenv('OPENROUTER_BASE_URL','https://openrouter.ai/api/v1')
+    # Pooled OpenRouter client (timeouts in seconds)
+    LLM_TIMEOUT: float = float(os.getenv('LLM_TIMEOUT','60'))
+    LLM_CONNECT_TIMEOUT: float = float(os.getenv('LLM_CONNECT_TIMEOUT','10'))
+    LLM_MAX_CONNECTIONS: int = int(os.getenv('LLM_MAX_CONNECTIONS','20'))
+    LLM_MAX_ATTEMPTS: int = int(os.getenv('LLM_MAX_ATTEMPTS','3'))
+    LLM_MAX_BACKOFF: float = float(os.getenv('LLM_MAX_BACKOFF','30'))
+    # Hedging: race LLM_FALLBACK_MODEL when LLM_MODEL sends no token within LLM_HEDGE_AFTER_MS (empty = off)
+    LLM_FALLBACK_MODEL: str = os.getenv('LLM_FALLBACK_MODEL','')
+    LLM_HEDGE_AFTER_MS: float = float(os.getenv('LLM_HEDGE_AFTER_MS','3000'))
     CHROMA_DIR: str = os.getenv('CHROMA_DIR','./chromadb_persist')
+    # 'per_document' keeps one collection per PDF, 'single' stores every chunk in one
+    # collection scoped by source_file metadata (see migrate_collections.py)
+    INDEX_MODE: str = os.getenv('INDEX_MODE','per_document')
+    UNIFIED_COLLECTION: str = os.getenv('UNIFIED_COLLECTION','legal_documents')
+    # Per-document fan-out: thread count and optional per-request deadline (0 = wait for all)
+    QUERY_FANOUT_WORKERS: int = int(os.getenv('QUERY_FANOUT_WORKERS','8'))
+    QUERY_DEADLINE_MS: float = float(os.getenv('QUERY_DEADLINE_MS','0'))
+    # Document routing: search only the top-N documents by centroid similarity (0 = all)
+    ROUTE_TOP_N: int = int(os.getenv('ROUTE_TOP_N','0'))
+    ROUTE_SECTIONS: int = int(os.getenv('ROUTE_SECTIONS','4'))
     # Hugging Face models - using local models to reduce API calls
     HUGGINGFACE_EMBED_MODEL: str = os.getenv('HUGGINGFACE_EMBED_MODEL','sentence-transformers/all-MiniLM-L6-v2')
+    # Memory budget for loaded embedding models (least recently used are unloaded first)
+    EMBED_MODEL_CACHE_MB: float = float(os.getenv('EMBED_MODEL_CACHE_MB','2048'))
+    # Query embedding micro-batching: wait window (ms, 0 = off) and max texts per encode
+    EMBED_BATCH_WINDOW_MS: float = float(os.getenv('EMBED_BATCH_WINDOW_MS','5'))
+    EMBED_BATCH_MAX: int = int(os.getenv('EMBED_BATCH_MAX','32'))
+    # Embedding cache: in-memory LRU (MB) backed by an SQLite file under CHROMA_DIR
+    EMBED_CACHE_MB: float = float(os.getenv('EMBED_CACHE_MB','64'))
+    EMBED_CACHE_DISK: bool = os.getenv('EMBED_CACHE_DISK','true').lower() in ('1','true','yes')
+    EMBED_CACHE_PATH: str = os.getenv('EMBED_CACHE_PATH','')
     RERANK_MODEL: str = os.getenv('RERANK_MODEL','cross-encoder/ms-marco-MiniLM-L-6-v2')
+    # Reranking: p95 latency target in ms (0 = off), candidates fetched per result, pair length, score cache
+    RERANK_P95_MS: float = float(os.getenv('RERANK_P95_MS','150'))
+    RERANK_CANDIDATES: int = int(os.getenv('RERANK_CANDIDATES','3'))
+    RERANK_SHORTLIST_MAX: int = int(os.getenv('RERANK_SHORTLIST_MAX','30'))
+    RERANK_MAX_LENGTH: int = int(os.getenv('RERANK_MAX_LENGTH','256'))
+    RERANK_CACHE_SIZE: int = int(os.getenv('RERANK_CACHE_SIZE','20000'))
+    # Prompt token budget for context + chat history (0 = no limit), and the history's share of it
+    PROMPT_MAX_TOKENS: int = int(os.getenv('PROMPT_MAX_TOKENS','3072'))
+    PROMPT_HISTORY_TOKENS: int = int(os.getenv('PROMPT_HISTORY_TOKENS','512'))
+    # Answer cache: exact prompt tier + semantic tier (query cosine >= MIN_COSINE with the same chunks); TTL in seconds
+    ANSWER_CACHE: bool = os.getenv('ANSWER_CACHE','true').lower() in ('1','true','yes')
+    ANSWER_CACHE_SIZE: int = int(os.getenv('ANSWER_CACHE_SIZE','1000'))
+    ANSWER_CACHE_TTL: float = float(os.getenv('ANSWER_CACHE_TTL','3600'))
+    ANSWER_CACHE_MIN_COSINE: float = float(os.getenv('ANSWER_CACHE_MIN_COSINE','0.95'))
+    # Model runtime: 'torch' (sentence-transformers) or 'onnx' (int8 exports from export_onnx.py in ONNX_MODEL_DIR)
+    EMBED_BACKEND: str = os.getenv('EMBED_BACKEND','torch')
+    RERANK_BACKEND: str = os.getenv('RERANK_BACKEND','torch')
+    ONNX_MODEL_DIR: str = os.getenv('ONNX_MODEL_DIR','./onnx_models')
+    ONNX_THREADS: int = int(os.getenv('ONNX_THREADS','0'))
+    # Executor sizing and backpressure (queue = extra requests allowed to wait for a worker)
+    EMBED_WORKERS: int = int(os.getenv('EMBED_WORKERS','2'))
+    EMBED_QUEUE: int = int(os.getenv('EMBED_QUEUE','32'))
+    CHROMA_WORKERS: int = int(os.getenv('CHROMA_WORKERS','8'))
+    CHROMA_QUEUE: int = int(os.getenv('CHROMA_QUEUE','64'))
+    # LLM scheduler: upstream slots and waiting requests (interactive before batch), per-model
+    # request budget (requests/min, 0 = unlimited) and circuit breaker (consecutive failures, seconds open)
+    LLM_CONCURRENCY: int = int(os.getenv('LLM_CONCURRENCY','16'))
+    LLM_QUEUE: int = int(os.getenv('LLM_QUEUE','64'))
+    LLM_RATE_PER_MIN: float = float(os.getenv('LLM_RATE_PER_MIN','20'))
+    LLM_BURST: float = float(os.getenv('LLM_BURST','10'))
+    LLM_BREAKER_FAILURES: int = int(os.getenv('LLM_BREAKER_FAILURES','5'))
+    LLM_BREAKER_COOLDOWN: float = float(os.getenv('LLM_BREAKER_COOLDOWN','30'))
+    # Identical concurrent chat requests (same normalized query, top_k and history) share one execution
+    CHAT_COALESCE: bool = os.getenv('CHAT_COALESCE','true').lower() in ('1','true','yes')
+    MAX_CONCURRENT_CHATS: int = int(os.getenv('MAX_CONCURRENT_CHATS','64'))
+    OVERLOAD_RETRY_AFTER: float = float(os.getenv('OVERLOAD_RETRY_AFTER','2'))
+    HEALTH_TIMEOUT: float = float(os.getenv('HEALTH_TIMEOUT','2'))
+    # Per-stage latency histograms on /metrics and the Server-Timing response header
+    METRICS_ENABLED: bool = os.getenv('METRICS_ENABLED','true').lower() in ('1','true','yes')
+    # Background ingestion: spool directory (default CHROMA_DIR/ingest_spool), workers, jobs kept
+    INGEST_SPOOL_DIR: str = os.getenv('INGEST_SPOOL_DIR','')
+    INGEST_WORKERS: int = int(os.getenv('INGEST_WORKERS','2'))
+    INGEST_JOB_HISTORY: int = int(os.getenv('INGEST_JOB_HISTORY','200'))
+    # Chunk batches allowed to wait between extract -> embed -> write stages
+    INGEST_QUEUE_DEPTH: int = int(os.getenv('INGEST_QUEUE_DEPTH','4'))
+    # Ingestion-time embedding process pool (<=1 = in-process); threads per worker (0 = cores / workers)
+    INGEST_EMBED_WORKERS: int = int(os.getenv('INGEST_EMBED_WORKERS','0'))
+    INGEST_EMBED_THREADS: int = int(os.getenv('INGEST_EMBED_THREADS','0'))
+    # Chunking: 'tokens' packs paragraphs up to the embedding model's token limit
+    # (CHUNK_MAX_TOKENS=0 uses the model's limit); 'chars' is the old 1000/200 character windows
+    CHUNKING: str = os.getenv('CHUNKING','tokens')
+    CHUNK_MAX_TOKENS: int = int(os.getenv('CHUNK_MAX_TOKENS','0'))
+    CHUNK_OVERLAP_TOKENS: int = int(os.getenv('CHUNK_OVERLAP_TOKENS','32'))
+    # PDF text extraction process pool (0 workers = one per CPU); small PDFs stay in-process
+    PDF_WORKERS: int = int(os.getenv('PDF_WORKERS','0'))
+    PDF_SHARD_PAGES: int = int(os.getenv('PDF_SHARD_PAGES','8'))
+    PDF_PARALLEL_MIN_PAGES: int = int(os.getenv('PDF_PARALLEL_MIN_PAGES','16'))
+    # PDF text extractor (pypdf, pymupdf, pdfium) and page text cache (default CHROMA_DIR/page_cache.sqlite)
+    PDF_BACKEND: str = os.getenv('PDF_BACKEND','pypdf')
+    PDF_PAGE_CACHE: bool = os.getenv('PDF_PAGE_CACHE','true').lower() in ('1','true','yes')
+    PDF_PAGE_CACHE_PATH: str = os.getenv('PDF_PAGE_CACHE_PATH','')
     # Admin credentials
     ADMIN_PASSWORD: str = os.getenv('ADMIN_PASSWORD', 'admin123')
 
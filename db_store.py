@@ -1,8 +1,19 @@
 import chromadb
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
 from typing import List, Dict, Any
 from config import cfg
+from doc_router import get_routing_index, model_slug, CentroidAccumulator
+from doc_registry import get_document_registry
+from answer_cache import invalidate_documents
+import metrics
 import re
 
+# Shared pool for per-document collection fan-out (created on first query)
+_fanout_pool = None
+
 def chroma_client(path: str = None):
     path = path or cfg.CHROMA_DIR
     return chromadb.PersistentClient(path=path)
@@ -17,17 +28,133 @@ def sanitize_collection_name(filename: str) -> str:
         name = 'doc_' + name
     return name[:63]  # ChromaDB has 63 char limit
 
-def get_or_create_collection(client, filename: str):
+def single_collection_mode() -> bool:
+    return cfg.INDEX_MODE == 'single'
+
+def collection_model(col) -> str:
+    """Embedding model that produced a collection's vectors (recorded at creation)"""
+    return (col.metadata or {}).get('embed_model') or cfg.HUGGINGFACE_EMBED_MODEL
+
+def _is_unified(name: str) -> bool:
+    return name == cfg.UNIFIED_COLLECTION or name.startswith(cfg.UNIFIED_COLLECTION + '__')
+
+def _unified_collections(client):
+    return [col for col in client.list_collections() if _is_unified(col.name)]
+
+def get_unified_collection(client, model_name: str = None):
+    """Get or create the shared collection used when INDEX_MODE=single.
+
+    Vectors from different models have different dimensions, so each embedding model
+    gets its own shared collection (UNIFIED_COLLECTION__<model>).
+    """
+    model_name = model_name or cfg.HUGGINGFACE_EMBED_MODEL
+    existing = _unified_collections(client)
+    for col in existing:
+        if collection_model(col) == model_name:
+            return col
+    name = cfg.UNIFIED_COLLECTION
+    if any(col.name == name for col in existing):
+        name = f"{cfg.UNIFIED_COLLECTION}__{model_slug(model_name)}"[:63]
+    return client.get_or_create_collection(name, metadata={'embed_model': model_name})
+
+def get_or_create_collection(client, filename: str, model_name: str = None):
     """Get or create a collection for a specific document"""
+    model_name = model_name or cfg.HUGGINGFACE_EMBED_MODEL
+    if single_collection_mode():
+        return get_unified_collection(client, model_name)
     collection_name = sanitize_collection_name(filename)
     try:
-        return client.get_collection(collection_name)
+        col = client.get_collection(collection_name)
+        if collection_model(col) == model_name:
+            return col
+        # Re-indexed with another model: old vectors are in a different space
+        print(f"Re-creating {collection_name}: model changed from {collection_model(col)} to {model_name}")
+        client.delete_collection(collection_name)
     except Exception:
-        return client.create_collection(collection_name)
+        pass
+    return client.create_collection(collection_name, metadata={'embed_model': model_name})
+
+def _document_collections(client):
+    """Per-document collections (everything except the unified collections)"""
+    return [col for col in client.list_collections() if not _is_unified(col.name)]
+
+def models_in_use(client) -> List[str]:
+    """Embedding models that produced the vectors currently searchable"""
+    collections = _unified_collections(client) if single_collection_mode() else _document_collections(client)
+    return sorted({collection_model(col) for col in collections})
+
+def _iter_collection(col, include: List[str], batch_size: int = 1000, where: Dict[str, Any] = None):
+    """Page through a collection with get() so large collections are not loaded at once"""
+    offset = 0
+    while True:
+        data = col.get(include=include, limit=batch_size, offset=offset, where=where)
+        if not data['ids']:
+            break
+        yield data
+        offset += len(data['ids'])
+
+def document_chunk_count(collection, filename: str) -> int:
+    """Number of chunks stored for a document in the given collection"""
+    if not _is_unified(collection.name):
+        return collection.count()
+    entry = (get_document_registry().documents(collection.name) or {}).get(sanitize_collection_name(filename))
+    if entry is not None:
+        return entry['chunk_count']
+    where = {'doc_id': sanitize_collection_name(filename)}
+    return sum(len(data['ids']) for data in _iter_collection(collection, [], where=where))
+
+def _scan_unified_documents(col, batch_size: int = 1000) -> Dict[str, Dict[str, Any]]:
+    """Document registry entries for a unified collection, from the metadata of every chunk"""
+    documents = {}
+    for data in _iter_collection(col, ['metadatas'], batch_size=batch_size):
+        for meta in data['metadatas']:
+            source_file = meta.get('source_file', 'unknown')
+            doc_id = meta.get('doc_id') or sanitize_collection_name(source_file)
+            if doc_id not in documents:
+                documents[doc_id] = {'display_name': source_file, 'chunk_count': 0}
+            documents[doc_id]['chunk_count'] += 1
+    return documents
+
+def unified_documents(col) -> Dict[str, Dict[str, Any]]:
+    """Registered documents of a unified collection; scans it once if it is not registered yet"""
+    registry = get_document_registry()
+    documents = registry.documents(col.name)
+    if documents is None:
+        documents = _scan_unified_documents(col)
+        registry.replace(col.name, documents)
+    return documents
+
+def register_document(collection, filename: str, chunk_count: int):
+    """Record a document's chunk count after (re)indexing into a unified collection"""
+    if _is_unified(collection.name):
+        get_document_registry().set(collection.name, sanitize_collection_name(filename), filename, chunk_count)
+
+def rebuild_document_registry(client, chroma_dir: str = None, batch_size: int = 1000) -> int:
+    """Re-scan every unified collection into the document registry"""
+    registry = get_document_registry(chroma_dir)
+    count = 0
+    for col in _unified_collections(client):
+        documents = _scan_unified_documents(col, batch_size=batch_size)
+        registry.replace(col.name, documents)
+        count += len(documents)
+    return count
+
+def _list_unified_documents(client) -> List[Dict[str, Any]]:
+    documents = {}
+    for col in _unified_collections(client):
+        model_name = collection_model(col)
+        for doc_id, entry in unified_documents(col).items():
+            if doc_id not in documents:
+                documents[doc_id] = {'collection_name': doc_id, 'display_name': entry['display_name'],
+                                     'chunk_count': 0, 'embed_model': model_name}
+            documents[doc_id]['chunk_count'] += entry['chunk_count']
+    return list(documents.values())
 
 def list_all_documents(client) -> List[Dict[str, Any]]:
-    """List all indexed documents (collections)"""
-    collections = client.list_collections()
+    """List all indexed documents (collections, or source_file groups in single mode)"""
+    if single_collection_mode():
+        return _list_unified_documents(client)
+    collections = _document_collections(client)
     documents = []
     for col in collections:
         try:
@@ -36,12 +163,13 @@ def list_all_documents(client) -> List[Dict[str, Any]]:
                 source_file = data['metadatas'][0].get('source_file', col.name)
             else:
                 source_file = col.name
-            
+
             count = col.count()
             documents.append({
                 'collection_name': col.name,
                 'display_name': source_file,
-                'chunk_count': count
+                'chunk_count': count,
+                'embed_model': collection_model(col)
             })
         except Exception:
             continue
@@ -49,34 +177,290 @@ def list_all_documents(client) -> List[Dict[str, Any]]:
 
 def delete_document(client, collection_name: str) -> bool:
     """Delete a document collection"""
+    if single_collection_mode():
+        try:
+            where = {'doc_id': collection_name}
+            deleted = False
+            for col in _unified_collections(client):
+                if not col.get(where=where, limit=1, include=[])['ids']:
+                    continue
+                col.delete(where=where)
+                get_routing_index(model_name=collection_model(col)).remove(collection_name)
+                get_document_registry().remove(col.name, collection_name)
+                invalidate_documents([collection_name])
+                if col.name != cfg.UNIFIED_COLLECTION and col.count() == 0:
+                    # Last document of a secondary model; stop embedding queries for it
+                    client.delete_collection(col.name)
+                    get_document_registry().drop_collection(col.name)
+                deleted = True
+            return deleted
+        except Exception as e:
+            print(f"Error deleting document {collection_name}: {e}")
+            return False
     try:
+        model_name = collection_model(client.get_collection(collection_name))
         client.delete_collection(collection_name)
+        get_routing_index(model_name=model_name).remove(collection_name)
+        invalidate_documents([collection_name])
         return True
     except Exception as e:
         print(f"Error deleting collection {collection_name}: {e}")
         return False
 
-def add_documents(collection, docs: List[str], ids: List[str], embeddings: List[List[float]], filename: str = None):
-    metas = [{'chunk_id': i, 'source_file': filename or 'unknown', 'chunk_index': idx} for idx, i in enumerate(ids)]
-    collection.add(documents=docs, metadatas=metas, ids=ids, embeddings=embeddings)
+def chunk_id(filename: str, content_hash: str, occurrence: int = 0) -> str:
+    """Content-addressed chunk id; occurrence separates identical chunks within one document"""
+    cid = f"{filename}_{content_hash[:16]}"
+    return cid if occurrence == 0 else f"{cid}_{occurrence}"
+
+def chunk_metadata(filename: str, chunk_id: str, chunk_index: int, **extra) -> Dict[str, Any]:
+    return {'chunk_id': chunk_id, 'source_file': filename, 'doc_id': sanitize_collection_name(filename),
+            'chunk_index': chunk_index, **extra}
+
+def add_documents(collection, docs: List[str], ids: List[str], embeddings: List[List[float]], filename: str = None,
+                  start_index: int = 0, metadatas: List[Dict[str, Any]] = None):
+    """Upsert chunks of one document; start_index is the chunk_index of docs[0] when writing in batches.
+
+    Pass metadatas (see chunk_metadata) to store per-chunk indexes or extra fields.
+    """
+    source_file = filename or 'unknown'
+    if metadatas is None:
+        metadatas = [chunk_metadata(source_file, i, start_index + idx) for idx, i in enumerate(ids)]
+    collection.upsert(documents=docs, metadatas=metadatas, ids=ids, embeddings=embeddings)
+    _invalidate_answers(collection, filename)
 
-def query_collection(collection, query_emb, k=5):
-    res = collection.query(query_embeddings=[query_emb], n_results=k, include=['documents','metadatas','distances'])
+def document_chunks(collection, filename: str) -> Dict[str, Dict[str, Any]]:
+    """Metadata of every stored chunk of a document, keyed by chunk id"""
+    where = {'doc_id': sanitize_collection_name(filename)} if _is_unified(collection.name) else None
+    chunks = {}
+    for data in _iter_collection(collection, ['metadatas'], where=where):
+        chunks.update(zip(data['ids'], data['metadatas']))
+    return chunks
+
+def _invalidate_answers(collection, filename: str = None):
+    """Drop cached answers that drew on a document whose chunks just changed"""
+    if filename:
+        invalidate_documents([sanitize_collection_name(filename)])
+    elif not _is_unified(collection.name):
+        invalidate_documents([collection.name])
+
+def update_chunk_metadata(collection, ids: List[str], metadatas: List[Dict[str, Any]], batch_size: int = 1000):
+    for i in range(0, len(ids), batch_size):
+        collection.update(ids=ids[i:i+batch_size], metadatas=metadatas[i:i+batch_size])
+
+def delete_chunks(collection, ids: List[str], batch_size: int = 1000, filename: str = None):
+    """Delete chunks by id; pass filename when the collection is shared by many documents"""
+    for i in range(0, len(ids), batch_size):
+        collection.delete(ids=ids[i:i+batch_size])
+    if ids:
+        _invalidate_answers(collection, filename)
+
+def remove_from_other_models(client, filename: str, model_name: str):
+    """In single mode, drop a document's chunks indexed under other embedding models"""
+    if not single_collection_mode():
+        return
+    doc_id = sanitize_collection_name(filename)
+    for col in _unified_collections(client):
+        other = collection_model(col)
+        if other == model_name or not col.get(where={'doc_id': doc_id}, limit=1, include=[])['ids']:
+            continue
+        print(f"Removing {doc_id} from {col.name}: re-indexed with {model_name}")
+        col.delete(where={'doc_id': doc_id})
+        get_routing_index(model_name=other).remove(doc_id)
+        get_document_registry().remove(col.name, doc_id)
+        invalidate_documents([doc_id])
+        if col.name != cfg.UNIFIED_COLLECTION and col.count() == 0:
+            client.delete_collection(col.name)
+            get_document_registry().drop_collection(col.name)
+
+def query_collection(collection, query_emb, k=5, where: Dict[str, Any] = None):
+    res = collection.query(query_embeddings=[query_emb], n_results=k, where=where, include=['documents','metadatas','distances'])
     docs = res['documents'][0]; metas = res['metadatas'][0]; dists = res['distances'][0]
     return [{'text':d,'meta':m,'score':float(s)} for d,m,s in zip(docs,metas,dists)]
 
-def query_all_collections(client, query_emb, k=5) -> List[Dict[str, Any]]:
-    """Query across all document collections"""
-    all_results = []
-    collections = client.list_collections()
-    
-    for col in collections:
+def _get_fanout_pool():
+    global _fanout_pool
+    if _fanout_pool is None:
+        _fanout_pool = ThreadPoolExecutor(max_workers=cfg.QUERY_FANOUT_WORKERS, thread_name_prefix='chroma-fanout')
+    return _fanout_pool
+
+def _vector_for(query_emb, model_name: str):
+    """query_emb is either one vector or a {model name: vector} dict"""
+    if isinstance(query_emb, dict):
+        return query_emb.get(model_name)
+    return query_emb
+
+def route_documents(query_emb, top_n: int, model_name: str = None) -> List[str]:
+    """Candidate document ids from the routing index (None when routing is off or empty)"""
+    if not top_n or top_n <= 0:
+        return None
+    try:
+        return get_routing_index(model_name=model_name).route(query_emb, top_n)
+    except Exception as e:
+        print(f"Document routing failed, searching all documents: {e}")
+        return None
+
+def _where(*clauses):
+    clauses = [c for c in clauses if c]
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+@metrics.timed('retrieve')
+def query_all_collections(client, query_emb, k=5, source_files: List[str] = None,
+                          deadline_ms: float = None, report: Dict[str, Any] = None,
+                          route_top_n: int = None, cancel_event=None) -> List[Dict[str, Any]]:
+    """Query across all document collections
+
+    query_emb is a single vector, or a dict mapping embedding model name to the query
+    vector for that model; each collection is searched with its own model's vector
+    (collections whose model is missing from the dict are skipped).
+    With route_top_n, only the documents the routing index ranks highest are searched
+    (documents missing from the index are always searched, in either mode).
+    Collections are queried concurrently. Collections that have not answered
+    within deadline_ms are skipped; their names are listed in report['skipped'].
+    Setting cancel_event (a threading.Event) abandons the collections not yet queried.
+    """
+    if report is None:
+        report = {}
+    report.update({'queried': 0, 'skipped': [], 'failed': [], 'routed': {}})
+    routed = {}
+
+    def routed_for(model_name, vec):
+        if model_name not in routed:
+            routed[model_name] = route_documents(vec, route_top_n, model_name)
+            report['routed'][model_name] = routed[model_name]
+        return routed[model_name]
+
+    # (collection, query vector, where filter) for every collection to search
+    targets = []
+    if single_collection_mode():
+        source_clause = {'source_file': {'$in': list(source_files)}} if source_files else None
+        for col in _unified_collections(client):
+            model_name = collection_model(col)
+            vec = _vector_for(query_emb, model_name)
+            if vec is None:
+                continue
+            docs = routed_for(model_name, vec)
+            if docs:
+                # Documents missing from the routing index (indexed before routing, migrated) are always searched
+                index = get_routing_index(model_name=model_name)
+                with index.lock:
+                    known = set(index.doc_ids)
+                docs = docs + [doc_id for doc_id in unified_documents(col) if doc_id not in known]
+            targets.append((col, vec, _where(source_clause, {'doc_id': {'$in': docs}} if docs else None)))
+    else:
+        wanted = {sanitize_collection_name(f) for f in source_files} if source_files else None
+        for col in _document_collections(client):
+            if wanted is not None and col.name not in wanted:
+                continue
+            model_name = collection_model(col)
+            vec = _vector_for(query_emb, model_name)
+            if vec is None:
+                continue
+            docs = routed_for(model_name, vec)
+            if docs and col.name not in docs and col.name in get_routing_index(model_name=model_name):
+                continue
+            targets.append((col, vec, None))
+    report['queried'] = len(targets)
+    if not targets:
+        return []
+
+    if deadline_ms is None:
+        deadline_ms = cfg.QUERY_DEADLINE_MS or None
+    pool = _get_fanout_pool()
+    futures = {pool.submit(query_collection, col, vec, k, where): col.name for col, vec, where in targets}
+    deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms else None
+    done, pending = set(), set(futures)
+    while pending:
+        timeout = 0.05 if cancel_event is not None else None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        finished, pending = wait(pending, timeout=timeout)
+        done |= finished
+        if cancel_event is not None and cancel_event.is_set():
+            for fut in pending:
+                fut.cancel()
+            report['cancelled'] = True
+            return []
+    for fut in pending:
+        fut.cancel()
+        report['skipped'].append(futures[fut])
+    if pending:
+        print(f"query_all_collections: skipped {len(pending)} collections after {deadline_ms}ms: {report['skipped']}")
+
+    # Each per-collection list is already sorted by distance, so merge instead of sorting everything
+    per_collection = []
+    for fut in done:
         try:
-            results = query_collection(col, query_emb, k=k)
-            all_results.extend(results)
+            per_collection.append(fut.result())
         except Exception:
-            continue
-    
-    # Sort by score and return top k
-    all_results.sort(key=lambda x: x['score'])
-    return all_results[:k]
+            report['failed'].append(futures[fut])
+    return list(islice(heapq.merge(*per_collection, key=lambda x: x['score']), k))
+
+def migrate_to_single_collection(client, delete_source: bool = True, batch_size: int = 500,
+                                 chroma_dir: str = None) -> Dict[str, int]:
+    """Fold per-document collections into the unified collection, keeping ids, vectors and metadata.
+
+    Documents the routing index does not know yet get routing vectors from the moved
+    embeddings, so routed queries in single mode still find them.
+    """
+    summary = {'collections': 0, 'chunks': 0}
+    for col in _document_collections(client):
+        model_name = collection_model(col)
+        target = get_unified_collection(client, model_name)
+        centroids = CentroidAccumulator()
+        moved = 0
+        for data in _iter_collection(col, ['documents', 'metadatas', 'embeddings'], batch_size=batch_size):
+            metas = []
+            for meta in data['metadatas']:
+                meta = dict(meta or {})
+                meta.setdefault('source_file', col.name)
+                meta['doc_id'] = col.name
+                metas.append(meta)
+            target.upsert(ids=data['ids'], documents=data['documents'], metadatas=metas, embeddings=data['embeddings'])
+            moved += len(data['ids'])
+            centroids.add(data['embeddings'])
+        # The registry entry is re-scanned on the next listing
+        get_document_registry(chroma_dir).drop_collection(target.name)
+        routing = get_routing_index(chroma_dir, model_name)
+        if col.name not in routing and len(centroids):
+            routing.set_vectors(col.name, centroids.vectors())
+        if delete_source:
+            client.delete_collection(col.name)
+        summary['collections'] += 1
+        summary['chunks'] += moved
+        print(f"Migrated {col.name}: {moved} chunks")
+    return summary
+
+def rebuild_routing_index(client, chroma_dir: str = None, batch_size: int = 1000, single: bool = None) -> int:
+    """Recompute routing vectors for every indexed document from the stored embeddings.
+
+    `single` picks the layout to read (default: the current INDEX_MODE).
+    """
+    if single_collection_mode() if single is None else single:
+        sources = []
+        for col in _unified_collections(client):
+            doc_ids = set()
+            for data in _iter_collection(col, ['metadatas'], batch_size=batch_size):
+                doc_ids.update(meta.get('doc_id') for meta in data['metadatas'] if meta.get('doc_id'))
+            sources.extend((doc_id, col, {'doc_id': doc_id}) for doc_id in sorted(doc_ids))
+    else:
+        sources = [(col.name, col, None) for col in _document_collections(client)]
+    by_model = {}
+    for doc_id, col, where in sources:
+        by_model.setdefault(collection_model(col), []).append((doc_id, col, where))
+    for model_name, docs in by_model.items():
+        index = get_routing_index(chroma_dir, model_name)
+        current = {doc_id for doc_id, _, _ in docs}
+        for doc_id in list(index.doc_ids):
+            if doc_id not in current:
+                index.remove(doc_id)
+        for doc_id, col, where in docs:
+            embs = []
+            for data in _iter_collection(col, ['embeddings'], batch_size=batch_size, where=where):
+                embs.extend(data['embeddings'])
+            index.update(doc_id, embs)
+    return len(sources)
@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+from config import cfg
+
+# One registry per ChromaDB directory
+_registries = {}
+_registries_lock = threading.Lock()
+
+class DocumentRegistry:
+    """Documents stored in each unified collection (INDEX_MODE=single), with their chunk counts.
+
+    Listing documents from the shared collection would page through the metadata of
+    every chunk; the registry answers from a small JSON file instead. It is kept in
+    step by indexing and deletion, and a collection the registry has never seen is
+    scanned once (see db_store.list_all_documents).
+
+    Layout: {collection name: {doc_id: {'display_name': str, 'chunk_count': int}}}.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.collections: Dict[str, Dict[str, dict]] = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.collections = json.load(f)
+        except Exception as e:
+            print(f"Could not load document registry {self.path}: {e}")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.collections, f)
+        os.replace(tmp, self.path)
+
+    def documents(self, collection: str) -> Optional[Dict[str, dict]]:
+        """doc_id -> entry for a collection, or None when it has not been registered yet"""
+        with self.lock:
+            docs = self.collections.get(collection)
+            return None if docs is None else {doc_id: dict(entry) for doc_id, entry in docs.items()}
+
+    def doc_ids(self, collection: str) -> Optional[List[str]]:
+        with self.lock:
+            docs = self.collections.get(collection)
+            return None if docs is None else list(docs)
+
+    def replace(self, collection: str, documents: Dict[str, dict]):
+        """Register a collection's full document list (after a scan or rebuild)"""
+        with self.lock:
+            self.collections[collection] = {doc_id: dict(entry) for doc_id, entry in documents.items()}
+            self._save()
+
+    def set(self, collection: str, doc_id: str, display_name: str, chunk_count: int):
+        """Record one document's chunk count; ignored until the collection is registered"""
+        with self.lock:
+            docs = self.collections.get(collection)
+            if docs is None:
+                return
+            if chunk_count > 0:
+                docs[doc_id] = {'display_name': display_name, 'chunk_count': chunk_count}
+            else:
+                docs.pop(doc_id, None)
+            self._save()
+
+    def remove(self, collection: str, doc_id: str):
+        with self.lock:
+            if doc_id in self.collections.get(collection, {}):
+                del self.collections[collection][doc_id]
+                self._save()
+
+    def drop_collection(self, collection: str):
+        with self.lock:
+            if self.collections.pop(collection, None) is not None:
+                self._save()
+
+def get_document_registry(chroma_dir: str = None) -> DocumentRegistry:
+    path = os.path.join(chroma_dir or cfg.CHROMA_DIR, 'document_registry.json')
+    with _registries_lock:
+        if path not in _registries:
+            _registries[path] = DocumentRegistry(path)
+        return _registries[path]
@@ -0,0 +1,166 @@
+import os
+import re
+import threading
+import numpy as np
+from typing import List, Optional
+from config import cfg
+
+# One routing index per ChromaDB directory and embedding model
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+def representative_vectors(embeddings, n_sections: int = None) -> np.ndarray:
+    """Document centroid plus the centroids of a few contiguous sections of the document"""
+    n_sections = cfg.ROUTE_SECTIONS if n_sections is None else n_sections
+    embs = _normalize(np.asarray(embeddings, dtype=np.float32))
+    reps = [embs.mean(axis=0)]
+    if n_sections > 1 and len(embs) >= 2 * n_sections:
+        reps.extend(part.mean(axis=0) for part in np.array_split(embs, n_sections))
+    return _normalize(np.stack(reps)).astype(np.float32)
+
+class CentroidAccumulator:
+    """Builds representative_vectors() from embeddings streamed in batches.
+
+    Only the sum and count of each batch's unit vectors are kept, so memory grows with
+    the number of batches rather than the number of chunks. Sections are formed from
+    whole batches, which matches the exact split closely once there are a few batches
+    per section.
+    """
+
+    def __init__(self):
+        self._sums: List[np.ndarray] = []
+        self._counts: List[int] = []
+
+    def __len__(self) -> int:
+        return sum(self._counts)
+
+    def add(self, embeddings):
+        if len(embeddings) == 0:
+            return
+        embs = _normalize(np.asarray(embeddings, dtype=np.float32))
+        self._sums.append(embs.sum(axis=0))
+        self._counts.append(len(embs))
+
+    def vectors(self, n_sections: int = None) -> np.ndarray:
+        n_sections = cfg.ROUTE_SECTIONS if n_sections is None else n_sections
+        sums = np.stack(self._sums)
+        total = len(self)
+        reps = [sums.sum(axis=0) / total]
+        if n_sections > 1 and total >= 2 * n_sections and len(sums) >= n_sections:
+            starts = np.cumsum([0] + self._counts[:-1])
+            section = np.minimum(starts * n_sections // total, n_sections - 1)
+            for s in range(n_sections):
+                if (section == s).any():
+                    reps.append(sums[section == s].sum(axis=0))
+        return _normalize(np.stack(reps)).astype(np.float32)
+
+class RoutingIndex:
+    """Compact per-document vectors used to pick candidate documents before vector search.
+
+    Rows of `matrix` are unit vectors; `owners[i]` is the index into `doc_ids` of the
+    document row i belongs to. A document's score is the best cosine over its rows.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.doc_ids: List[str] = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.owners = np.zeros(0, dtype=np.int32)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            data = np.load(self.path, allow_pickle=False)
+            self.doc_ids = [str(d) for d in data['doc_ids']]
+            self.matrix = data['matrix'].astype(np.float32)
+            self.owners = data['owners'].astype(np.int32)
+        except Exception as e:
+            print(f"Could not load routing index {self.path}: {e}")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = self.path + '.tmp.npz'
+        np.savez(tmp, doc_ids=np.array(self.doc_ids, dtype=str), matrix=self.matrix, owners=self.owners)
+        os.replace(tmp, self.path)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.doc_ids
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def _drop(self, doc_id: str):
+        if doc_id not in self.doc_ids:
+            return
+        idx = self.doc_ids.index(doc_id)
+        keep = self.owners != idx
+        self.matrix = self.matrix[keep]
+        owners = self.owners[keep]
+        self.owners = np.where(owners > idx, owners - 1, owners).astype(np.int32)
+        del self.doc_ids[idx]
+
+    def update(self, doc_id: str, embeddings):
+        """Replace the routing vectors for a document from its chunk embeddings"""
+        if len(embeddings) == 0:
+            return
+        self.set_vectors(doc_id, representative_vectors(embeddings))
+
+    def set_vectors(self, doc_id: str, reps: np.ndarray):
+        """Replace the routing vectors for a document with precomputed representatives"""
+        with self.lock:
+            self._drop(doc_id)
+            if self.matrix.size and self.matrix.shape[1] != reps.shape[1]:
+                print(f"Routing index dimension mismatch for {doc_id}; skipping")
+                return
+            self.doc_ids.append(doc_id)
+            self.matrix = reps if not self.matrix.size else np.vstack([self.matrix, reps])
+            self.owners = np.concatenate([self.owners, np.full(len(reps), len(self.doc_ids) - 1, dtype=np.int32)])
+            self._save()
+
+    def remove(self, doc_id: str):
+        with self.lock:
+            if doc_id in self.doc_ids:
+                self._drop(doc_id)
+                self._save()
+
+    def route(self, query_emb, top_n: int) -> Optional[List[str]]:
+        """Return the top_n document ids for the query, or None when the index is empty"""
+        with self.lock:
+            matrix, owners, doc_ids = self.matrix, self.owners, list(self.doc_ids)
+        if not doc_ids:
+            return None
+        q = np.asarray(query_emb, dtype=np.float32)
+        if q.shape[0] != matrix.shape[1]:
+            return None
+        q = q / (np.linalg.norm(q) or 1.0)
+        row_scores = matrix @ q
+        doc_scores = np.full(len(doc_ids), -np.inf, dtype=np.float32)
+        np.maximum.at(doc_scores, owners, row_scores)
+        if top_n >= len(doc_ids):
+            return doc_ids
+        best = np.argpartition(-doc_scores, top_n - 1)[:top_n]
+        best = best[np.argsort(-doc_scores[best])]
+        return [doc_ids[i] for i in best]
+
+def model_slug(model_name: str) -> str:
+    """Short filesystem/collection-safe tag for an embedding model name"""
+    return re.sub(r'[^a-zA-Z0-9]+', '-', model_name.split('/')[-1]).strip('-').lower()
+
+def get_routing_index(chroma_dir: str = None, model_name: str = None) -> RoutingIndex:
+    """Routing index for one embedding model (vectors of different models are not comparable)"""
+    filename = 'routing_index.npz'
+    if model_name and model_name != cfg.HUGGINGFACE_EMBED_MODEL:
+        filename = f'routing_index__{model_slug(model_name)}.npz'
+    path = os.path.join(chroma_dir or cfg.CHROMA_DIR, filename)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = RoutingIndex(path)
+        return _indexes[path]
@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterable, Iterator, List
+import numpy as np
+from config import cfg
+
+def _init_worker(threads: int):
+    """Pin the math libraries of one worker to `threads` threads before torch/onnxruntime is loaded"""
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    if cfg.EMBED_BACKEND == 'onnx':
+        cfg.ONNX_THREADS = threads
+        return
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+def _encode(texts: List[str], model_name: str, batch_size: int) -> np.ndarray:
+    """Runs inside a worker; the model stays loaded in the worker's own registry"""
+    from embeddings import _get_model
+    model = _get_model(model_name)
+    return model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True).astype(np.float32)
+
+class EmbeddingWorkerPool:
+    """Process pool for ingestion-time embedding.
+
+    Each worker loads its own copy of the model and is pinned to `threads` torch/BLAS
+    threads, so N workers use N x threads cores without oversubscribing them.
+    """
+
+    def __init__(self, workers: int, threads: int = None, batch_size: int = 32):
+        self.workers = workers
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        self.batch_size = batch_size
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_worker, initargs=(self.threads,))
+
+    def submit(self, texts: List[str], model_name: str) -> Future:
+        """Future of a float32 array with one row per text"""
+        return self._pool.submit(_encode, list(texts), model_name, self.batch_size)
+
+    def embed_ordered(self, batches: Iterable[List[str]], model_name: str, in_flight: int = None) -> Iterator[np.ndarray]:
+        """Encode batches across the workers, yielding each batch's vectors in input order"""
+        in_flight = in_flight or 2 * self.workers
+        pending = deque()
+        for batch in batches:
+            pending.append(self.submit(batch, model_name))
+            if len(pending) >= in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def warmup(self, model_name: str):
+        """Load the model in every worker (one call per worker, submitted together)"""
+        futures = [self.submit(['warmup'], model_name) for _ in range(self.workers)]
+        for f in futures:
+            f.result()
+
+    def shutdown(self):
+        self._pool.shutdown(cancel_futures=True)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_embedding_workers():
+    """Shared ingestion worker pool, or None when INGEST_EMBED_WORKERS leaves embedding in-process"""
+    global _pool
+    if cfg.INGEST_EMBED_WORKERS <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = EmbeddingWorkerPool(cfg.INGEST_EMBED_WORKERS, cfg.INGEST_EMBED_THREADS or None)
+        return _pool
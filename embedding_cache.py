@@ -0,0 +1,123 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+from config import cfg
+import metrics
+
+# Rough per-entry overhead of the OrderedDict slot, key tuple and ndarray header
+_ENTRY_OVERHEAD = 200
+
+def text_key(model_name: str, text: str):
+    return (model_name, hashlib.sha256(text.encode('utf-8')).hexdigest())
+
+class EmbeddingCache:
+    """Per-text embedding cache keyed by (model name, SHA-256 of the text).
+
+    Tier 1 is an in-process LRU bounded by bytes; tier 2 is an SQLite file storing
+    float16 vectors so cached embeddings survive restarts. Disk hits are promoted to
+    memory. Vectors read back from disk carry float16 precision (~1e-3 relative error).
+    """
+
+    def __init__(self, max_bytes: int, db_path: str = None):
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self._lru = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS embeddings ('
+                             'model TEXT NOT NULL, text_hash TEXT NOT NULL, vec BLOB NOT NULL, '
+                             'PRIMARY KEY (model, text_hash))')
+            self._db.commit()
+
+    def _count(self, stat: str, n: int = 1):
+        if n:
+            self.stats[stat] += n
+            metrics.inc('embedding_cache_events_total', n, event=stat)
+
+    def _remember(self, key, vec: np.ndarray):
+        """Insert into the LRU tier; caller holds the lock"""
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            return
+        size = vec.nbytes + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        self._lru[key] = vec
+        self._bytes += size
+        evicted = 0
+        while self._bytes > self.max_bytes:
+            _, old = self._lru.popitem(last=False)
+            self._bytes -= old.nbytes + _ENTRY_OVERHEAD
+            evicted += 1
+        self._count('evictions', evicted)
+
+    def get_many(self, model_name: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [text_key(model_name, t) for t in texts]
+        found: List[Optional[np.ndarray]] = [None] * len(texts)
+        disk_lookup = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._lru.get(key)
+                if vec is not None:
+                    self._lru.move_to_end(key)
+                    found[i] = vec
+                else:
+                    disk_lookup.setdefault(key[1], []).append(i)
+            self._count('memory_hits', len(texts) - sum(len(v) for v in disk_lookup.values()))
+            if self._db is not None and disk_lookup:
+                hashes = list(disk_lookup)
+                for start in range(0, len(hashes), 500):
+                    part = hashes[start:start + 500]
+                    rows = self._db.execute(
+                        f"SELECT text_hash, vec FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(part))})",
+                        [model_name, *part]).fetchall()
+                    for text_hash, blob in rows:
+                        vec = np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+                        self._remember((model_name, text_hash), vec)
+                        for i in disk_lookup.pop(text_hash):
+                            found[i] = vec
+                            self._count('disk_hits')
+            self._count('misses', sum(len(v) for v in disk_lookup.values()))
+        return found
+
+    def put_many(self, model_name: str, texts: List[str], vectors):
+        rows = []
+        with self._lock:
+            for text, vec in zip(texts, vectors):
+                key = text_key(model_name, text)
+                vec = np.asarray(vec, dtype=np.float32)
+                self._remember(key, vec)
+                rows.append((model_name, key[1], vec.astype(np.float16).tobytes()))
+            if self._db is not None and rows:
+                self._db.executemany('INSERT OR REPLACE INTO embeddings (model, text_hash, vec) VALUES (?, ?, ?)', rows)
+                self._db.commit()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, entries=len(self._lru), memory_bytes=self._bytes, max_bytes=self.max_bytes)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            db_path = None
+            if cfg.EMBED_CACHE_DISK:
+                db_path = cfg.EMBED_CACHE_PATH or os.path.join(cfg.CHROMA_DIR, 'embedding_cache.sqlite')
+            _cache = EmbeddingCache(int(cfg.EMBED_CACHE_MB * 1024 * 1024), db_path)
+        return _cache
+
+metrics.describe('embedding_cache_events_total', 'Embedding cache lookups and evictions (memory_hits, disk_hits, misses, evictions)')
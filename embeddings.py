@@ -1,10 +1,17 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from typing import List
-import hashlib
 from config import cfg
+from embedding_cache import get_embedding_cache
+import metrics
 
-# lazy import to speed startup
-_model = None
-_cache = {}
+# Loaded SentenceTransformer models: name -> {'model', 'bytes', 'load_seconds'}, in LRU order.
+# Models are imported lazily to speed startup.
+_models = OrderedDict()
+_models_lock = threading.Lock()
+_load_locks = {}
 
 # Available Hugging Face models for different use cases
 AVAILABLE_MODELS = {
@@ -14,30 +21,147 @@ AVAILABLE_MODELS = {
     'accurate': 'sentence-transformers/all-mpnet-base-v2',  # More accurate but slower
 }
 
-def _cache_key(texts: List[str]) -> str:
-    return hashlib.sha256(("||".join(texts)).encode()).hexdigest()
+def resolve_model_name(model_name: str = None) -> str:
+    """Accept an AVAILABLE_MODELS key or a full Hugging Face model name"""
+    if not model_name:
+        return cfg.HUGGINGFACE_EMBED_MODEL
+    return AVAILABLE_MODELS.get(model_name, model_name)
+
+def _model_bytes(model) -> int:
+    if hasattr(model, 'nbytes'):
+        return model.nbytes
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+def _cache_name(model_name: str) -> str:
+    """Embedding cache namespace: int8 ONNX vectors are close to, not equal to, torch vectors"""
+    return f"{model_name}#onnx-int8" if cfg.EMBED_BACKEND == 'onnx' else model_name
+
+def _load_model(model_name: str):
+    if cfg.EMBED_BACKEND == 'onnx':
+        from onnx_backend import OnnxEncoder
+        return OnnxEncoder(model_name)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+def _evict_models(keep: str):
+    """Drop least recently used models until the registry fits EMBED_MODEL_CACHE_MB; caller holds the lock"""
+    budget = cfg.EMBED_MODEL_CACHE_MB * 1024 * 1024
+    while len(_models) > 1 and sum(m['bytes'] for m in _models.values()) > budget:
+        name = next(iter(_models))
+        if name == keep:
+            _models.move_to_end(name)
+            continue
+        evicted = _models.pop(name)
+        metrics.inc('embedding_model_evictions_total', model=name)
+        print(f"Evicted embedding model {name} ({evicted['bytes'] / 2**20:.0f} MB)")
 
 def _get_model(model_name: str = None):
-    global _model
-    model_name = model_name or cfg.HUGGINGFACE_EMBED_MODEL
-    if _model is None:
-        from sentence_transformers import SentenceTransformer
-        _model = SentenceTransformer(model_name)
-    return _model
+    model_name = resolve_model_name(model_name)
+    with _models_lock:
+        entry = _models.get(model_name)
+        if entry is not None:
+            _models.move_to_end(model_name)
+            return entry['model']
+        load_lock = _load_locks.setdefault(model_name, threading.Lock())
+    # Load outside the registry lock so other models stay usable meanwhile
+    with load_lock:
+        with _models_lock:
+            if model_name in _models:
+                return _models[model_name]['model']
+        started = time.perf_counter()
+        model = _load_model(model_name)
+        load_seconds = time.perf_counter() - started
+        entry = {'model': model, 'bytes': _model_bytes(model), 'load_seconds': load_seconds}
+        with _models_lock:
+            _models[model_name] = entry
+            _evict_models(keep=model_name)
+    metrics.inc('embedding_model_loads_total', model=model_name)
+    metrics.inc('embedding_model_load_seconds_total', load_seconds, model=model_name)
+    print(f"Loaded embedding model {model_name} in {load_seconds:.1f}s ({entry['bytes'] / 2**20:.0f} MB)")
+    return model
 
+def loaded_models() -> List[dict]:
+    """Currently loaded embedding models, least recently used first"""
+    with _models_lock:
+        return [{'model': name, 'bytes': m['bytes'], 'load_seconds': round(m['load_seconds'], 3)}
+                for name, m in _models.items()]
+
+@metrics.timed('embed')
 def embed_texts(texts: List[str], batch_size: int = 32, model_name: str = None) -> List[List[float]]:
-    """Embed texts using Hugging Face models. Supports multiple model types."""
-    key = _cache_key(texts)
-    if key in _cache: return _cache[key]
+    """Embed texts using Hugging Face models. Supports multiple model types.
+
+    Each text is looked up in the embedding cache; only the misses are encoded.
+    """
+    model_name = resolve_model_name(model_name)
+    cache = get_embedding_cache()
+    vectors = cache.get_many(_cache_name(model_name), texts)
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+    if missing:
+        model = _get_model(model_name)
+        encoded = {}
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i+batch_size]
+            e = model.encode(batch, show_progress_bar=False, convert_to_numpy=True)
+            cache.put_many(_cache_name(model_name), batch, e)
+            encoded.update(zip(batch, e))
+        vectors = [encoded[t] if v is None else v for t, v in zip(texts, vectors)]
+    return [v.tolist() for v in vectors]
+
+def submit_embed(texts: List[str], model_name: str = None, workers=None) -> Future:
+    """Future of embed_texts(texts) whose cache misses are encoded on an EmbeddingWorkerPool.
+
+    Without `workers` the texts are embedded in the calling thread and the returned
+    future is already done.
+    """
+    model_name = resolve_model_name(model_name)
+    result = Future()
+    if workers is None:
+        try:
+            result.set_result(embed_texts(texts, model_name=model_name))
+        except Exception as e:
+            result.set_exception(e)
+        return result
+    cache = get_embedding_cache()
+    vectors = cache.get_many(_cache_name(model_name), texts)
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+    if not missing:
+        result.set_result([v.tolist() for v in vectors])
+        return result
+
+    def done(future: Future):
+        try:
+            encoded = future.result()
+            cache.put_many(_cache_name(model_name), missing, encoded)
+            lookup = dict(zip(missing, encoded))
+            result.set_result([(lookup[t] if v is None else v).tolist() for t, v in zip(texts, vectors)])
+        except BaseException as e:
+            result.set_exception(e)
+
+    workers.submit(missing, model_name).add_done_callback(done)
+    return result
+
+def max_tokens(model_name: str = None) -> int:
+    """Content tokens the model embeds before truncating (sequence length minus special tokens)"""
     model = _get_model(model_name)
-    embs = []
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i+batch_size]
-        e = model.encode(batch, show_progress_bar=False, convert_to_numpy=True)
-        embs.extend(e.tolist())
-    _cache[key] = embs
-    return embs
+    return model.max_seq_length - model.tokenizer.num_special_tokens_to_add()
+
+def count_tokens(texts: List[str], model_name: str = None) -> List[int]:
+    """Length of each text in the model's own tokenizer (without special tokens)"""
+    if not texts:
+        return []
+    tokenizer = _get_model(model_name).tokenizer
+    encoded = tokenizer(list(texts), add_special_tokens=False, return_attention_mask=False,
+                        return_token_type_ids=False, verbose=False)
+    return [len(ids) for ids in encoded['input_ids']]
+
+def get_cache_stats() -> dict:
+    """Hit/miss/eviction counters and size of the embedding cache"""
+    return get_embedding_cache().snapshot()
 
 def get_available_models():
     """Return list of available Hugging Face models"""
     return AVAILABLE_MODELS
+
+metrics.describe('embedding_model_loads_total', 'Embedding model loads')
+metrics.describe('embedding_model_load_seconds_total', 'Time spent loading embedding models')
+metrics.describe('embedding_model_evictions_total', 'Embedding models evicted from the registry')
@@ -0,0 +1,120 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from config import cfg
+import metrics
+
+# Dedicated, sized pools so blocking work never runs on the asyncio event loop:
+#   embed  - SentenceTransformer encode / PDF indexing (CPU bound)
+#   chroma - ChromaDB reads and writes (blocking I/O)
+# OpenRouter calls are already async; their admission is llm_scheduler.LLMScheduler.
+
+class Overloaded(Exception):
+    """A pool or limiter is full; callers should retry after `retry_after` seconds"""
+
+    def __init__(self, resource: str, retry_after: float = None, status_code: int = 503):
+        self.resource = resource
+        self.retry_after = cfg.OVERLOAD_RETRY_AFTER if retry_after is None else retry_after
+        self.status_code = status_code
+        super().__init__(f"Server busy ({resource}), retry in {self.retry_after:g}s")
+
+class BoundedExecutor:
+    """Thread pool that rejects work instead of queueing without limit"""
+
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.capacity = workers + queue_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'{name}-pool')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _done(self, _):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        with self._lock:
+            if self._pending >= self.capacity:
+                metrics.inc('executor_rejected_total', pool=self.name)
+                raise Overloaded(self.name)
+            self._pending += 1
+        try:
+            # Carry the caller's context so per-request stage timings follow the work
+            future = self._pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+class ConcurrencyLimiter:
+    """Caps in-flight work; waits for a slot only while fewer than queue_size are already waiting"""
+
+    def __init__(self, name: str, limit: int, queue_size: int = 0, status_code: int = 503):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.status_code = status_code
+        self._active = 0
+        self._waiting = 0
+        self._cond = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self):
+        cond = self._condition()
+        async with cond:
+            if self._active >= self.limit and self._waiting >= self.queue_size:
+                metrics.inc('executor_rejected_total', pool=self.name)
+                raise Overloaded(self.name, status_code=self.status_code)
+            self._waiting += 1
+            try:
+                await cond.wait_for(lambda: self._active < self.limit)
+            finally:
+                self._waiting -= 1
+            self._active += 1
+
+    async def release(self):
+        cond = self._condition()
+        async with cond:
+            self._active -= 1
+            cond.notify()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.release()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _get(name: str, factory):
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = factory()
+        return _pools[name]
+
+def embed_pool() -> BoundedExecutor:
+    return _get('embed', lambda: BoundedExecutor('embed', cfg.EMBED_WORKERS, cfg.EMBED_QUEUE))
+
+def chroma_pool() -> BoundedExecutor:
+    return _get('chroma', lambda: BoundedExecutor('chroma', cfg.CHROMA_WORKERS, cfg.CHROMA_QUEUE))
+
+def chat_limiter() -> ConcurrencyLimiter:
+    """Admission control for /chat requests; rejects with 429 instead of queueing"""
+    return _get('chat', lambda: ConcurrencyLimiter('chat', cfg.MAX_CONCURRENT_CHATS, 0, status_code=429))
+
+metrics.describe('executor_rejected_total', 'Work rejected because a pool or limiter was full')
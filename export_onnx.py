@@ -0,0 +1,67 @@
+# Script to export a model to int8 ONNX for EMBED_BACKEND=onnx / RERANK_BACKEND=onnx
+#
+#   python export_onnx.py --model sentence-transformers/all-MiniLM-L6-v2
+#   python export_onnx.py --model cross-encoder/ms-marco-MiniLM-L-6-v2 --cross-encoder
+#
+# Export needs optimum[exporters] (and so torch) once; serving only needs onnxruntime and tokenizers.
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+from config import cfg
+from onnx_backend import MODEL_FILE, model_dir
+
+def sentence_transformer_settings(model_name: str) -> dict:
+    """Pooling, normalization and max length from the sentence-transformers config files"""
+    from huggingface_hub import snapshot_download
+    path = snapshot_download(model_name, allow_patterns=['modules.json', 'sentence_bert_config.json', '1_Pooling/config.json'])
+    settings = {'pooling': 'mean', 'normalize': False, 'max_seq_length': 512}
+    modules_path = os.path.join(path, 'modules.json')
+    if os.path.exists(modules_path):
+        with open(modules_path) as f:
+            settings['normalize'] = any(m['type'].endswith('Normalize') for m in json.load(f))
+    pooling_path = os.path.join(path, '1_Pooling', 'config.json')
+    if os.path.exists(pooling_path):
+        with open(pooling_path) as f:
+            pooling = json.load(f)
+        settings['pooling'] = 'cls' if pooling.get('pooling_mode_cls_token') else 'mean'
+    bert_path = os.path.join(path, 'sentence_bert_config.json')
+    if os.path.exists(bert_path):
+        with open(bert_path) as f:
+            settings['max_seq_length'] = json.load(f).get('max_seq_length', settings['max_seq_length'])
+    return settings
+
+def export(model_name: str, cross_encoder: bool = False):
+    from optimum.exporters.onnx import main_export
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    out_dir = model_dir(model_name)
+    os.makedirs(out_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Exporting {model_name} to ONNX...")
+        main_export(model_name, output=tmp, task='text-classification' if cross_encoder else 'feature-extraction')
+        print("Quantizing weights to int8...")
+        quantize_dynamic(os.path.join(tmp, 'model.onnx'), os.path.join(out_dir, MODEL_FILE), weight_type=QuantType.QInt8)
+        shutil.copy(os.path.join(tmp, 'tokenizer.json'), os.path.join(out_dir, 'tokenizer.json'))
+        if cross_encoder:
+            with open(os.path.join(tmp, 'config.json')) as f:
+                max_len = min(json.load(f).get('max_position_embeddings', 512), 512)
+            settings = {'kind': 'cross-encoder', 'pooling': None, 'normalize': False, 'max_seq_length': max_len}
+        else:
+            settings = {'kind': 'encoder', **sentence_transformer_settings(model_name)}
+    with open(os.path.join(out_dir, 'encoder.json'), 'w') as f:
+        json.dump(settings, f, indent=2)
+    size = os.path.getsize(os.path.join(out_dir, MODEL_FILE)) / 2**20
+    print(f"Wrote {out_dir} ({size:.1f} MB, {settings})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a model to int8 ONNX")
+    parser.add_argument("--model", default=cfg.HUGGINGFACE_EMBED_MODEL)
+    parser.add_argument("--cross-encoder", action="store_true", help="Export a reranking cross-encoder")
+    args = parser.parse_args()
+    export(args.model, args.cross_encoder)
+
+if __name__ == "__main__":
+    main()
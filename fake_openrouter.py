@@ -0,0 +1,125 @@
+# Script to run a local stand-in for the OpenRouter chat completions API
+#
+#   python fake_openrouter.py --port 8099 --model primary:0.2:0.1:5 --model fallback:0.5
+#   OPENROUTER_BASE_URL=http://127.0.0.1:8099 LLM_MODEL=primary LLM_FALLBACK_MODEL=fallback python -m uvicorn ...
+#
+# Each --model is name:ttft[:slow_rate:slow_ttft[:fail_rate]] in seconds: the time to the first
+# token is ttft, or slow_ttft for a slow_rate share of requests; a fail_rate share answers 503
+# (models passed to FakeOpenRouter directly may set 'fail_status': 429 and 'retry_after').
+# Unknown models answer like "default". Both plain and streamed (SSE) completions are served.
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = "The tenant must give ninety days written notice before terminating the lease [src:0]."
+
+def parse_model(spec: str):
+    name, *values = spec.split(':')
+    values = [float(v) for v in values][:4]
+    ttft, slow_rate, slow_ttft, fail_rate = values + [0.0] * (4 - len(values))
+    return name, {'ttft': ttft, 'slow_rate': slow_rate, 'slow_ttft': slow_ttft, 'fail_rate': fail_rate}
+
+class FakeOpenRouter:
+    """Threaded HTTP server answering /chat/completions with per-model latency and failures"""
+
+    def __init__(self, models: dict, port: int = 0, token_delay: float = 0.005):
+        self.models = {'default': {'ttft': 0.05, 'slow_rate': 0.0, 'slow_ttft': 0.0, 'fail_rate': 0.0}, **models}
+        self.token_delay = token_delay
+        self.requests = {}
+        self.cancelled = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def _count(self, counts: dict, model: str):
+        with self._lock:
+            counts[model] = counts.get(model, 0) + 1
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.endswith('/chat/completions'):
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                model = body.get('model', 'default')
+                behaviour = fake.models.get(model, fake.models['default'])
+                fake._count(fake.requests, model)
+                if random.random() < behaviour['fail_rate']:
+                    status = behaviour.get('fail_status', 503)
+                    headers = {'Retry-After': str(behaviour.get('retry_after', 1))} if status == 429 else {}
+                    self._send(status, 'application/json', json.dumps({'error': {'message': 'overloaded'}}).encode(), headers)
+                    return
+                slow = random.random() < behaviour['slow_rate']
+                time.sleep(behaviour['slow_ttft'] if slow else behaviour['ttft'])
+                answer = f"{ANSWER} ({model})"
+                if not body.get('stream'):
+                    self._send(200, 'application/json', json.dumps(
+                        {'model': model, 'choices': [{'message': {'role': 'assistant', 'content': answer}}]}).encode())
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    for word in answer.split(' '):
+                        chunk = {'model': model, 'choices': [{'delta': {'content': word + ' '}}]}
+                        self._chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                        time.sleep(fake.token_delay)
+                    self._chunk(b"data: [DONE]\n\n")
+                    self._chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    fake._count(fake.cancelled, model)
+
+            def _chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def _send(self, status: int, content_type: str, data: bytes, headers: dict = None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def start(self) -> 'FakeOpenRouter':
+        threading.Thread(target=self.server.serve_forever, name='fake-openrouter', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake OpenRouter server")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--model", action="append", default=[], help="name:ttft[:slow_rate:slow_ttft[:fail_rate]]")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="Seconds between streamed tokens")
+    args = parser.parse_args()
+    fake = FakeOpenRouter(dict(parse_model(m) for m in args.model), args.port, args.token_delay)
+    print(f"Fake OpenRouter on {fake.url} (set OPENROUTER_BASE_URL to this)")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
+
+if __name__ == "__main__":
+    main()
@@ -73,13 +73,24 @@ export const Chat: React.FC = () => {
 
     setIsUploading(true);
     try {
-      await documentService.upload(file);
-      const systemMsg: Message = {
+      const upload = await documentService.upload(file);
+      const queuedMsg: Message = {
         id: Date.now().toString(),
         role: 'assistant',
-        content: `Successfully uploaded and indexed document: ${file.name}. You can now ask questions about it.`
+        content: `Uploaded ${file.name}; it is queued for indexing. I'll let you know when it is ready.`
       };
-      setMessages(prev => [...prev, systemMsg]);
+      setMessages(prev => [...prev, queuedMsg]);
+      if (upload.job_id) {
+        const job = await documentService.waitForJob(upload.job_id);
+        const doneMsg: Message = {
+          id: Date.now().toString(),
+          role: 'assistant',
+          content: job.status === 'done'
+            ? `Finished indexing ${file.name}. You can now ask questions about it.`
+            : `Indexing ${file.name} failed: ${job.error || 'unknown error'}`
+        };
+        setMessages(prev => [...prev, doneMsg]);
+      }
     } catch (error) {
       console.error('Upload error:', error);
       const errorMsg: Message = {
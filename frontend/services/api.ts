@@ -84,6 +84,22 @@ export const documentService = {
         return response.data;
     },
 
+    jobStatus: async (jobId: string) => {
+        const response = await api.get(`/documents/jobs/${jobId}`);
+        return response.data;
+    },
+
+    // Poll an ingestion job until it is done or failed
+    waitForJob: async (jobId: string, intervalMs: number = 2000) => {
+        while (true) {
+            const job = await documentService.jobStatus(jobId);
+            if (job.status === 'done' || job.status === 'failed') {
+                return job;
+            }
+            await new Promise(resolve => setTimeout(resolve, intervalMs));
+        }
+    },
+
     list: async () => {
         const response = await api.get('/documents/list');
         return response.data;
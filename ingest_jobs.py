@@ -0,0 +1,211 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Optional
+from config import cfg
+import metrics
+
+# Per-stage counters reported while a job runs
+STAGES = ('pages_total', 'pages_extracted', 'pages_failed', 'chunks_total', 'chunks_reused', 'chunks_embedded', 'vectors_written')
+
+class IngestJob:
+    """One spooled upload waiting for, or going through, index_file_bytes"""
+
+    def __init__(self, job_id: str, filename: str, path: str, model_name: str = None):
+        self.id = job_id
+        self.filename = filename
+        self.path = path
+        self.model_name = model_name
+        self.status = 'queued'
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.progress: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self.result: Dict[str, int] = {}
+        self.future: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    def update(self, **counts):
+        """Progress callback passed to index_file_bytes"""
+        with self._lock:
+            for stage, value in counts.items():
+                if stage in self.progress:
+                    self.progress[stage] = value
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            progress = dict(self.progress)
+        end = self.finished or time.time()
+        elapsed = end - self.started if self.started else 0.0
+        throughput = {}
+        if elapsed > 0:
+            throughput = {
+                'pages_per_sec': round(progress['pages_extracted'] / elapsed, 2),
+                'chunks_per_sec': round(progress['chunks_embedded'] / elapsed, 2),
+            }
+        return {
+            'job_id': self.id,
+            'filename': self.filename,
+            'model': self.model_name,
+            'status': self.status,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'elapsed_seconds': round(elapsed, 3),
+            'progress': progress,
+            'throughput': throughput,
+            'result': dict(self.result),
+        }
+
+    def _meta(self) -> dict:
+        return {'job_id': self.id, 'filename': self.filename, 'model': self.model_name, 'created': self.created}
+
+class IngestQueue:
+    """Spools uploads to disk and indexes them on a worker pool.
+
+    Spooled files are removed once indexed. A job that fails has its file moved to
+    the failed/ subdirectory with the error in its metadata, so a PDF that cannot be
+    indexed is kept for inspection but not retried. Files left behind by a restart
+    are picked up again by recover().
+    """
+
+    def __init__(self, spool_dir: str, workers: int, history: int):
+        self.spool_dir = spool_dir
+        self.history = history
+        self._jobs: 'OrderedDict[str, IngestJob]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest')
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def _spool_path(self, job_id: str) -> str:
+        return os.path.join(self.spool_dir, f'{job_id}.pdf')
+
+    def _quarantine(self, job: IngestJob):
+        """Move a failed job's spooled files out of recover()'s way, recording the error"""
+        failed_dir = os.path.join(self.spool_dir, 'failed')
+        try:
+            os.makedirs(failed_dir, exist_ok=True)
+            path = os.path.join(failed_dir, os.path.basename(job.path))
+            with open(path + '.json', 'w') as f:
+                json.dump({**job._meta(), 'status': job.status, 'error': job.error, 'finished': time.time()}, f)
+            os.replace(job.path, path)
+            os.remove(job.path + '.json')
+        except OSError as e:
+            print(f"Could not move failed ingestion job {job.id} to {failed_dir}: {e}")
+
+    def _enqueue(self, job: IngestJob) -> IngestJob:
+        with open(job.path + '.json', 'w') as f:
+            json.dump(job._meta(), f)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        job.future = self._pool.submit(self._run, job)
+        metrics.inc('ingest_jobs_total', status='queued')
+        return job
+
+    def submit_file(self, fileobj, filename: str, model_name: str = None) -> IngestJob:
+        """Copy a file object to the spool directory and queue it"""
+        job_id = uuid.uuid4().hex
+        path = self._spool_path(job_id)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(fileobj, f)
+        return self._enqueue(IngestJob(job_id, filename, path, model_name))
+
+    def submit_bytes(self, file_bytes: bytes, filename: str, model_name: str = None) -> IngestJob:
+        job_id = uuid.uuid4().hex
+        path = self._spool_path(job_id)
+        with open(path, 'wb') as f:
+            f.write(file_bytes)
+        return self._enqueue(IngestJob(job_id, filename, path, model_name))
+
+    def _trim(self):
+        """Forget the oldest finished jobs beyond the history limit; caller holds the lock"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ('done', 'failed')]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: IngestJob):
+        from pipeline import index_file_bytes
+        job.status = 'running'
+        job.started = time.time()
+        try:
+            with open(job.path, 'rb') as f:
+                file_bytes = f.read()
+            stats = {}
+            index_file_bytes(file_bytes, job.filename, model_name=job.model_name, progress=job.update, stats=stats)
+            job.result = {key: stats[key] for key in ('chunk_count', 'chunks_reused', 'chunks_embedded', 'chunks_deleted',
+                                                      'unchanged', 'tokens_total', 'tokens_truncated')}
+            if not stats['unchanged']:
+                metrics.inc('ingest_tokens_total', stats['tokens_total'])
+                metrics.inc('ingest_tokens_truncated_total', stats['tokens_truncated'])
+            job.status = 'done'
+            for suffix in ('', '.json'):
+                try:
+                    os.remove(job.path + suffix)
+                except OSError:
+                    pass
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            print(f"Ingestion job {job.id} ({job.filename}) failed: {e}")
+            self._quarantine(job)
+        finally:
+            job.finished = time.time()
+            metrics.inc('ingest_jobs_total', status=job.status)
+            metrics.inc('ingest_pages_total', job.progress['pages_extracted'])
+            metrics.inc('ingest_chunks_total', job.progress['vectors_written'])
+            metrics.inc('ingest_seconds_total', job.finished - job.started)
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[IngestJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def recover(self) -> int:
+        """Re-queue uploads spooled before a restart (failed ones stay in failed/)"""
+        count = 0
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith('.pdf.json'):
+                continue
+            meta_path = os.path.join(self.spool_dir, name)
+            path = meta_path[:-len('.json')]
+            if not os.path.exists(path):
+                os.remove(meta_path)
+                continue
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if self.get(meta['job_id']) is not None:
+                continue
+            job = IngestJob(meta['job_id'], meta['filename'], path, meta.get('model'))
+            job.created = meta.get('created', job.created)
+            self._enqueue(job)
+            count += 1
+        return count
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_ingest_queue() -> IngestQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            spool_dir = cfg.INGEST_SPOOL_DIR or os.path.join(cfg.CHROMA_DIR, 'ingest_spool')
+            _queue = IngestQueue(spool_dir, cfg.INGEST_WORKERS, cfg.INGEST_JOB_HISTORY)
+        return _queue
+
+metrics.describe('ingest_jobs_total', 'Ingestion jobs by status transition')
+metrics.describe('ingest_pages_total', 'PDF pages extracted by ingestion jobs')
+metrics.describe('ingest_chunks_total', 'Chunks written to Chroma by ingestion jobs')
+metrics.describe('ingest_seconds_total', 'Wall time spent running ingestion jobs')
+metrics.describe('ingest_tokens_total', 'Tokens in chunks produced by ingestion jobs')
+metrics.describe('ingest_tokens_truncated_total', "Chunk tokens beyond the embedding model's limit (dropped by the encoder)")
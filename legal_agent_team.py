@@ -4,6 +4,7 @@ from agno.models.openai import OpenAIChat
 import tempfile
 import os
 from pypdf import PdfReader
+from pdf_extract import extract_pages
 import chromadb
 from chromadb.config import Settings
 import hashlib
@@ -218,16 +219,13 @@ def extract_pdf_with_metadata(file_path: str) -> Dict:
             'author': reader.metadata.get('/Author', 'Unknown') if reader.metadata else 'Unknown',
             'processed_date': datetime.now().isoformat()
         }
-        pages_text = []
-        for i, page in enumerate(reader.pages):
-            try:
-                text = page.extract_text() or ""
-            except Exception as e:
-                st.warning(f"Error extracting page {i+1}: {str(e)}")
-                text = ""
-            pages_text.append({'page_num': i + 1, 'text': text, 'char_count': len(text)})
-        full_text = "\n\n".join([p['text'] for p in pages_text])
-        return {'text': full_text, 'pages': pages_text, 'metadata': metadata}
+    pages_text = []
+    for page in extract_pages(file_path):
+        if page['error']:
+            st.warning(f"Error extracting page {page['page_num']}: {page['error']}")
+        pages_text.append({'page_num': page['page_num'], 'text': page['text'], 'char_count': len(page['text'])})
+    full_text = "\n\n".join([p['text'] for p in pages_text])
+    return {'text': full_text, 'pages': pages_text, 'metadata': metadata}
 
 # ============================================================================
 # STORE DOC IN CHROMADB
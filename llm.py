@@ -1,27 +1,331 @@
-import requests
+import asyncio
+import json
+import queue
+import threading
 import time
+from email.utils import parsedate_to_datetime
+import httpx
 from config import cfg
+from llm_scheduler import INTERACTIVE, BATCH, LLMError, UpstreamUnavailable, get_scheduler
+import metrics
 
-def chat(prompt: str, max_tokens: int = 2048) -> str:
-    body = {'model': cfg.LLM_MODEL, 'messages':[{'role':'user','content':prompt}], 'max_tokens': max_tokens}
-    
-    # Try with retries and exponential backoff
-    for attempt in range(3):
+# The HTTP client and its connection pool live on one background event loop so sync
+# callers (pipeline.run_rag, scripts) and async callers (FastAPI routes) share keep-alive
+# connections instead of opening a new one per request.
+_loop = None
+_client = None
+_lock = threading.Lock()
+
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='llm-loop', daemon=True).start()
+            _loop = loop
+    return _loop
+
+def _get_client() -> httpx.AsyncClient:
+    """Pooled client; only called from the background loop"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=cfg.OPENROUTER_BASE_URL,
+            http2=_http2_available(),
+            timeout=httpx.Timeout(cfg.LLM_TIMEOUT, connect=cfg.LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=cfg.LLM_MAX_CONNECTIONS,
+                                max_keepalive_connections=cfg.LLM_MAX_CONNECTIONS),
+        )
+    return _client
+
+def _headers() -> dict:
+    return {
+        'Authorization': f'Bearer {cfg.OPENROUTER_API_KEY}',
+        'Content-Type': 'application/json',
+        'HTTP-Referer': 'http://localhost:3000', # Optional, for including your app on openrouter.ai rankings.
+        'X-Title': 'Legal Agent RAG', # Optional. Shows in rankings on openrouter.ai.
+    }
+
+def retry_after_seconds(response: httpx.Response):
+    """Parse a Retry-After header (seconds or HTTP date); None when absent or invalid"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _backoff(attempt: int, response: httpx.Response = None) -> float:
+    delay = retry_after_seconds(response)
+    if delay is None:
+        delay = 2 ** attempt  # Wait 1s, then 2s, then 4s
+    return min(delay, cfg.LLM_MAX_BACKOFF)
+
+def _error_message(attempts: int, e: Exception) -> str:
+    return f"Error calling OpenRouter API after {attempts} attempts: {str(e)}. Please check: 1) Internet connection, 2) API key validity at https://openrouter.ai/keys"
+
+async def _call(model: str, priority: int, attempt, may_retry=lambda: True):
+    """Run attempt(model) under the scheduler, retrying what upstream says is transient.
+
+    At most LLM_MAX_ATTEMPTS tries are made. 429s pause the model's token bucket for
+    Retry-After (every queued request for the model waits, not just this one, and
+    without holding a concurrency slot). Timeouts, connection errors and 5xx count
+    against the model's circuit breaker and are retried with backoff. Raises LLMError
+    when out of attempts or on any other status, UpstreamUnavailable while the breaker
+    is open.
+    """
+    scheduler = get_scheduler()
+    breaker = scheduler.breaker(model)
+    attempts = max(1, cfg.LLM_MAX_ATTEMPTS)
+    for n in range(attempts):
+        response = None
+        async with scheduler.slot(model, priority):
+            try:
+                result = await attempt(model)
+                breaker.success()
+                return result
+            except httpx.HTTPError as e:
+                if isinstance(e, httpx.HTTPStatusError):
+                    response = e.response
+                status = response.status_code if response is not None else None
+                if status == 429:
+                    breaker.success()  # Upstream is up, just rationing
+                    metrics.inc('llm_rate_limited_total', model=model)
+                    scheduler.bucket(model).pause(_backoff(n, response))
+                elif status is None or status in RETRY_STATUS:
+                    breaker.failure()
+                else:
+                    breaker.success()
+                    raise LLMError(_error_message(n + 1, e)) from e
+                if n == attempts - 1 or not may_retry():
+                    raise LLMError(_error_message(n + 1, e)) from e
+        if status != 429:
+            breaker.check()  # This failure may have opened the circuit; don't back off just to find out
+            await asyncio.sleep(_backoff(n, response))
+
+async def _chat(prompt: str, max_tokens: int, priority: int = INTERACTIVE) -> str:
+    if hedging_enabled():
+        # Hedging needs to see the first token, so the answer is streamed and joined
+        parts = []
+        await _hedged_stream(prompt, max_tokens, parts.append, priority)
+        return ''.join(parts)
+
+    async def attempt(model: str) -> str:
+        body = {'model': model, 'messages':[{'role':'user','content':prompt}], 'max_tokens': max_tokens}
+        response = await _get_client().post('/chat/completions', headers=_headers(), json=body)
+        response.raise_for_status()
+        j = response.json()
+        return j.get('choices',[{}])[0].get('message',{}).get('content','')
+
+    return await _call(cfg.LLM_MODEL, priority, attempt)
+
+@metrics.timed('llm')
+async def achat(prompt: str, max_tokens: int = 2048, priority: int = INTERACTIVE) -> str:
+    """Async chat completion; awaits the pooled client without blocking the caller's loop.
+
+    Raises LLMError (UpstreamUnavailable while the model's circuit is open) when no answer
+    can be produced, and executors.Overloaded when the scheduler queue is full.
+    """
+    future = asyncio.run_coroutine_threadsafe(_chat(prompt, max_tokens, priority), _get_loop())
+    return await asyncio.wrap_future(future)
+
+@metrics.timed('llm')
+def chat(prompt: str, max_tokens: int = 2048, priority: int = INTERACTIVE) -> str:
+    """Blocking wrapper around achat for sync callers; background jobs pass priority=BATCH"""
+    return asyncio.run_coroutine_threadsafe(_chat(prompt, max_tokens, priority), _get_loop()).result()
+
+def _parse_sse_line(line: str):
+    """Return the content delta of one SSE line, '' for keep-alives, None at [DONE]"""
+    if not line.startswith('data:'):
+        return ''  # blank separators and ': OPENROUTER PROCESSING' comments
+    data = line[5:].strip()
+    if data == '[DONE]':
+        return None
+    try:
+        chunk = json.loads(data)
+    except ValueError:
+        return ''
+    if chunk.get('error'):
+        raise LLMError(chunk['error'].get('message', str(chunk['error'])))
+    choices = chunk.get('choices') or [{}]
+    return choices[0].get('delta', {}).get('content') or ''
+
+async def _stream(prompt: str, max_tokens: int, emit, model: str = None, priority: int = INTERACTIVE):
+    """Stream completion deltas into emit(); retries only until the first token arrives"""
+    started = False
+
+    async def attempt(model: str):
+        nonlocal started
+        body = {'model': model, 'messages':[{'role':'user','content':prompt}], 'max_tokens': max_tokens,
+                'stream': True}
+        async with _get_client().stream('POST', '/chat/completions', headers=_headers(), json=body) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                delta = _parse_sse_line(line)
+                if delta is None:
+                    return
+                if delta:
+                    started = True
+                    emit(delta)
+
+    await _call(model or cfg.LLM_MODEL, priority, attempt, may_retry=lambda: not started)
+
+# Hedging counters (only touched on the background loop): requests eligible for a hedge,
+# requests that issued one, and which model's answer was used
+_hedge_stats = {'requests': 0, 'hedged': 0, 'primary_wins': 0, 'fallback_wins': 0, 'failed': 0}
+
+def hedging_enabled() -> bool:
+    return bool(cfg.LLM_FALLBACK_MODEL) and cfg.LLM_FALLBACK_MODEL != cfg.LLM_MODEL
+
+def hedge_stats() -> dict:
+    """Hedge rate (share of requests that raced the fallback) and fallback win rate"""
+    stats = dict(_hedge_stats)
+    stats['hedge_rate'] = stats['hedged'] / stats['requests'] if stats['requests'] else 0.0
+    stats['fallback_win_rate'] = stats['fallback_wins'] / stats['hedged'] if stats['hedged'] else 0.0
+    return stats
+
+def _count_hedge(stat: str, **labels):
+    _hedge_stats[stat] += 1
+    metrics.inc(f'llm_hedge_{stat}_total', **labels)
+
+async def _hedged_stream(prompt: str, max_tokens: int, emit, priority: int = INTERACTIVE):
+    """_stream from LLM_MODEL, racing LLM_FALLBACK_MODEL when no token arrived within LLM_HEDGE_AFTER_MS.
+
+    The fallback also starts at once if the primary fails first. Whichever request
+    produces the first token wins: its tokens go to emit() and the other request is
+    cancelled. Raises the last error when both fail.
+    """
+    winner = None
+    tasks = {}
+
+    def emitter(role: str):
+        def on_token(delta: str):
+            nonlocal winner
+            if winner is None:
+                winner = role
+                for other, task in tasks.items():
+                    if other != role:
+                        task.cancel()
+            if winner == role:
+                emit(delta)
+        return on_token
+
+    def start(role: str, model: str):
+        tasks[role] = asyncio.ensure_future(_stream(prompt, max_tokens, emitter(role), model, priority))
+        return tasks[role]
+
+    _count_hedge('requests')
+    pending = {start('primary', cfg.LLM_MODEL)}
+    error = None
+    try:
+        _, pending = await asyncio.wait(pending, timeout=cfg.LLM_HEDGE_AFTER_MS / 1000)
+        if winner is None and (pending or tasks['primary'].exception() is not None):
+            _count_hedge('hedged')
+            pending.add(start('fallback', cfg.LLM_FALLBACK_MODEL))
+        pending |= {t for t in tasks.values() if t.done()}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for role, task in tasks.items():
+                if task not in done or task.cancelled():
+                    continue
+                if task.exception() is not None:
+                    error = task.exception()
+                    if winner == role:
+                        _count_hedge('failed')
+                        raise error
+                    continue
+                if winner is None:
+                    winner = role  # An empty answer; nothing else produced a token either
+                if winner == role:
+                    _count_hedge(f'{role}_wins')
+                    return
+    finally:
+        for task in tasks.values():
+            task.cancel()
+    _count_hedge('failed')
+    raise error
+
+def _run_stream(prompt: str, max_tokens: int, emit, priority: int):
+    if hedging_enabled():
+        return _hedged_stream(prompt, max_tokens, emit, priority)
+    return _stream(prompt, max_tokens, emit, priority=priority)
+
+_DONE = object()
+
+async def astream_chat(prompt: str, max_tokens: int = 2048, priority: int = INTERACTIVE):
+    """Async generator of answer tokens as OpenRouter streams them.
+
+    Closing the generator early cancels the upstream request.
+    """
+    caller_loop = asyncio.get_running_loop()
+    tokens = asyncio.Queue()
+    put = lambda item: caller_loop.call_soon_threadsafe(tokens.put_nowait, item)
+
+    async def pump():
+        try:
+            await _run_stream(prompt, max_tokens, put, priority)
+            put(_DONE)
+        except Exception as e:
+            put(e)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), _get_loop())
+    try:
+        while True:
+            item = await tokens.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        future.cancel()
+
+def stream_chat(prompt: str, max_tokens: int = 2048, priority: int = INTERACTIVE):
+    """Blocking generator version of astream_chat"""
+    tokens = queue.Queue()
+
+    async def pump():
         try:
-            r = requests.post('https://openrouter.ai/api/v1/chat/completions',
-                              headers={
-                                  'Authorization': f'Bearer {cfg.OPENROUTER_API_KEY}',
-                                  'Content-Type': 'application/json',
-                                  'HTTP-Referer': 'http://localhost:3000', # Optional, for including your app on openrouter.ai rankings.
-                                  'X-Title': 'Legal Agent RAG', # Optional. Shows in rankings on openrouter.ai.
-                              }, 
-                              json=body, 
-                              timeout=60)
-            r.raise_for_status()
-            j = r.json()
-            return j.get('choices',[{}])[0].get('message',{}).get('content','')
-        except requests.exceptions.RequestException as e:
-            if attempt < 2:
-                time.sleep(2 ** attempt)  # Wait 1s, then 2s, then 4s
-                continue
-            return f"Error calling OpenRouter API after {attempt+1} attempts: {str(e)}. Please check: 1) Internet connection, 2) API key validity at https://openrouter.ai/keys"
+            await _run_stream(prompt, max_tokens, tokens.put, priority)
+            tokens.put(_DONE)
+        except Exception as e:
+            tokens.put(e)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), _get_loop())
+    try:
+        while True:
+            item = tokens.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        future.cancel()
+
+def close():
+    """Close pooled connections (e.g. on application shutdown)"""
+    global _client
+    if _client is not None and _loop is not None:
+        asyncio.run_coroutine_threadsafe(_client.aclose(), _loop).result()
+        _client = None
+
+metrics.describe('llm_hedge_requests_total', 'LLM requests eligible for hedging (LLM_FALLBACK_MODEL set)')
+metrics.describe('llm_hedge_hedged_total', 'LLM requests that raced LLM_FALLBACK_MODEL after LLM_HEDGE_AFTER_MS without a token')
+metrics.describe('llm_hedge_primary_wins_total', 'Hedge-eligible LLM requests answered by LLM_MODEL')
+metrics.describe('llm_hedge_fallback_wins_total', 'Hedge-eligible LLM requests answered by LLM_FALLBACK_MODEL')
+metrics.describe('llm_hedge_failed_total', 'Hedge-eligible LLM requests where no model answered')
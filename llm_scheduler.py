@@ -0,0 +1,269 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+from config import cfg
+from executors import Overloaded
+import metrics
+
+# Request priorities: lower runs first. Anything a user is waiting on (the API, the
+# Streamlit app) is interactive by default; scripts and ingestion jobs pass BATCH.
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BATCH: 'batch'}
+
+class LLMError(Exception):
+    """Raised by the chat APIs when OpenRouter cannot produce an answer"""
+
+class UpstreamUnavailable(LLMError):
+    """The circuit breaker for a model is open; retry after `retry_after` seconds"""
+
+    def __init__(self, model: str, retry_after: float):
+        self.model = model
+        self.retry_after = retry_after
+        super().__init__(f"{model} is unavailable upstream, retry in {retry_after:.0f}s")
+
+class TokenBucket:
+    """Request budget for one model: `rate` requests per second with bursts of up to `burst`.
+
+    Waiters are admitted in priority order as tokens become available, by one drain
+    task rather than each waiter polling. A 429 from upstream pauses the bucket for its
+    Retry-After, so every request for that model waits instead of each discovering the
+    limit on its own. Lives on llm.py's background loop, like LLMScheduler.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiting = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._drainer: asyncio.Task = None
+        self._wakeup: asyncio.Event = None
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiting if not future.done())
+
+    def _reserve(self) -> float:
+        """Take a token now (returns 0) or return the seconds until one is available"""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        """Give back a token taken by a request that was then not sent"""
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    async def _drain(self):
+        while self._waiting:
+            if self._waiting[0][2].done():  # Cancelled while waiting
+                heapq.heappop(self._waiting)
+                continue
+            delay = self._reserve()
+            if delay <= 0:
+                heapq.heappop(self._waiting)[2].set_result(None)
+                continue
+            self._wakeup.clear()
+            try:
+                # pause() wakes the drainer so a longer Retry-After takes effect at once
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def take(self, priority: int):
+        if not self._waiting and self._reserve() <= 0:
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._seq), future))
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.ensure_future(self._drain())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.refund()  # The token was handed over just as we were cancelled
+            else:
+                future.cancel()
+            raise
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+class CircuitBreaker:
+    """Fails fast after `failures` consecutive upstream failures, for `cooldown` seconds.
+
+    After the cooldown one probe request is let through (half-open); its success closes
+    the breaker and its failure opens it again.
+    """
+
+    def __init__(self, model: str, failures: int, cooldown: float):
+        self.model = model
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.opened_at = None
+        self.probing = False
+        self.probe_started = 0.0
+
+    def check(self):
+        if self.opened_at is None:
+            return
+        now = time.monotonic()
+        remaining = self.opened_at + self.cooldown - now
+        # A probe that never reported back (cancelled, rejected) stops blocking after a cooldown
+        if remaining > 0 or (self.probing and now - self.probe_started < self.cooldown):
+            metrics.inc('llm_fast_failures_total', model=self.model)
+            raise UpstreamUnavailable(self.model, max(remaining, 1.0))
+        self.probing = True
+        self.probe_started = now
+
+    def success(self):
+        self.consecutive = 0
+        self.probing = False
+        if self.opened_at is not None:
+            self.opened_at = None
+            metrics.set_gauge('llm_circuit_open', 0, model=self.model)
+            print(f"LLM circuit for {self.model} closed")
+
+    def failure(self):
+        self.consecutive += 1
+        if self.probing or (self.failures > 0 and self.consecutive >= self.failures and self.opened_at is None):
+            self.probing = False
+            self.opened_at = time.monotonic()
+            metrics.inc('llm_circuit_opened_total', model=self.model)
+            metrics.set_gauge('llm_circuit_open', 1, model=self.model)
+            print(f"LLM circuit for {self.model} open for {self.cooldown:g}s after {self.consecutive} failures")
+
+class LLMScheduler:
+    """Admission for upstream LLM calls: the model's token bucket, then concurrency slots,
+    both handed out by priority, behind the model's circuit breaker.
+
+    Lives on llm.py's background event loop; all state is touched from that loop only.
+    At most `queue_size` requests may wait for a slot; beyond that callers get Overloaded.
+    """
+
+    def __init__(self, concurrency: int, queue_size: int):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.active = 0
+        self._waiting = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def bucket(self, model: str) -> TokenBucket:
+        if model not in self._buckets:
+            self._buckets[model] = TokenBucket(cfg.LLM_RATE_PER_MIN / 60, cfg.LLM_BURST)
+        return self._buckets[model]
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(model, cfg.LLM_BREAKER_FAILURES, cfg.LLM_BREAKER_COOLDOWN)
+        return self._breakers[model]
+
+    def _export_depth(self):
+        depth = {p: 0 for p in PRIORITY_NAMES}
+        for priority, _, future in self._waiting:
+            if not future.done():
+                depth[priority] += 1
+        for priority, n in depth.items():
+            metrics.set_gauge('llm_queue_depth', n, priority=PRIORITY_NAMES[priority])
+        metrics.set_gauge('llm_active_requests', self.active)
+
+    async def acquire(self, priority: int):
+        if self.active < self.concurrency and not self._waiting:
+            self.active += 1
+            self._export_depth()
+            return
+        if len(self._waiting) >= self.queue_size:
+            metrics.inc('executor_rejected_total', pool='llm')
+            raise Overloaded('llm')
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._seq), future))
+        self._export_depth()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # The slot was handed over just as we were cancelled
+            else:
+                future.cancel()
+                self._waiting = [w for w in self._waiting if w[2] is not future]
+                heapq.heapify(self._waiting)
+                self._export_depth()
+            raise
+        self._export_depth()
+
+    def release(self):
+        self.active -= 1
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+                break
+        self._export_depth()
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: int):
+        """Hold one upstream request slot for `model`; raises UpstreamUnavailable while its breaker is open.
+
+        The model's token bucket (and any 429 pause) is waited on before a concurrency
+        slot is taken, so requests rationed for one model never hold slots that requests
+        for another model, such as the hedging fallback, could use.
+        """
+        self.breaker(model).check()
+        bucket = self.bucket(model)
+        if bucket.waiting >= self.queue_size:
+            metrics.inc('executor_rejected_total', pool='llm')
+            raise Overloaded('llm')
+        started = time.monotonic()
+        await bucket.take(priority)
+        try:
+            await self.acquire(priority)
+        except BaseException:
+            bucket.refund()
+            raise
+        name = PRIORITY_NAMES[priority]
+        metrics.inc('llm_queue_wait_seconds_total', time.monotonic() - started, priority=name)
+        metrics.inc('llm_queue_waits_total', priority=name)
+        try:
+            yield
+        finally:
+            self.release()
+
+_scheduler = None
+
+def get_scheduler() -> LLMScheduler:
+    """The scheduler of llm.py's background loop (created there on first use)"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler(cfg.LLM_CONCURRENCY, cfg.LLM_QUEUE)
+    return _scheduler
+
+metrics.describe('llm_queue_depth', 'LLM requests waiting for an upstream slot, by priority')
+metrics.describe('llm_active_requests', 'LLM requests holding an upstream slot')
+metrics.describe('llm_queue_wait_seconds_total', 'Time LLM requests waited for their rate budget and an upstream slot, by priority')
+metrics.describe('llm_queue_waits_total', 'LLM requests admitted to an upstream slot, by priority')
+metrics.describe('llm_rate_limited_total', 'Upstream 429 responses, by model')
+metrics.describe('llm_circuit_opened_total', 'Times a model circuit breaker opened')
+metrics.describe('llm_circuit_open', 'Whether a model circuit breaker is open (1) or closed (0)')
+metrics.describe('llm_fast_failures_total', 'LLM requests failed fast by an open circuit breaker')
@@ -0,0 +1,145 @@
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Tuple
+from config import cfg
+
+# In-process counters, gauges and histograms exported in Prometheus text format on /metrics
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple], float] = defaultdict(float)
+_gauges: Dict[Tuple[str, Tuple], float] = {}
+_histograms: Dict[Tuple[str, Tuple], List[float]] = {}  # bucket counts (last is +Inf), sum, count
+_help: Dict[str, str] = {}
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def describe(name: str, help_text: str):
+    _help[name] = help_text
+
+def inc(name: str, value: float = 1.0, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] += value
+
+def set_gauge(name: str, value: float, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _gauges[key] = value
+
+def observe(name: str, value: float, **labels):
+    """Add one observation to a histogram with BUCKETS"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0.0] * (len(BUCKETS) + 3)
+        h[bisect_left(BUCKETS, value)] += 1
+        h[-2] += value
+        h[-1] += 1
+
+# Per-request stage totals for the Server-Timing header: {stage: [seconds, calls]} while a
+# request is being served (see start_request), None otherwise. Executors copy the context
+# into their threads, so spans there count towards the request that submitted the work.
+_request_stages: contextvars.ContextVar = contextvars.ContextVar('request_stages', default=None)
+_NO_SPAN = nullcontext()
+
+def _record(stage: str, seconds: float):
+    observe('stage_duration_seconds', seconds, stage=stage)
+    stages = _request_stages.get()
+    if stages is not None:
+        total = stages.setdefault(stage, [0.0, 0])
+        total[0] += seconds
+        total[1] += 1
+
+def record(stage: str, seconds: float):
+    """Report a stage duration measured by the caller (e.g. across threads); see span()"""
+    if cfg.METRICS_ENABLED:
+        _record(stage, seconds)
+
+@contextmanager
+def _span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(stage, time.perf_counter() - started)
+
+def span(stage: str):
+    """Time a block as `stage`: a stage_duration_seconds observation plus the current
+    request's Server-Timing entry. A shared no-op when METRICS_ENABLED is off."""
+    return _span(stage) if cfg.METRICS_ENABLED else _NO_SPAN
+
+def timed(stage: str):
+    """Decorator form of span() for functions and coroutine functions"""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not cfg.METRICS_ENABLED:
+                    return await fn(*args, **kwargs)
+                with _span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not cfg.METRICS_ENABLED:
+                return fn(*args, **kwargs)
+            with _span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def start_request():
+    """Begin collecting stage timings for the current request; returns a token for end_request"""
+    return _request_stages.set({})
+
+def end_request(token) -> str:
+    """Stop collecting and return the Server-Timing header value (stage;dur=ms, ...)"""
+    stages = _request_stages.get() or {}
+    _request_stages.reset(token)
+    return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, (seconds, _) in stages.items())
+
+def get(name: str, **labels) -> float:
+    with _lock:
+        return _counters.get((name, tuple(sorted(labels.items()))), 0.0)
+
+def _format_labels(labels: Tuple) -> str:
+    if not labels:
+        return ''
+    inner = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+    return '{' + inner + '}'
+
+def render_prometheus() -> str:
+    with _lock:
+        series = [(key, value, 'counter') for key, value in _counters.items()]
+        series += [(key, value, 'gauge') for key, value in _gauges.items()]
+        series += [(key, list(h), 'histogram') for key, h in _histograms.items()]
+    lines = []
+    seen = set()
+    for (name, labels), value, kind in sorted(series, key=lambda item: item[0]):
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+        if kind != 'histogram':
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            continue
+        cumulative = 0
+        for bound, n in zip(BUCKETS + (float('inf'),), value):
+            cumulative += n
+            le = '+Inf' if bound == float('inf') else f"{bound:g}"
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative:g}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]:g}")
+        lines.append(f"{name}_count{_format_labels(labels)} {value[-1]:g}")
+    return '\n'.join(lines) + '\n'
+
+describe('rag_cancelled_total', 'Streaming RAG requests abandoned after the client disconnected, by stage reached (retrieval = LLM call avoided)')
+describe('stage_duration_seconds', 'Time spent in each request and ingestion stage')
@@ -0,0 +1,25 @@
+# Script to fold per-document ChromaDB collections into the single shared collection
+import argparse
+
+from config import cfg
+from db_store import chroma_client, migrate_to_single_collection, rebuild_routing_index
+
+parser = argparse.ArgumentParser(description="Move every per-document collection into the unified collection")
+parser.add_argument("--path", default=cfg.CHROMA_DIR, help="ChromaDB directory")
+parser.add_argument("--keep", action="store_true", help="Keep the per-document collections after copying")
+parser.add_argument("--batch-size", type=int, default=500)
+parser.add_argument("--rebuild-routing", action="store_true",
+                    help="Only rebuild the document routing index (from the unified collection with --single)")
+parser.add_argument("--single", action="store_true", help="With --rebuild-routing, read the unified collection")
+args = parser.parse_args()
+
+client = chroma_client(args.path)
+if args.rebuild_routing:
+    count = rebuild_routing_index(client, chroma_dir=args.path, single=args.single or None)
+    print(f"✅ Routing index rebuilt for {count} documents")
+    raise SystemExit(0)
+print(f"📦 Migrating collections in {args.path} into '{cfg.UNIFIED_COLLECTION}'...")
+summary = migrate_to_single_collection(client, delete_source=not args.keep, batch_size=args.batch_size,
+                                       chroma_dir=args.path)
+print(f"✅ Migrated {summary['collections']} documents ({summary['chunks']} chunks)")
+print("ℹ️ Set INDEX_MODE=single in your .env to query the unified collection.")
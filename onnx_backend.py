@@ -0,0 +1,114 @@
+import json
+import os
+from typing import Dict, List
+import numpy as np
+from config import cfg
+from doc_router import model_slug
+
+# Exported models live in ONNX_MODEL_DIR/<model slug>/ (see export_onnx.py):
+#   model_int8.onnx  dynamically quantized graph
+#   tokenizer.json   Hugging Face fast tokenizer
+#   encoder.json     {'kind', 'pooling', 'normalize', 'max_seq_length'}
+MODEL_FILE = 'model_int8.onnx'
+
+# Accuracy contract checked by bench_onnx.py: every int8 embedding has cosine similarity
+# of at least EMBED_MIN_COSINE with the torch embedding of the same text, and rerank
+# scores (sigmoid) differ by at most RERANK_MAX_SCORE_DIFF.
+EMBED_MIN_COSINE = 0.99
+RERANK_MAX_SCORE_DIFF = 0.05
+
+def model_dir(model_name: str) -> str:
+    return os.path.join(cfg.ONNX_MODEL_DIR, model_slug(model_name))
+
+def _session(path: str):
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    if cfg.ONNX_THREADS > 0:
+        options.intra_op_num_threads = cfg.ONNX_THREADS
+        options.inter_op_num_threads = 1
+    return ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+
+class OnnxTokenizer:
+    """The parts of the transformers tokenizer API the pipeline uses, over `tokenizers`"""
+
+    def __init__(self, path: str, max_length: int):
+        from tokenizers import Tokenizer
+        # Separate instances so counting (raw) and batching (padded, truncated) can run concurrently
+        self._tok = Tokenizer.from_file(path)
+        self._tok.no_padding()
+        self._tok.no_truncation()
+        self._batch_tok = Tokenizer.from_file(path)
+        self._batch_tok.enable_truncation(max_length)
+        self._batch_tok.enable_padding()
+        self.max_length = max_length
+
+    def num_special_tokens_to_add(self, pair: bool = False) -> int:
+        return self._tok.post_processor.num_special_tokens_to_add(pair) if self._tok.post_processor else 0
+
+    def __call__(self, texts: List[str], add_special_tokens: bool = True, **kwargs) -> Dict[str, List[List[int]]]:
+        encoded = self._tok.encode_batch(list(texts), add_special_tokens=add_special_tokens)
+        return {'input_ids': [e.ids for e in encoded]}
+
+    def batch(self, texts, pairs=None) -> Dict[str, np.ndarray]:
+        """Padded, truncated model inputs for a batch of texts (or text pairs)"""
+        encoded = self._batch_tok.encode_batch(list(zip(texts, pairs)) if pairs is not None else list(texts))
+        return {
+            'input_ids': np.array([e.ids for e in encoded], dtype=np.int64),
+            'attention_mask': np.array([e.attention_mask for e in encoded], dtype=np.int64),
+            'token_type_ids': np.array([e.type_ids for e in encoded], dtype=np.int64),
+        }
+
+class _OnnxModel:
+    def __init__(self, model_name: str, kind: str, max_length: int = None):
+        path = model_dir(model_name)
+        config_path = os.path.join(path, 'encoder.json')
+        if not os.path.exists(config_path):
+            raise FileNotFoundError(f"No ONNX export of {model_name} in {path}; run: python export_onnx.py --model {model_name}")
+        with open(config_path) as f:
+            self.config = json.load(f)
+        if self.config['kind'] != kind:
+            raise ValueError(f"{path} holds a {self.config['kind']} model, not a {kind}")
+        self.model_name = model_name
+        self.max_seq_length = min(self.config['max_seq_length'], max_length or self.config['max_seq_length'])
+        self.tokenizer = OnnxTokenizer(os.path.join(path, 'tokenizer.json'), self.max_seq_length)
+        self.session = _session(os.path.join(path, MODEL_FILE))
+        self._inputs = {i.name for i in self.session.get_inputs()}
+        self.nbytes = os.path.getsize(os.path.join(path, MODEL_FILE))
+
+    def _run(self, batch: Dict[str, np.ndarray]) -> np.ndarray:
+        return self.session.run(None, {k: v for k, v in batch.items() if k in self._inputs})[0]
+
+class OnnxEncoder(_OnnxModel):
+    """Int8 ONNX stand-in for SentenceTransformer.encode (mean or CLS pooling, optional L2 norm)"""
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name, 'encoder')
+
+    def encode(self, texts: List[str], batch_size: int = 32, **kwargs) -> np.ndarray:
+        out = []
+        for i in range(0, len(texts), batch_size):
+            batch = self.tokenizer.batch(texts[i:i+batch_size])
+            hidden = self._run(batch)
+            if self.config['pooling'] == 'cls':
+                vecs = hidden[:, 0]
+            else:
+                mask = batch['attention_mask'][..., None].astype(np.float32)
+                vecs = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.config['normalize']:
+                vecs = vecs / np.clip(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12, None)
+            out.append(vecs.astype(np.float32))
+        return np.concatenate(out) if out else np.zeros((0, 0), dtype=np.float32)
+
+class OnnxCrossEncoder(_OnnxModel):
+    """Int8 ONNX stand-in for CrossEncoder.predict (sigmoid of the single relevance logit)"""
+
+    def __init__(self, model_name: str, max_length: int = None):
+        super().__init__(model_name, 'cross-encoder', max_length)
+
+    def predict(self, pairs, batch_size: int = 32, **kwargs) -> np.ndarray:
+        scores = []
+        for i in range(0, len(pairs), batch_size):
+            part = pairs[i:i+batch_size]
+            logits = self._run(self.tokenizer.batch([p[0] for p in part], [p[1] for p in part]))
+            scores.append(1 / (1 + np.exp(-logits[:, 0])))
+        return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
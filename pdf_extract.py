@@ -0,0 +1,297 @@
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Union
+import pypdf
+from config import cfg
+import metrics
+
+class PdfBackend:
+    """Text extractor interface: open a file, count its pages, extract one page"""
+    name = ''
+    module = None
+
+    @classmethod
+    def available(cls) -> bool:
+        if cls.module is None:
+            return True
+        try:
+            __import__(cls.module)
+            return True
+        except ImportError:
+            return False
+
+    def open(self, path: str):
+        raise NotImplementedError
+
+    def page_count(self, doc) -> int:
+        raise NotImplementedError
+
+    def page_text(self, doc, index: int) -> str:
+        raise NotImplementedError
+
+class PypdfBackend(PdfBackend):
+    """Pure-Python pypdf (default; always installed)"""
+    name = 'pypdf'
+
+    def open(self, path: str):
+        return pypdf.PdfReader(path)
+
+    def page_count(self, doc) -> int:
+        return len(doc.pages)
+
+    def page_text(self, doc, index: int) -> str:
+        return doc.pages[index].extract_text() or ''
+
+class PymupdfBackend(PdfBackend):
+    """MuPDF via the optional `pymupdf` package"""
+    name = 'pymupdf'
+    module = 'pymupdf'
+
+    def open(self, path: str):
+        import pymupdf
+        return pymupdf.open(path)
+
+    def page_count(self, doc) -> int:
+        return doc.page_count
+
+    def page_text(self, doc, index: int) -> str:
+        return doc.load_page(index).get_text() or ''
+
+class PdfiumBackend(PdfBackend):
+    """PDFium via the optional `pypdfium2` package"""
+    name = 'pdfium'
+    module = 'pypdfium2'
+
+    def open(self, path: str):
+        import pypdfium2
+        return pypdfium2.PdfDocument(path)
+
+    def page_count(self, doc) -> int:
+        return len(doc)
+
+    def page_text(self, doc, index: int) -> str:
+        return doc[index].get_textpage().get_text_range() or ''
+
+BACKENDS = {cls.name: cls for cls in (PypdfBackend, PymupdfBackend, PdfiumBackend)}
+
+def available_backends() -> List[str]:
+    return [name for name, cls in BACKENDS.items() if cls.available()]
+
+def get_backend(name: str = None) -> PdfBackend:
+    name = name or cfg.PDF_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown PDF backend '{name}'. Available: {', '.join(BACKENDS)}")
+    if not BACKENDS[name].available():
+        raise ValueError(f"PDF backend '{name}' needs the '{BACKENDS[name].module}' package")
+    return BACKENDS[name]()
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+class PageTextCache:
+    """Extracted page text in SQLite, keyed by (file SHA-256, backend, page number).
+
+    A document is served from the cache only when every page is present, so pages
+    that failed to extract are retried on the next run.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS pdf_files ('
+                         'file_hash TEXT NOT NULL, backend TEXT NOT NULL, num_pages INTEGER NOT NULL, '
+                         'PRIMARY KEY (file_hash, backend))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS pdf_pages ('
+                         'file_hash TEXT NOT NULL, backend TEXT NOT NULL, page_num INTEGER NOT NULL, text TEXT NOT NULL, '
+                         'PRIMARY KEY (file_hash, backend, page_num))')
+        self._db.commit()
+
+    def complete_page_count(self, digest: str, backend: str) -> Optional[int]:
+        """Page count when all pages of the file are cached, else None"""
+        with self._lock:
+            row = self._db.execute('SELECT num_pages FROM pdf_files WHERE file_hash = ? AND backend = ?',
+                                   (digest, backend)).fetchone()
+            if row is None:
+                return None
+            cached = self._db.execute('SELECT COUNT(*) FROM pdf_pages WHERE file_hash = ? AND backend = ?',
+                                      (digest, backend)).fetchone()[0]
+        return row[0] if cached == row[0] else None
+
+    def iter_pages(self, digest: str, backend: str, batch: int = 64) -> Iterator[Dict]:
+        page = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    'SELECT page_num, text FROM pdf_pages WHERE file_hash = ? AND backend = ? AND page_num > ? '
+                    'ORDER BY page_num LIMIT ?', (digest, backend, page, batch)).fetchall()
+            if not rows:
+                return
+            for page, text in rows:
+                yield {'page_num': page, 'text': text, 'error': None}
+
+    def set_page_count(self, digest: str, backend: str, num_pages: int):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO pdf_files (file_hash, backend, num_pages) VALUES (?, ?, ?)',
+                             (digest, backend, num_pages))
+            self._db.commit()
+
+    def put_pages(self, digest: str, backend: str, pages: List[Dict]):
+        rows = [(digest, backend, p['page_num'], p['text']) for p in pages if not p['error']]
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO pdf_pages (file_hash, backend, page_num, text) VALUES (?, ?, ?, ?)', rows)
+            self._db.commit()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_page_cache() -> Optional[PageTextCache]:
+    global _cache
+    if not cfg.PDF_PAGE_CACHE:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = PageTextCache(cfg.PDF_PAGE_CACHE_PATH or os.path.join(cfg.CHROMA_DIR, 'page_cache.sqlite'))
+        return _cache
+
+# Last PDF opened by this worker process: shards of the same file reuse the parsed document
+_opened = (None, None)
+
+def _open(path: str, backend: PdfBackend):
+    global _opened
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size, backend.name)
+    if _opened[0] != key:
+        _opened = (key, backend.open(path))
+    return _opened[1]
+
+def _extract_one(backend: PdfBackend, doc, index: int) -> Dict:
+    try:
+        return {'page_num': index + 1, 'text': backend.page_text(doc, index), 'error': None}
+    except Exception as e:
+        return {'page_num': index + 1, 'text': '', 'error': f'{type(e).__name__}: {e}'}
+
+def extract_page_range(path: str, start: int, stop: int, backend_name: str = 'pypdf') -> List[Dict]:
+    """Extract pages [start, stop) of the PDF at path (runs inside a pool worker)"""
+    backend = get_backend(backend_name)
+    try:
+        doc = _open(path, backend)
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+        return [{'page_num': i + 1, 'text': '', 'error': error} for i in range(start, stop)]
+    return [_extract_one(backend, doc, i) for i in range(start, stop)]
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def pdf_workers() -> int:
+    return cfg.PDF_WORKERS if cfg.PDF_WORKERS > 0 else (os.cpu_count() or 1)
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """Shared extraction pool; spawn keeps workers clear of the server's threads and sockets"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None:
+            _pool_workers = pdf_workers()
+            _pool = ProcessPoolExecutor(max_workers=_pool_workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _extract_uncached(path: str, backend: PdfBackend, num_pages: int, shard_pages: int,
+                      executor: Optional[ProcessPoolExecutor], min_pages: int,
+                      workers: Optional[int]) -> Iterator[List[Dict]]:
+    """Yield extracted pages shard by shard, in page order"""
+    if executor is None and (num_pages < min_pages or pdf_workers() <= 1):
+        doc = backend.open(path)
+        for start in range(0, num_pages, shard_pages):
+            yield [_extract_one(backend, doc, i) for i in range(start, min(start + shard_pages, num_pages))]
+        return
+    if executor is None:
+        executor = get_pdf_pool()
+        workers = _pool_workers
+    in_flight = max(2, 2 * (workers or pdf_workers()))
+    ranges = iter([(s, min(s + shard_pages, num_pages)) for s in range(0, num_pages, shard_pages)])
+    pending = deque()
+    for start, stop in ranges:
+        pending.append(executor.submit(extract_page_range, path, start, stop, backend.name))
+        if len(pending) >= in_flight:
+            break
+    while pending:
+        pages = pending.popleft().result()
+        for start, stop in ranges:
+            pending.append(executor.submit(extract_page_range, path, start, stop, backend.name))
+            break
+        yield pages
+
+def extract_pages(source: Union[str, bytes], shard_pages: int = None, executor: ProcessPoolExecutor = None,
+                  min_pages: int = None, backend: str = None, on_page_count: Callable[[int], None] = None,
+                  use_cache: bool = True, workers: int = None) -> Iterator[Dict]:
+    """Yield {'page_num', 'text', 'error'} for every page of a PDF, in page order.
+
+    Text is looked up in the page cache by (file hash, page, backend) first; a fully
+    cached file is served without opening the PDF at all. Otherwise page ranges of
+    `shard_pages` are extracted in parallel on the process pool from a shared on-disk
+    copy (bytes are written to a temporary file first), with only a couple of shards
+    per worker in flight, and successful pages are added to the cache. A page that
+    fails to extract comes back with empty text and its error; the rest of the
+    document is unaffected. PDFs shorter than `min_pages` are extracted in-process,
+    where pool overhead would dominate. on_page_count(n) is called before the first page.
+    `workers` is the size of a caller-supplied `executor` (PDF_WORKERS if omitted).
+    """
+    shard_pages = shard_pages or cfg.PDF_SHARD_PAGES
+    min_pages = cfg.PDF_PARALLEL_MIN_PAGES if min_pages is None else min_pages
+    pdf_backend = get_backend(backend)
+    cache = get_page_cache() if use_cache else None
+    in_memory = isinstance(source, (bytes, bytearray, memoryview))
+    digest = None
+    if cache is not None:
+        digest = hashlib.sha256(source).hexdigest() if in_memory else file_hash(source)
+        num_pages = cache.complete_page_count(digest, pdf_backend.name)
+        if num_pages is not None:
+            metrics.inc('pdf_page_cache_events_total', num_pages, event='hits')
+            if on_page_count:
+                on_page_count(num_pages)
+            yield from cache.iter_pages(digest, pdf_backend.name)
+            return
+    tmp_path = None
+    if in_memory:
+        fd, tmp_path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(source)
+        path = tmp_path
+    else:
+        path = source
+    try:
+        num_pages = pdf_backend.page_count(pdf_backend.open(path))
+        if on_page_count:
+            on_page_count(num_pages)
+        if cache is not None:
+            cache.set_page_count(digest, pdf_backend.name, num_pages)
+        for pages in _extract_uncached(path, pdf_backend, num_pages, shard_pages, executor, min_pages,
+                                       workers):
+            if cache is not None:
+                cache.put_pages(digest, pdf_backend.name, pages)
+                metrics.inc('pdf_page_cache_events_total', len(pages), event='misses')
+            yield from pages
+    finally:
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+metrics.describe('pdf_page_cache_events_total', 'Pages served from (hits) or extracted into (misses) the PDF page text cache')
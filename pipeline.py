@@ -1,57 +1,330 @@
-import pypdf
-from io import BytesIO
-from db_store import chroma_client, get_or_create_collection, add_documents, query_all_collections
-from embeddings import embed_texts
-from retriever import retrieve, rerank, build_context, verify_citations
-from llm import chat
-
-def index_file_bytes(file_bytes: bytes, filename: str, client_path: str = None):
-    client = chroma_client(client_path)
-    col = get_or_create_collection(client, filename)
-    reader = pypdf.PdfReader(stream=BytesIO(file_bytes))
-    
-    # Extract text with page numbers
-    pages_text = [(i+1, p.extract_text() or '') for i, p in enumerate(reader.pages)]
-    text = '\n'.join([f"[Page {num}] {txt}" for num, txt in pages_text])
-    
-    # Create chunks with overlap for better context
-    chunk_size = 1000
-    overlap = 200
-    chunks = []
-    for i in range(0, len(text), chunk_size - overlap):
-        chunk = text[i:i+chunk_size]
-        if chunk.strip():
-            chunks.append(chunk)
-    
-    ids = [f"{filename}_chunk_{i}" for i in range(len(chunks))]
-    embs = embed_texts(chunks)
-    add_documents(col, chunks, ids, embs, filename=filename)
-    return col
+import asyncio
+import hashlib
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import aclosing
+from db_store import (chroma_client, get_or_create_collection, add_documents, query_all_collections, sanitize_collection_name,
+                      models_in_use, chunk_id, chunk_metadata, document_chunks, update_chunk_metadata, delete_chunks,
+                      remove_from_other_models, register_document)
+from doc_router import get_routing_index, CentroidAccumulator
+from pdf_extract import extract_pages
+from embeddings import embed_texts, submit_embed, resolve_model_name, max_tokens, count_tokens
+from embed_workers import get_embedding_workers
+from chunking import char_chunks, TokenChunker
+from retriever import retrieve, rerank, fast_rerank, build_context, merge_adjacent, fit_context, verify_citations
+from llm import chat, achat, astream_chat
+from answer_cache import AnswerKey, get_answer_cache
+from single_flight import SingleFlight, StreamFlight
+from executors import embed_pool, chroma_pool
+from query_batcher import get_query_batcher, batching_enabled
+from config import cfg
+import metrics
 
-def run_rag(query: str, client=None, top_k: int = 5, chat_history: list = None):
-    """Run RAG across all documents with optional chat history for conversational context"""
-    if client is None:
-        client = chroma_client()
+def _no_progress(**counts):
+    pass
+
+# Sentinel closing an ingestion stage queue
+_END = object()
+
+def chunker_signature() -> str:
+    """Identifies the chunking settings; stored with every chunk so a change forces re-chunking"""
+    if cfg.CHUNKING == 'chars':
+        return 'chars:1000:200'
+    return f"tokens:{cfg.CHUNK_MAX_TOKENS or 'model'}:{cfg.CHUNK_OVERLAP_TOKENS}"
+
+def make_chunker(model_name: str):
+    """(chunks(pages) generator, token counter, model token limit) for the configured CHUNKING"""
+    limit = max_tokens(model_name)
+    counter = lambda texts: count_tokens(texts, model_name=model_name)
+    if cfg.CHUNKING == 'chars':
+        return char_chunks, counter, limit
+    budget = min(cfg.CHUNK_MAX_TOKENS, limit) if cfg.CHUNK_MAX_TOKENS > 0 else limit
+    return TokenChunker(counter, budget, cfg.CHUNK_OVERLAP_TOKENS).chunks, counter, limit
+
+def _put(q: queue.Queue, item, failed: threading.Event) -> bool:
+    """Blocking put that gives up once another stage has failed"""
+    while not failed.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _get(q: queue.Queue, failed: threading.Event):
+    while not failed.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _END
+
+def _start_stage(name: str, work, errors: list, failed: threading.Event) -> threading.Thread:
+    def run():
+        try:
+            work()
+        except BaseException as e:
+            errors.append(e)
+            failed.set()
+    thread = threading.Thread(target=run, name=f'ingest-{name}', daemon=True)
+    thread.start()
+    return thread
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+@metrics.timed('ingest_document')
+def index_file_bytes(file_bytes: bytes, filename: str, client_path: str = None, model_name: str = None,
+                     progress=None, embed_batch_size: int = 64, queue_depth: int = None, stats: dict = None):
+    """Extract, chunk, embed and store a PDF.
+
+    Runs as three overlapping stages joined by bounded queues: an extractor thread
+    chunks pages as the extraction pool returns them, the calling thread embeds chunk batches,
+    and a writer thread upserts each embedded batch into Chroma. At most `queue_depth`
+    batches wait between stages, so memory stays flat regardless of PDF size. With
+    INGEST_EMBED_WORKERS > 1 batches are encoded on a process pool, a few per worker
+    in flight, and consumed in order.
+
+    Re-indexing is incremental. Chunk ids are derived from the chunk's content hash, so
+    a chunk already stored for this document (same model) keeps its vector and only
+    has its metadata refreshed; new chunks are embedded and upserted and chunks that
+    no longer occur are deleted once everything else is written. If the file hash
+    matches what is stored nothing is extracted at all.
+
+    progress(**counts) is called as stages advance with pages_total, pages_extracted,
+    pages_failed, chunks_total, chunks_reused, chunks_embedded and vectors_written. A
+    page that fails to extract is indexed as empty text instead of failing the document.
+    Chunks come from make_chunker: by default TokenChunker packs paragraphs up to the
+    model's own token limit, so nothing is cut off at encode time. Each chunk records
+    its page range and token count.
+
+    If given, `stats` is filled with file_hash, unchanged, chunk_count, chunks_reused,
+    chunks_embedded, chunks_deleted, and tokens_total / tokens_truncated (tokens past
+    the model's limit that the encoder would have dropped).
+
+    Stage times go to the stage_duration_seconds histogram: ingest_extract per page,
+    ingest_prepare, ingest_embed (submit to vectors) and ingest_write per batch.
+    """
+    progress = progress or _no_progress
+    stats = {} if stats is None else stats
+    depth = cfg.INGEST_QUEUE_DEPTH if queue_depth is None else queue_depth
+    model_name = resolve_model_name(model_name)
+    client = chroma_client(client_path)
+    col = get_or_create_collection(client, filename, model_name)
+    doc_id = sanitize_collection_name(filename)
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    signature = chunker_signature()
+    stored = document_chunks(col, filename)
+    stats.update(file_hash=file_hash, unchanged=False, chunks_reused=0, chunks_embedded=0, chunks_deleted=0,
+                 tokens_total=0, tokens_truncated=0)
     
-    # Get query embedding
-    from embeddings import embed_texts
-    query_emb = embed_texts([query])[0]
+    if stored and all(meta.get('file_hash') == file_hash and meta.get('chunker') == signature
+                      for meta in stored.values()):
+        stats.update(unchanged=True, chunk_count=len(stored), chunks_reused=len(stored),
+                     tokens_total=sum(meta.get('tokens', 0) for meta in stored.values()),
+                     tokens_truncated=sum(meta.get('tokens_truncated', 0) for meta in stored.values()))
+        progress(chunks_total=len(stored), chunks_reused=len(stored))
+        return col
     
-    # Query across all collections (optimized: reduced candidates for speed)
-    cands = query_all_collections(client, query_emb, k=top_k)
-    if not cands: return 'No relevant documents found in the database. Please ask an administrator to upload and index documents first.'
-    # Skip reranking for faster responses - use direct retrieval results
-    # top = rerank(query, cands, top_k=top_k)
-    ctx = build_context(cands)
+    chunker, counter, limit = make_chunker(model_name)
+    
+    to_embed = queue.Queue(maxsize=depth)
+    to_write = queue.Queue(maxsize=depth)
+    failed = threading.Event()
+    errors = []
+    written_ids = []
     
-    # Build prompt with chat history if available
+    def pages():
+        failed_pages = 0
+        extracted = iter(extract_pages(file_bytes, on_page_count=lambda n: progress(pages_total=n)))
+        while True:
+            with metrics.span('ingest_extract'):
+                page = next(extracted, None)
+            if page is None:
+                return
+            if page['error']:
+                failed_pages += 1
+                print(f"Could not extract page {page['page_num']} of {filename}: {page['error']}")
+                progress(pages_failed=failed_pages)
+            yield page['page_num'], page['text']
+            progress(pages_extracted=page['page_num'])
+    
+    @metrics.timed('ingest_prepare')
+    def prepare(chunks, start):
+        """(id, metadata, text) per chunk, measuring token counts the chunker didn't report"""
+        unmeasured = [c['text'] for c in chunks if c['tokens'] is None]
+        measured = iter(counter(unmeasured))
+        batch = []
+        for i, c in enumerate(chunks):
+            tokens = next(measured) if c['tokens'] is None else c['tokens']
+            truncated = max(0, tokens - limit)
+            stats['tokens_total'] += tokens
+            stats['tokens_truncated'] += truncated
+            h = content_hash(c['text'])
+            cid = chunk_id(filename, h, occurrences.get(h, 0))
+            occurrences[h] = occurrences.get(h, 0) + 1
+            meta = chunk_metadata(filename, cid, start + i, content_hash=h, file_hash=file_hash, chunker=signature,
+                                  page_start=c['page_start'], page_end=c['page_end'],
+                                  tokens=tokens, tokens_truncated=truncated)
+            batch.append((cid, meta, c['text']))
+        return batch
+    
+    occurrences = {}
+    
+    def extract():
+        chunks, index = [], 0
+        try:
+            for chunk in chunker(pages()):
+                chunks.append(chunk)
+                if len(chunks) == embed_batch_size:
+                    progress(chunks_total=index + len(chunks))
+                    if not _put(to_embed, prepare(chunks, index), failed):
+                        return
+                    index, chunks = index + len(chunks), []
+            if chunks:
+                progress(chunks_total=index + len(chunks))
+                _put(to_embed, prepare(chunks, index), failed)
+        finally:
+            _put(to_embed, _END, failed)
+    
+    def write():
+        while True:
+            item = _get(to_write, failed)
+            if item is _END:
+                return
+            ids, metas, chunks, embs = item
+            with metrics.span('ingest_write'):
+                add_documents(col, chunks, ids, embs, filename=filename, metadatas=metas)
+            written_ids.extend(ids)
+            progress(vectors_written=len(written_ids))
+    
+    stages = [_start_stage('extract', extract, errors, failed), _start_stage('write', write, errors, failed)]
+    centroids = CentroidAccumulator()
+    seen, reused_ids, reused_metas = set(), [], []
+    workers = get_embedding_workers()
+    in_flight = 2 * workers.workers if workers is not None else 0
+    pending = deque()
+    
+    def finish(fresh, reused, future, started) -> bool:
+        """Consume one embedded batch in input order; False once the writer has failed"""
+        if reused:
+            # Keep the stored vectors; only the routing centroid needs them
+            centroids.add(col.get(ids=[item[0] for item in reused], include=['embeddings'])['embeddings'])
+            reused_ids.extend(item[0] for item in reused)
+            reused_metas.extend(item[1] for item in reused)
+            progress(chunks_reused=len(reused_ids))
+        if not fresh:
+            return True
+        embs = future.result()
+        metrics.record('ingest_embed', time.perf_counter() - started)
+        centroids.add(embs)
+        stats['chunks_embedded'] += len(embs)
+        progress(chunks_embedded=stats['chunks_embedded'])
+        return _put(to_write, ([item[0] for item in fresh], [item[1] for item in fresh],
+                               [item[2] for item in fresh], embs), failed)
+    
+    try:
+        while True:
+            batch = _get(to_embed, failed)
+            if batch is _END:
+                break
+            fresh = [item for item in batch if item[0] not in stored]
+            reused = [item for item in batch if item[0] in stored]
+            seen.update(item[0] for item in batch)
+            started = time.perf_counter()
+            future = submit_embed([item[2] for item in fresh], model_name, workers) if fresh else None
+            pending.append((fresh, reused, future, started))
+            # Keep up to `in_flight` batches encoding on the worker pool (none when embedding in-process)
+            while len(pending) > in_flight or (pending and pending[0][2] is not None and pending[0][2].done()):
+                if not finish(*pending.popleft()):
+                    break
+            if failed.is_set():
+                break
+        while pending and not failed.is_set():
+            if not finish(*pending.popleft()):
+                break
+    except BaseException as e:
+        errors.append(e)
+        failed.set()
+    finally:
+        for _, _, future, _ in pending:
+            if future is not None:
+                future.cancel()
+        _put(to_write, _END, failed)
+        for thread in stages:
+            thread.join()
+    
+    if errors:
+        # Back out the new chunks; the previously stored version stays intact
+        try:
+            delete_chunks(col, written_ids, filename=filename)
+        except Exception as e:
+            print(f"Could not remove partial chunks of {filename}: {e}")
+        raise errors[0]
+    
+    update_chunk_metadata(col, reused_ids, reused_metas)
+    stale = [cid for cid in stored if cid not in seen]
+    delete_chunks(col, stale, filename=filename)
+    register_document(col, filename, len(seen))
+    remove_from_other_models(client, filename, model_name)
+    stats.update(chunk_count=len(seen), chunks_reused=len(reused_ids), chunks_deleted=len(stale))
+    if len(centroids):
+        get_routing_index(client_path, model_name).set_vectors(doc_id, centroids.vectors())
+    else:
+        get_routing_index(client_path, model_name).remove(doc_id)
+    return col
+
+NO_DOCUMENTS_ANSWER = 'No relevant documents found in the database. Please ask an administrator to upload and index documents first.'
+
+# Earlier messages considered for the prompt before the token budget is applied
+HISTORY_LOOKBACK = 20
+
+def prompt_tokens(texts: list) -> list:
+    """Token counts for prompt budgeting, from the default embedding model's tokenizer.
+
+    The LLM's own tokenizer is not available locally; this one is close enough for
+    a budget (PROMPT_MAX_TOKENS leaves headroom). Falls back to ~4 chars per token.
+    """
+    try:
+        return count_tokens(texts, model_name=cfg.HUGGINGFACE_EMBED_MODEL)
+    except Exception:
+        return [len(t) // 4 + 1 for t in texts]
+
+def _history_line(msg: dict) -> str:
+    return f"{msg['role'].upper()}: {msg['content']}"
+
+def trim_history(chat_history: list, max_tokens: int, report: dict = None) -> list:
+    """Most recent earlier messages that fit in max_tokens (the last message is the current question)
+
+    Messages are kept newest first and returned in conversation order; if even the
+    newest one is too long, its text is cut to fit. max_tokens <= 0 keeps the lookback.
+    """
+    report = {} if report is None else report
+    earlier = (chat_history or [])[-HISTORY_LOOKBACK - 1:-1]
+    sizes = prompt_tokens([_history_line(m) for m in earlier]) if earlier else []
+    kept, used = [], 0
+    for msg, n in zip(reversed(earlier), reversed(sizes)):
+        if max_tokens > 0 and used + n > max_tokens:
+            if not kept:
+                kept.append(dict(msg, content=msg['content'][:len(msg['content']) * max_tokens // n]))
+                used = max_tokens
+            break
+        kept.append(msg)
+        used += n
+    report['history_tokens'] = used
+    report['history_dropped'] = len(earlier) - len(kept)
+    return kept[::-1]
+
+def build_prompt(query: str, ctx: str, history: list = None) -> str:
+    """Prompt text; `history` holds the earlier messages to show (see trim_history)"""
     history_context = ""
-    if chat_history and len(chat_history) > 1:
-        recent_history = chat_history[-6:]  # Last 3 exchanges (user + assistant)
-        history_text = "\n".join([f"{msg['role'].upper()}: {msg['content'][:200]}" for msg in recent_history[:-1]])
+    if history:
+        history_text = "\n".join(_history_line(msg) for msg in history)
         history_context = f"\n\nPREVIOUS CONVERSATION:\n{history_text}\n"
     
-    prompt = f"""You are a helpful legal assistant chatbot. Use the CONTEXT from the documents to answer questions accurately.
+    return f"""You are a helpful legal assistant chatbot. Use the CONTEXT from the documents to answer questions accurately.
 
 CONTEXT FROM DOCUMENTS:
 {ctx}{history_context}
@@ -59,11 +332,342 @@ CONTEXT FROM DOCUMENTS:
 CURRENT QUESTION: {query}
 
 Provide a detailed, conversational answer based on the context. Cite sources using [src:i] format. Be helpful and natural in your responses. If referring to previous questions, acknowledge them. Include relevant legal disclaimers when appropriate."""
+
+@metrics.timed('build_context')
+def assemble_prompt(query: str, top: list, chat_history: list = None, report: dict = None):
+    """Prompt within PROMPT_MAX_TOKENS from reranked chunks; returns (prompt, passages).
+
+    Adjacent chunks of a document are merged with their overlap removed, the chat
+    history gets up to PROMPT_HISTORY_TOKENS, and passages fill what is left in rank
+    order. The top-ranked passage always goes in: when it does not fit next to the
+    instructions, history and question, history is dropped oldest first, and if that
+    is not enough the passage is cut to what is left, or kept whole if nothing is
+    (prompt_over_budget is reported and logged).
+    `passages` are what the [src:i] labels refer to. `report` receives prompt_tokens,
+    prompt_tokens_saved (versus the chunks and history pasted verbatim),
+    context_merged, context_dropped, history_dropped and prompt_over_budget.
+    """
+    report = {} if report is None else report
+    history = trim_history(chat_history, cfg.PROMPT_HISTORY_TOKENS if cfg.PROMPT_MAX_TOKENS > 0 else 0, report)
+    passages = merge_adjacent(top)
+    report['prompt_over_budget'] = False
+    if cfg.PROMPT_MAX_TOKENS > 0:
+        fixed = prompt_tokens([build_prompt(query, '', history)])[0]
+        first = prompt_tokens([build_context(passages[:1])])[0] if passages else 0
+        if history and fixed + first > cfg.PROMPT_MAX_TOKENS:
+            # Make room for the best passage before anything else
+            while history and fixed + first > cfg.PROMPT_MAX_TOKENS:
+                history = history[1:]
+                report['history_dropped'] += 1
+                fixed = prompt_tokens([build_prompt(query, '', history)])[0]
+            report['history_tokens'] = sum(prompt_tokens([_history_line(m) for m in history])) if history else 0
+        if fixed + first > cfg.PROMPT_MAX_TOKENS:
+            report['prompt_over_budget'] = True
+            print(f"assemble_prompt: question and instructions take {fixed} of PROMPT_MAX_TOKENS="
+                  f"{cfg.PROMPT_MAX_TOKENS} tokens; keeping the top passage ({first} tokens) anyway, cut to what is left")
+        passages = fit_context(passages, prompt_tokens, max(0, cfg.PROMPT_MAX_TOKENS - fixed), report)
+    prompt = build_prompt(query, build_context(passages), history)
+    verbatim = build_prompt(query, build_context(top), (chat_history or [])[-HISTORY_LOOKBACK - 1:-1])
+    before, used = prompt_tokens([verbatim, prompt])
+    report['prompt_tokens'] = used
+    report['prompt_tokens_saved'] = max(0, before - used)
+    report['context_merged'] = sum(p.get('merged', 1) for p in passages) - len(passages)
+    metrics.inc('prompt_tokens_total', used)
+    metrics.inc('prompt_tokens_saved_total', report['prompt_tokens_saved'])
+    return prompt, passages
+
+class RAGCancelled(Exception):
+    """Raised by prepare_rag when its cancel_event is set between retrieval stages"""
+
+def _candidate_count(top_k: int) -> int:
+    """Chunks to retrieve: a wider pool when reranking is on, so it has something to reorder"""
+    return top_k * max(1, cfg.RERANK_CANDIDATES) if cfg.RERANK_P95_MS > 0 else top_k
+
+def _answer_key(prompt: str, passages: list, chat_history: list, query_emb: dict) -> AnswerKey:
+    """Answer cache key: the exact prompt, plus what a similar query must share to reuse its answer"""
+    query_model = cfg.HUGGINGFACE_EMBED_MODEL if cfg.HUGGINGFACE_EMBED_MODEL in query_emb else min(query_emb)
+    metas = [p.get('meta', {}) for p in passages]
+    return AnswerKey(
+        prompt, cfg.LLM_MODEL,
+        chunk_ids=[m.get('chunk_id') or p.get('id', '') for m, p in zip(metas, passages)],
+        history=[_history_line(m) for m in (chat_history or [])[-HISTORY_LOOKBACK - 1:-1]],
+        query_vec=query_emb[query_model], query_model=query_model,
+        doc_ids={m.get('doc_id') or sanitize_collection_name(m.get('source_file', 'unknown')) for m in metas},
+    )
+
+def _finish_prompt(query: str, cands: list, chat_history: list = None, top_k: int = 5, report: dict = None,
+                   query_emb: dict = None):
+    if not cands:
+        return None, []
+    # Rerank within the latency budget (falls back to vector order when over it)
+    top = fast_rerank(query, cands, top_k=top_k, report=report)
+    prompt, passages = assemble_prompt(query, top, chat_history, report)
+    if report is not None and query_emb and get_answer_cache() is not None:
+        report['answer_key'] = _answer_key(prompt, passages, chat_history, query_emb)
+    return prompt, passages
+
+def _cached_answer(report: dict):
+    """Answer cache lookup for the key prepare_rag left in report; records the tier hit"""
+    cache, key = get_answer_cache(), report.get('answer_key')
+    if cache is None or key is None:
+        report['answer_cache'] = None
+        return None
+    answer, tier = cache.get(key)
+    report['answer_cache'] = tier or 'miss'
+    if answer is not None:
+        report.pop('answer_key')
+    return answer
+
+def _report_search(report: dict, search: dict):
+    """Copy the collections query_all_collections skipped (deadline) or failed into report"""
+    if report is not None:
+        report['collections_skipped'] = list(search.get('skipped', []))
+        report['collections_failed'] = list(search.get('failed', []))
+        report['partial'] = bool(report['collections_skipped'] or report['collections_failed'])
+
+def _remember_answer(report: dict, answer: str):
+    cache, key = get_answer_cache(), report.pop('answer_key', None)
+    # An answer from a partial search is not kept; the next request may see every collection
+    if cache is not None and key is not None and answer and not report.get('partial'):
+        cache.put(key, answer)
+
+def embed_query(query: str, models: list) -> dict:
+    """Query vector per embedding model, so each collection is searched in its own space"""
+    if batching_enabled():
+        batcher = get_query_batcher()
+        futures = {m: batcher.submit(query, m) for m in models}
+        return {m: f.result() for m, f in futures.items()}
+    return {m: embed_texts([query], model_name=m)[0] for m in models}
+
+async def aembed_query(query: str, models: list) -> dict:
+    """embed_query for the event loop; batched requests are awaited without holding a thread"""
+    if not batching_enabled():
+        return await embed_pool().run(embed_query, query, models)
+    batcher = get_query_batcher()
+    futures = {m: asyncio.wrap_future(batcher.submit(query, m)) for m in models}
+    return {m: await f for m, f in futures.items()}
+
+def prepare_rag(query: str, client=None, top_k: int = 5, chat_history: list = None, route_top_n: int = None,
+                cancel_event: threading.Event = None, report: dict = None):
+    """Retrieval half of RAG: returns (prompt, candidates); prompt is None when nothing was found
+
+    `report` receives the rerank and prompt figures (see retriever.fast_rerank and
+    assemble_prompt), collections_skipped / collections_failed with partial=True when
+    some collections did not answer, and, with ANSWER_CACHE on, the answer cache key
+    for run_rag.
+    """
+    if client is None:
+        client = chroma_client()
+    
+    # Get query embedding for every model that produced searchable vectors
+    with metrics.span('query_embed'):
+        query_emb = embed_query(query, models_in_use(client))
+    if cancel_event is not None and cancel_event.is_set():
+        raise RAGCancelled()
+    
+    # Query across all collections (optimized: reduced candidates for speed)
+    if route_top_n is None:
+        route_top_n = cfg.ROUTE_TOP_N
+    search = {}
+    cands = query_all_collections(client, query_emb, k=_candidate_count(top_k), route_top_n=route_top_n,
+                                  cancel_event=cancel_event, report=search)
+    if cancel_event is not None and cancel_event.is_set():
+        raise RAGCancelled()
+    _report_search(report, search)
+    return _finish_prompt(query, cands, chat_history, top_k, report, query_emb)
+
+async def aprepare_rag(query: str, client=None, top_k: int = 5, chat_history: list = None, route_top_n: int = None,
+                       cancel_event: threading.Event = None, report: dict = None):
+    """prepare_rag for the event loop: embedding and Chroma work run on their own executors"""
+    if client is None:
+        client = chroma_client()
+    models = await chroma_pool().run(models_in_use, client)
+    with metrics.span('query_embed'):
+        query_emb = await aembed_query(query, models)
+    if cancel_event is not None and cancel_event.is_set():
+        raise RAGCancelled()
+    if route_top_n is None:
+        route_top_n = cfg.ROUTE_TOP_N
+    search = {}
+    cands = await chroma_pool().run(query_all_collections, client, query_emb, k=_candidate_count(top_k),
+                                    route_top_n=route_top_n, cancel_event=cancel_event, report=search)
+    if cancel_event is not None and cancel_event.is_set():
+        raise RAGCancelled()
+    _report_search(report, search)
+    # The cross-encoder is model compute, like query embedding
+    return await embed_pool().run(_finish_prompt, query, cands, chat_history, top_k, report, query_emb)
+
+def source_summaries(cands: list) -> list:
+    """Compact description of retrieved chunks for API responses"""
+    return [
+        {
+            'index': i,
+            'source_file': c.get('meta', {}).get('source_file', 'unknown'),
+            'chunk_id': c.get('meta', {}).get('chunk_id'),
+            'page_start': c.get('meta', {}).get('page_start'),
+            'page_end': c.get('meta', {}).get('page_end'),
+            'score': c.get('score'),
+            'preview': c['text'][:300],
+        }
+        for i, c in enumerate(cands)
+    ]
+
+def run_rag(query: str, client=None, top_k: int = 5, chat_history: list = None, route_top_n: int = None,
+            report: dict = None):
+    """Run RAG across all documents with optional chat history for conversational context
+
+    route_top_n limits vector search to the N documents the routing index ranks highest
+    (lower = faster, higher = better recall, 0 = search every document). Pass a dict
+    as `report` to get per-request stage figures such as rerank_ms.
+    """
+    report = {} if report is None else report
+    prompt, cands = prepare_rag(query, client, top_k, chat_history, route_top_n, report=report)
+    if prompt is None:
+        return NO_DOCUMENTS_ANSWER
+    cached = _cached_answer(report)
+    if cached is not None:
+        return cached
     
     # Reduced max_tokens for faster responses
     ans = chat(prompt, max_tokens=1024)
+    _remember_answer(report, ans)
     # Citation verification removed to keep responses clean
     # missing = verify_citations(ans, top)
     # if missing:
     #     ans += f"\n\n[Note] Some cited snippets may not match retrieved text: {missing}"
     return ans
+
+async def arun_rag(query: str, client=None, top_k: int = 5, chat_history: list = None, route_top_n: int = None,
+                   report: dict = None):
+    """run_rag for async callers; never blocks the event loop"""
+    report = {} if report is None else report
+    prompt, cands = await aprepare_rag(query, client, top_k, chat_history, route_top_n, report=report)
+    if prompt is None:
+        return NO_DOCUMENTS_ANSWER
+    cached = _cached_answer(report)
+    if cached is not None:
+        return cached
+    ans = await achat(prompt, max_tokens=1024)
+    _remember_answer(report, ans)
+    return ans
+
+async def stream_rag(query: str, client=None, top_k: int = 5, chat_history: list = None, route_top_n: int = None):
+    """Streaming variant of run_rag.
+
+    Yields ('sources', [...]) once retrieval finishes, then ('timings', {...}) with the
+    retrieval and rerank times, prompt token counts and any skipped or failed
+    collections (partial=True), then ('token', str) events as the LLM produces them
+    (a cached answer arrives as one token). Time-to-first-token
+    is logged per request. Cancelling the consumer (or closing the generator) stops
+    pending retrieval and the upstream LLM request.
+    """
+    started = time.perf_counter()
+    cancel_event = threading.Event()
+    stage = 'retrieval'
+    report = {}
+    try:
+        prompt, cands = await aprepare_rag(query, client, top_k, chat_history, route_top_n, cancel_event, report)
+        stage = 'sources'
+        yield 'sources', source_summaries(cands)
+        retrieval_ms = (time.perf_counter() - started) * 1000
+        cached = _cached_answer(report) if prompt is not None else None
+        yield 'timings', {'retrieval_ms': round(retrieval_ms, 1), 'rerank_ms': round(report.get('rerank_ms', 0.0), 1),
+                          'rerank_skipped': report.get('rerank_skipped'), 'prompt_tokens': report.get('prompt_tokens'),
+                          'prompt_tokens_saved': report.get('prompt_tokens_saved'),
+                          'prompt_over_budget': report.get('prompt_over_budget', False),
+                          'answer_cache': report.get('answer_cache'), 'partial': report.get('partial', False),
+                          'collections_skipped': report.get('collections_skipped', []),
+                          'collections_failed': report.get('collections_failed', [])}
+        if prompt is None:
+            yield 'token', NO_DOCUMENTS_ANSWER
+            return
+        if cached is not None:
+            yield 'token', cached
+            return
+        stage = 'llm'
+        answer = []
+        with metrics.span('llm'):
+            async with aclosing(astream_chat(prompt, max_tokens=1024)) as tokens:
+                async for token in tokens:
+                    if stage == 'llm':
+                        stage = 'streaming'
+                        ttft_ms = (time.perf_counter() - started) * 1000
+                        print(f"stream_rag: time to first token {ttft_ms:.0f}ms (retrieval {retrieval_ms:.0f}ms, "
+                              f"rerank {report.get('rerank_ms', 0.0):.0f}ms)")
+                    answer.append(token)
+                    yield 'token', token
+        _remember_answer(report, ''.join(answer))
+    except (asyncio.CancelledError, GeneratorExit, RAGCancelled):
+        cancel_event.set()
+        metrics.inc('rag_cancelled_total', stage=stage)
+        print(f"stream_rag: client went away during {stage}, cancelled upstream work")
+        raise
+
+_query_flight = SingleFlight('query')
+_stream_flight = StreamFlight('stream')
+
+# What a joining request keeps from the shared execution's report: properties of the
+# answer itself. Stage figures belong to the request that did the work.
+_SHARED_ANSWER_FIELDS = ('partial', 'collections_skipped', 'collections_failed')
+
+def _joined_report(shared_report: dict, waited: float) -> dict:
+    """Report for a request that joined an execution in flight; also times its wait as `coalesced`"""
+    metrics.record('coalesced', waited)
+    report = {k: shared_report[k] for k in _SHARED_ANSWER_FIELDS if k in shared_report}
+    report.update(coalesced=True, coalesced_ms=round(waited * 1000, 1))
+    return report
+
+def rag_flight_key(query: str, top_k: int, chat_history: list = None, route_top_n: int = None) -> tuple:
+    """Requests with equal keys produce the same prompt, so in-flight ones can share one execution"""
+    history = hashlib.sha256('\0'.join(_history_line(m) for m in (chat_history or [])[-HISTORY_LOOKBACK - 1:-1])
+                             .encode('utf-8')).hexdigest()
+    return ' '.join(query.lower().split()), top_k, history, route_top_n
+
+async def coalesced_rag(query: str, client=None, top_k: int = 5, chat_history: list = None, route_top_n: int = None,
+                        report: dict = None):
+    """arun_rag where identical concurrent requests (see rag_flight_key) share one execution.
+
+    `report` receives the execution's figures and coalesced=False for the request that
+    ran it. A request that joined one already in flight gets coalesced=True, its own
+    wait as coalesced_ms and whether the answer is partial, but not the stage figures.
+    """
+    if not cfg.CHAT_COALESCE:
+        return await arun_rag(query, client, top_k, chat_history, route_top_n, report)
+
+    async def execute():
+        shared_report = {}
+        answer = await arun_rag(query, client, top_k, chat_history, route_top_n, shared_report)
+        return answer, shared_report
+
+    started = time.perf_counter()
+    (answer, shared_report), shared = await _query_flight.run(
+        rag_flight_key(query, top_k, chat_history, route_top_n), execute)
+    if shared:
+        shared_report = _joined_report(shared_report, time.perf_counter() - started)
+    if report is not None:
+        report.update(shared_report, coalesced=shared)
+    return answer
+
+def coalesced_stream_rag(query: str, client=None, top_k: int = 5, chat_history: list = None, route_top_n: int = None):
+    """stream_rag where identical concurrent requests subscribe to one token feed.
+
+    A subscriber that joins late first receives everything already produced. Its
+    'timings' event is its own (see coalesced_rag), not the first subscriber's.
+    """
+    if not cfg.CHAT_COALESCE:
+        return stream_rag(query, client, top_k, chat_history, route_top_n)
+    return _joined_stream(rag_flight_key(query, top_k, chat_history, route_top_n),
+                          lambda: stream_rag(query, client, top_k, chat_history, route_top_n))
+
+async def _joined_stream(key: tuple, factory):
+    started = time.perf_counter()
+    joined = _stream_flight.joinable(key)
+    async with aclosing(_stream_flight.subscribe(key, factory)) as events:
+        async for kind, payload in events:
+            if kind == 'timings':
+                payload = (_joined_report(payload, time.perf_counter() - started) if joined
+                           else dict(payload, coalesced=False))
+            yield kind, payload
+
+metrics.describe('prompt_tokens_total', 'Prompt tokens sent to the LLM (embedding tokenizer estimate)')
+metrics.describe('prompt_tokens_saved_total', 'Prompt tokens removed by chunk merging, overlap removal and the token budget')
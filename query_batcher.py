@@ -0,0 +1,95 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+from config import cfg
+from embeddings import embed_texts, resolve_model_name
+import metrics
+
+class QueryBatcher:
+    """Coalesces concurrent single-query embedding calls into one encode per batch.
+
+    The first request for a model opens a window of `window_ms`; everything that arrives
+    for the same model before it closes (up to `max_batch` texts) is encoded together on
+    the batcher thread and each caller's future receives its own vector. While a batch
+    is being encoded new requests keep accumulating for the next one.
+    """
+
+    def __init__(self, window_ms: float = None, max_batch: int = None,
+                 encode: Callable[[List[str], str], List[List[float]]] = None):
+        self.window = (cfg.EMBED_BATCH_WINDOW_MS if window_ms is None else window_ms) / 1000
+        self.max_batch = cfg.EMBED_BATCH_MAX if max_batch is None else max_batch
+        self.encode = encode or (lambda texts, model_name: embed_texts(texts, model_name=model_name))
+        self._pending: Dict[str, list] = {}
+        self._opened: Dict[str, float] = {}
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name='query-batcher', daemon=True).start()
+
+    def submit(self, text: str, model_name: str = None) -> Future:
+        model_name = resolve_model_name(model_name)
+        future = Future()
+        with self._cond:
+            if model_name not in self._pending:
+                self._pending[model_name] = []
+                self._opened[model_name] = time.monotonic()
+            self._pending[model_name].append((text, future, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def embed(self, text: str, model_name: str = None) -> List[float]:
+        return self.submit(text, model_name).result()
+
+    def _next_batch(self):
+        """Block until some model's window closed or its batch is full; caller holds the lock"""
+        while True:
+            now = time.monotonic()
+            wait_for = None
+            for model_name, items in self._pending.items():
+                due = self._opened[model_name] + self.window
+                if len(items) >= self.max_batch or now >= due:
+                    batch = items[:self.max_batch]
+                    rest = items[self.max_batch:]
+                    if rest:
+                        self._pending[model_name] = rest
+                        self._opened[model_name] = now
+                    else:
+                        del self._pending[model_name]
+                        del self._opened[model_name]
+                    return model_name, batch
+                wait_for = due - now if wait_for is None else min(wait_for, due - now)
+            self._cond.wait(timeout=wait_for)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                model_name, batch = self._next_batch()
+            started = time.monotonic()
+            texts = [text for text, _, _ in batch]
+            try:
+                vectors = self.encode(texts, model_name)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, queued), vec in zip(batch, vectors):
+                metrics.inc('query_batch_wait_seconds_total', started - queued)
+                future.set_result(vec)
+            metrics.inc('query_batches_total')
+            metrics.inc('query_batch_texts_total', len(batch))
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+def get_query_batcher() -> QueryBatcher:
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = QueryBatcher()
+        return _batcher
+
+def batching_enabled() -> bool:
+    return cfg.EMBED_BATCH_WINDOW_MS > 0
+
+metrics.describe('query_batches_total', 'model.encode calls made by the query embedding batcher')
+metrics.describe('query_batch_texts_total', 'Queries embedded through the batcher (divide by batches for mean batch size)')
+metrics.describe('query_batch_wait_seconds_total', 'Time queries spent waiting for their batch to start encoding')
@@ -1,20 +1,67 @@
 from embeddings import embed_texts
 from db_store import query_collection
 from llm import chat
+from config import cfg
 from typing import List, Dict, Any
+from collections import OrderedDict, deque
+import hashlib
 import json
+import threading
+import time
+import metrics
 
 # Lazy load reranking model
 _rerank_model = None
+_rerank_load_lock = threading.Lock()
+_rerank_loading = False
+# Background load failures: count and when the next attempt may start (backs off to 10 minutes)
+_rerank_load_failures = 0
+_rerank_retry_at = 0.0
 
 def _get_rerank_model():
     global _rerank_model
-    if _rerank_model is None:
-        from sentence_transformers import CrossEncoder
-        # Using a cross-encoder model for better reranking
-        _rerank_model = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+    with _rerank_load_lock:
+        if _rerank_model is None:
+            if cfg.RERANK_BACKEND == 'onnx':
+                from onnx_backend import OnnxCrossEncoder
+                _rerank_model = OnnxCrossEncoder(cfg.RERANK_MODEL, max_length=cfg.RERANK_MAX_LENGTH)
+            else:
+                from sentence_transformers import CrossEncoder
+                # Using a cross-encoder model for better reranking; pairs are truncated to max_length
+                _rerank_model = CrossEncoder(cfg.RERANK_MODEL, max_length=cfg.RERANK_MAX_LENGTH)
     return _rerank_model
 
+def _load_rerank_model():
+    """Background load for _rerank_state; failures are logged and retried with backoff"""
+    global _rerank_loading, _rerank_load_failures, _rerank_retry_at
+    try:
+        _get_rerank_model()
+        _rerank_load_failures = 0
+    except Exception as e:
+        _rerank_load_failures += 1
+        delay = min(600.0, 30.0 * 2 ** (_rerank_load_failures - 1))
+        _rerank_retry_at = time.monotonic() + delay
+        metrics.inc('rerank_load_failures_total')
+        print(f"Could not load rerank model {cfg.RERANK_MODEL} ({_rerank_load_failures} failures, "
+              f"retrying in {delay:.0f}s): {e!r}")
+    finally:
+        _rerank_loading = False
+
+def _rerank_model_state() -> str:
+    """'ready' once the cross-encoder is loaded; otherwise 'loading' (a background load is
+    started if none is running) or 'error' while backing off after a failed load"""
+    global _rerank_loading
+    if _rerank_model is not None:
+        return 'ready'
+    with _rerank_load_lock:
+        if _rerank_loading:
+            return 'loading'
+        if time.monotonic() < _rerank_retry_at:
+            return 'error'
+        _rerank_loading = True
+    threading.Thread(target=_load_rerank_model, name='rerank-load', daemon=True).start()
+    return 'loading'
+
 def retrieve(collection, query: str, k=5):
     q_emb = embed_texts([query])[0]
     return query_collection(collection, q_emb, k=k)
@@ -25,6 +72,7 @@ def expand_query(query: str) -> str:
     # Could use a local model here for query expansion in future
     return query
 
+@metrics.timed('rerank')
 def rerank(query: str, candidates: List[Dict[str,Any]], top_k: int = 3):
     """Rerank candidates using Hugging Face cross-encoder model"""
     if not candidates:
@@ -44,13 +92,292 @@ def rerank(query: str, candidates: List[Dict[str,Any]], top_k: int = 3):
         print(f"Reranking failed: {e}, falling back to distance sorting")
         return sorted(candidates, key=lambda x: x['score'])[:top_k]
 
+class RerankBudget:
+    """Tracks rerank cost so the shortlist fits the p95 latency target.
+
+    Keeps an EWMA of model time per scored pair and a window of recent rerank stage
+    durations (at most `window` of them, none older than `window_seconds`). The
+    shortlist is the number of uncached pairs the per-pair estimate says fit in the
+    target, shrunk further while the observed p95 is over it. Before the first
+    measurement it is `probe_pairs`. While requests are skipped for budget, one of
+    them every `probe_interval` seconds scores a `probe_pairs` shortlist whose timing
+    replaces the estimate, so reranking comes back once the model is fast again.
+    """
+
+    def __init__(self, target_ms: float, window: int = 200, window_seconds: float = 60.0,
+                 probe_interval: float = 10.0, probe_pairs: int = 8):
+        self.target_ms = target_ms
+        self.window_seconds = window_seconds
+        self.probe_interval = probe_interval
+        self.probe_pairs = probe_pairs
+        self.per_pair_ms = None
+        self._recent = deque(maxlen=window)  # (monotonic time, ms)
+        self._last_record = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def p95(self) -> float:
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            recent = sorted(ms for at, ms in self._recent if at >= cutoff)
+        return recent[int(len(recent) * 0.95) - 1] if len(recent) >= 20 else 0.0
+
+    def max_pairs(self) -> int:
+        if self.per_pair_ms is None:
+            return min(self.probe_pairs, cfg.RERANK_SHORTLIST_MAX)
+        pairs = int(self.target_ms / self.per_pair_ms)
+        p95 = self.p95()
+        if p95 > self.target_ms:
+            pairs = int(pairs * self.target_ms / p95)
+        return max(0, min(pairs, cfg.RERANK_SHORTLIST_MAX))
+
+    def claim_probe(self) -> bool:
+        """True for one caller at a time once no timing has been recorded for probe_interval"""
+        now = time.monotonic()
+        with self._lock:
+            if self._probe_started is not None and now - self._probe_started < self.probe_interval:
+                return False
+            if self.per_pair_ms is not None and now - self._last_record < self.probe_interval:
+                return False
+            self._probe_started = now
+            return True
+
+    def record(self, elapsed_ms: float, pairs: int, probe: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            self._recent.append((now, elapsed_ms))
+            self._last_record = now
+            if probe:
+                self._probe_started = None
+            if pairs:
+                sample = elapsed_ms / pairs
+                if self.per_pair_ms is None or probe:
+                    self.per_pair_ms = sample
+                else:
+                    self.per_pair_ms = 0.8 * self.per_pair_ms + 0.2 * sample
+
+class RerankScoreCache:
+    """LRU of cross-encoder scores keyed by (query hash, chunk id)"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+            return score
+
+    def put_many(self, items):
+        with self._lock:
+            for key, score in items:
+                self._scores[key] = score
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+_rerank_budget = None
+_rerank_cache = None
+
+def _rerank_state():
+    global _rerank_budget, _rerank_cache
+    if _rerank_budget is None:
+        _rerank_budget = RerankBudget(cfg.RERANK_P95_MS)
+        _rerank_cache = RerankScoreCache(cfg.RERANK_CACHE_SIZE)
+    return _rerank_budget, _rerank_cache
+
+def _chunk_key(c: Dict[str, Any]) -> str:
+    return c.get('meta', {}).get('chunk_id') or hashlib.sha256(c['text'].encode('utf-8')).hexdigest()
+
+@metrics.timed('rerank')
+def fast_rerank(query: str, candidates: List[Dict[str, Any]], top_k: int = 5,
+                report: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    """Cross-encoder rerank that stays inside RERANK_P95_MS.
+
+    Candidates are in vector-distance order. Cached (query, chunk) scores are free;
+    uncached pairs are scored for as many leading candidates as the latency budget
+    allows, and the cross-encoder is skipped entirely (vector order is kept) while the
+    model is still loading, failed to load (retried with backoff), or not even top_k
+    pairs fit (apart from a periodic probe that keeps the estimate current, see
+    RerankBudget). Scored candidates come first, best score first, followed by the
+    unscored ones in their original order. Pair text is cut to roughly
+    RERANK_MAX_LENGTH tokens before tokenizing; the model truncates exactly.
+
+    `report` receives rerank_ms, rerank_scored, rerank_cached, rerank_shortlist,
+    rerank_probe and rerank_skipped (None, 'disabled', 'loading', 'budget' or 'error').
+    """
+    report = {} if report is None else report
+    started = time.perf_counter()
+    report.update(rerank_ms=0.0, rerank_scored=0, rerank_cached=0, rerank_shortlist=0, rerank_probe=False,
+                  rerank_skipped=None)
+    if not candidates:
+        return []
+    if cfg.RERANK_P95_MS <= 0:
+        report['rerank_skipped'] = 'disabled'
+        return candidates[:top_k]
+    budget, cache = _rerank_state()
+    qhash = hashlib.sha256(' '.join(query.lower().split()).encode('utf-8')).hexdigest()
+    keys = [(qhash, _chunk_key(c)) for c in candidates]
+    scores = [cache.get(k) for k in keys]
+    report['rerank_cached'] = sum(s is not None for s in scores)
+
+    def shortlist_for(allowed):
+        """Leading candidates whose uncached pairs fit in `allowed`: (shortlist length, miss indexes)"""
+        shortlist, misses = 0, []
+        for i, score in enumerate(scores):
+            if score is None:
+                if len(misses) >= allowed:
+                    break
+                misses.append(i)
+            shortlist = i + 1
+        return shortlist, misses
+
+    shortlist, misses = shortlist_for(budget.max_pairs())
+    probe = False
+    state = _rerank_model_state() if misses else 'ready'
+    if state != 'ready':
+        report['rerank_skipped'] = state
+        misses = []
+    elif misses and shortlist < min(top_k, len(candidates)):
+        if budget.claim_probe():
+            # Over budget by a stale estimate: score a small shortlist to measure again
+            shortlist, misses = shortlist_for(budget.probe_pairs)
+            probe = True
+        else:
+            report['rerank_skipped'] = 'budget'
+            misses = []
+    report['rerank_shortlist'] = shortlist
+    report['rerank_probe'] = probe
+    if misses:
+        max_chars = cfg.RERANK_MAX_LENGTH * 6
+        pairs = [[query[:max_chars], candidates[i]['text'][:max_chars]] for i in misses]
+        try:
+            t = time.perf_counter()
+            predicted = _get_rerank_model().predict(pairs)
+            budget.record((time.perf_counter() - t) * 1000, len(pairs), probe)
+        except Exception as e:
+            print(f"Reranking failed: {e}, keeping vector order")
+            report['rerank_skipped'] = 'error'
+            predicted = None
+        if predicted is not None:
+            for i, score in zip(misses, predicted):
+                scores[i] = float(score)
+            cache.put_many((keys[i], scores[i]) for i in misses)
+            report['rerank_scored'] = len(misses)
+
+    scored = sorted((i for i in range(len(candidates)) if scores[i] is not None), key=lambda i: -scores[i])
+    rest = [i for i in range(len(candidates)) if scores[i] is None]
+    ranked = []
+    for i in scored + rest:
+        c = candidates[i]
+        if scores[i] is not None:
+            c = dict(c, rerank_score=scores[i])
+        ranked.append(c)
+    report['rerank_ms'] = (time.perf_counter() - started) * 1000
+    metrics.inc('rerank_seconds_total', report['rerank_ms'] / 1000)
+    metrics.inc('rerank_requests_total', outcome=report['rerank_skipped'] or 'reranked')
+    metrics.inc('rerank_pairs_total', report['rerank_scored'], source='model')
+    metrics.inc('rerank_pairs_total', report['rerank_cached'], source='cache')
+    return ranked[:top_k]
+
 def build_context(cands):
     context_parts = []
     for i, c in enumerate(cands):
-        source_file = c.get('meta', {}).get('source_file', 'unknown')
-        context_parts.append(f"[src:{i}] (from: {source_file})\n{c['text']}")
+        meta = c.get('meta', {})
+        source = meta.get('source_file', 'unknown')
+        if meta.get('page_start'):
+            first, last = meta['page_start'], meta.get('page_end', meta['page_start'])
+            source += f", p. {first}" if first == last else f", pp. {first}-{last}"
+        context_parts.append(f"[src:{i}] (from: {source})\n{c['text']}")
     return '\n\n'.join(context_parts)
 
+def _overlap_len(a: str, b: str, probe: int = 32) -> int:
+    """Length of the longest suffix of `a` that is also a prefix of `b`"""
+    head = b[:min(probe, len(b))]
+    if not head:
+        return 0
+    pos = a.find(head, max(0, len(a) - len(b)))
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        pos = a.find(head, pos + 1)
+    return 0
+
+def merge_adjacent(cands: List[Dict[str, Any]], min_overlap: int = 16) -> List[Dict[str, Any]]:
+    """Fold neighbouring chunks of the same document into one passage.
+
+    Chunks whose chunk_index values are consecutive are joined in document order
+    with the text they share (the chunker's overlap) kept once. Each passage takes
+    the rank of its best candidate and spans the pages of all of its chunks;
+    'merged' counts the chunks it replaces. The same chunk returned by more than one
+    embedding model's collection appears once.
+    """
+    by_doc, order = {}, []
+    for rank, c in enumerate(cands):
+        meta = c.get('meta', {})
+        index = meta.get('chunk_index')
+        if index is None:
+            order.append((rank, [c]))
+            continue
+        chunks = by_doc.setdefault(meta.get('source_file', 'unknown'), {})
+        chunks.setdefault(index, (rank, c))
+    for chunks in by_doc.values():
+        run = []
+        for index in sorted(chunks):
+            if run and index != run[-1][0] + 1:
+                order.append((min(chunks[i][0] for i, _ in run), [c for _, c in run]))
+                run = []
+            run.append((index, chunks[index][1]))
+        order.append((min(chunks[i][0] for i, _ in run), [c for _, c in run]))
+
+    passages = []
+    for _, run in sorted(order, key=lambda item: item[0]):
+        if len(run) == 1:
+            passages.append(run[0])
+            continue
+        text = run[0]['text']
+        for c in run[1:]:
+            overlap = _overlap_len(text, c['text'])
+            text += c['text'][overlap:] if overlap >= min_overlap else '\n' + c['text']
+        meta = dict(run[0].get('meta', {}))
+        pages = [c['meta'][k] for c in run for k in ('page_start', 'page_end') if c['meta'].get(k)]
+        if pages:
+            meta['page_start'], meta['page_end'] = min(pages), max(pages)
+        scores = [c['score'] for c in run if c.get('score') is not None]
+        passages.append(dict(run[0], text=text, meta=meta, merged=len(run),
+                             score=min(scores) if scores else run[0].get('score')))
+    return passages
+
+def fit_context(passages: List[Dict[str, Any]], count_tokens, max_tokens: int,
+                report: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    """Keep passages in rank order while their tokens fit in max_tokens.
+
+    Passages that do not fit are dropped (a smaller later one may still fit), except
+    that the first passage is never dropped: it is cut to the budget, or kept whole
+    when there is no budget at all, rather than leaving the context empty.
+    `report` receives context_tokens and context_dropped.
+    """
+    report = {} if report is None else report
+    sizes = count_tokens([build_context([p]) for p in passages]) if passages else []
+    kept, used = [], 0
+    for p, n in zip(passages, sizes):
+        if used + n <= max_tokens:
+            kept.append(p)
+            used += n
+        elif not kept:
+            if max_tokens > 0:
+                # Tokens are roughly proportional to characters; cut the text to fit
+                p = dict(p, text=p['text'][:len(p['text']) * max_tokens // n])
+                n = max_tokens
+            kept.append(p)
+            used = n
+    report['context_tokens'] = used
+    report['context_dropped'] = len(passages) - len(kept)
+    return kept
+
 def verify_citations(answer: str, cands: List[Dict[str,Any]]):
     missing = []
     for idx,c in enumerate(cands):
@@ -58,3 +385,8 @@ def verify_citations(answer: str, cands: List[Dict[str,Any]]):
         if snippet_tag in answer and c['text'] not in answer:
             missing.append(idx)
     return missing
+
+metrics.describe('rerank_seconds_total', 'Time spent in the rerank stage')
+metrics.describe('rerank_requests_total', 'Rerank stage outcomes (reranked, or why the cross-encoder was skipped)')
+metrics.describe('rerank_pairs_total', 'Query/chunk pairs scored by the cross-encoder or served from the score cache')
+metrics.describe('rerank_load_failures_total', 'Failed background loads of the rerank model')
@@ -0,0 +1,106 @@
+import asyncio
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List
+import metrics
+
+class SingleFlight:
+    """Runs one coroutine per key at a time; concurrent callers with the same key share its result.
+
+    The work runs as its own task, so a caller that goes away does not cancel it for
+    the others. The key is released when the work finishes; later callers start afresh.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]):
+        """(result, shared) where shared is True when another caller's execution was joined"""
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            metrics.inc('coalesced_requests_total', kind=self.name)
+        else:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task), shared
+
+class _Broadcast:
+    """One producer's events, kept so subscribers that join late replay them from the start"""
+
+    def __init__(self):
+        self.events: List[Any] = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: asyncio.Task = None
+
+    def publish(self, event):
+        self.events.append(event)
+        self.changed.set()
+
+class StreamFlight:
+    """Single-flight for async generators: concurrent subscribers with the same key share one feed.
+
+    Every subscriber sees every event from the first one on, then follows the live tail.
+    The producer is cancelled (closing the upstream generator) once its last subscriber
+    detaches, so a lone client disconnecting still stops the upstream work.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, _Broadcast] = {}
+
+    async def _produce(self, key: Hashable, feed: _Broadcast, factory: Callable[[], AsyncIterator[Any]]):
+        try:
+            async with aclosing(factory()) as events:
+                async for event in events:
+                    feed.publish(event)
+        except asyncio.CancelledError:
+            feed.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            feed.error = e
+        finally:
+            feed.done = True
+            feed.changed.set()
+            if self._inflight.get(key) is feed:
+                del self._inflight[key]
+
+    def joinable(self, key: Hashable) -> bool:
+        """True when subscribing to `key` now would join a feed already in flight"""
+        return key in self._inflight
+
+    async def subscribe(self, key: Hashable, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        feed = self._inflight.get(key)
+        if feed is None:
+            feed = _Broadcast()
+            self._inflight[key] = feed
+            feed.task = asyncio.ensure_future(self._produce(key, feed, factory))
+        else:
+            metrics.inc('coalesced_requests_total', kind=self.name)
+        feed.subscribers += 1
+        sent = 0
+        try:
+            while True:
+                while sent < len(feed.events):
+                    sent += 1
+                    yield feed.events[sent - 1]
+                if feed.done:
+                    if feed.error is not None:
+                        raise feed.error
+                    return
+                feed.changed.clear()
+                if sent < len(feed.events) or feed.done:
+                    continue
+                await feed.changed.wait()
+        finally:
+            feed.subscribers -= 1
+            if feed.subscribers == 0 and not feed.done:
+                if self._inflight.get(key) is feed:
+                    del self._inflight[key]
+                feed.task.cancel()
+
+metrics.describe('coalesced_requests_total', 'Chat requests that joined an identical request already in flight')
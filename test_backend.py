@@ -1,5 +1,6 @@
 import requests
 import json
+import time
 
 BASE_URL = "http://localhost:8000"
 
@@ -50,6 +51,51 @@ def test_documents_list():
         print(f"✗ List documents failed: {e}")
         return False
 
+def _sample_pdf() -> bytes:
+    """One-page PDF with a line of text, so the upload test needs no fixture file"""
+    text = b"BT /F1 12 Tf 72 720 Td (The tenant must give ninety days written notice.) Tj ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(text), text),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf, offsets = b"%PDF-1.4\n", []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+def test_upload(timeout: float = 120):
+    """Test upload: the file is queued, then the job is polled until indexing finishes"""
+    try:
+        files = {"file": ("backend_test.pdf", _sample_pdf(), "application/pdf")}
+        response = requests.post(f"{BASE_URL}/documents/upload", files=files)
+        print(f"✓ Upload: {response.status_code}")
+        if response.status_code != 200:
+            print(f"  Error: {response.text}")
+            return False
+        job_id = response.json().get("job_id")
+        print(f"  Queued as job {job_id}")
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = requests.get(f"{BASE_URL}/documents/jobs/{job_id}").json()
+            if job.get("status") in ("done", "failed"):
+                print(f"  Job {job['status']}: {job.get('error') or job.get('result')}")
+                return job["status"] == "done"
+            time.sleep(1)
+        print(f"  Job {job_id} still running after {timeout:.0f}s")
+        return False
+    except Exception as e:
+        print(f"✗ Upload failed: {e}")
+        return False
+
 def test_cors():
     """Test CORS headers"""
     try:
@@ -71,6 +117,7 @@ if __name__ == "__main__":
         "Health": test_health(),
         "Chat": test_chat(),
         "Documents": test_documents_list(),
+        "Upload": test_upload(),
         "CORS": test_cors()
     }
     
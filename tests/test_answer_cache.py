@@ -0,0 +1,48 @@
+import pytest
+import answer_cache
+import db_store
+from answer_cache import AnswerCache, AnswerKey
+
+class FakeCollection:
+    """Just enough of a Chroma collection for db_store's write paths"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def upsert(self, **kwargs):
+        pass
+
+    def delete(self, **kwargs):
+        pass
+
+def key(prompt: str, doc_ids=('lease',), query_vec=(1.0, 0.0)) -> AnswerKey:
+    chunk_ids = [f'{doc_id}_c{i}' for doc_id in doc_ids for i in range(2)]
+    return AnswerKey(prompt, 'llm', chunk_ids, [], query_vec=query_vec, query_model='embed', doc_ids=doc_ids)
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = AnswerCache(max_entries=10, ttl=60, min_cosine=0.9)
+    monkeypatch.setattr(answer_cache, '_cache', cache)
+    return cache
+
+def test_exact_and_semantic_hits(cache):
+    cache.put(key('what notice?'), 'ninety days')
+    assert cache.get(key('what notice?')) == ('ninety days', 'exact')
+    assert cache.get(key('how much notice?', query_vec=(0.99, 0.05))) == ('ninety days', 'semantic')
+    assert cache.get(key('who pays rent?', query_vec=(0.0, 1.0))) == (None, None)
+
+def test_upsert_invalidates_answers_for_the_document(cache):
+    cache.put(key('what notice?'), 'ninety days')
+    cache.put(key('what deposit?', doc_ids=('loan',)), 'one month')
+    db_store.add_documents(FakeCollection('lease'), ['new text'], ['lease_abc'], [[0.1, 0.2]])
+    assert cache.get(key('what notice?')) == (None, None)
+    assert cache.get(key('what deposit?', doc_ids=('loan',))) == ('one month', 'exact')
+
+def test_chunk_delete_in_shared_collection_invalidates_by_filename(cache):
+    cache.put(key('what notice?'), 'ninety days')
+    unified = FakeCollection(db_store.cfg.UNIFIED_COLLECTION)
+    db_store.delete_chunks(unified, [], filename='lease')  # Nothing deleted, nothing dropped
+    assert cache.get(key('what notice?'))[1] == 'exact'
+    db_store.delete_chunks(unified, ['lease_abc'], filename='lease')
+    assert cache.get(key('what notice?')) == (None, None)
+    assert cache.snapshot()['invalidations'] == 1
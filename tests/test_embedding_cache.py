@@ -0,0 +1,30 @@
+import numpy as np
+from embedding_cache import EmbeddingCache
+
+def test_memory_hits_and_misses():
+    cache = EmbeddingCache(max_bytes=1 << 20)
+    cache.put_many('m', ['a', 'b'], [[1.0, 0.0], [0.0, 1.0]])
+    found = cache.get_many('m', ['a', 'c', 'b'])
+    assert found[1] is None
+    np.testing.assert_array_equal(found[0], [1.0, 0.0])
+    np.testing.assert_array_equal(found[2], [0.0, 1.0])
+    assert cache.get_many('other-model', ['a']) == [None]
+    assert cache.snapshot()['memory_hits'] == 2
+
+def test_lru_is_bounded_by_bytes():
+    vec = np.zeros(64, dtype=np.float32)
+    cache = EmbeddingCache(max_bytes=2 * (vec.nbytes + 200))
+    cache.put_many('m', ['a', 'b'], [vec, vec])
+    cache.get_many('m', ['a'])  # 'b' is now least recently used
+    cache.put_many('m', ['c'], [vec])
+    assert [v is not None for v in cache.get_many('m', ['a', 'b', 'c'])] == [True, False, True]
+    assert cache.snapshot()['evictions'] == 1
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / 'embeddings.sqlite')
+    EmbeddingCache(max_bytes=1 << 20, db_path=path).put_many('m', ['a'], [[0.5, 0.25]])
+    cache = EmbeddingCache(max_bytes=1 << 20, db_path=path)
+    np.testing.assert_allclose(cache.get_many('m', ['a'])[0], [0.5, 0.25], rtol=1e-3)
+    assert cache.snapshot()['disk_hits'] == 1
+    cache.get_many('m', ['a'])
+    assert cache.snapshot()['memory_hits'] == 1  # Promoted to memory
@@ -0,0 +1,116 @@
+import asyncio
+import time
+import httpx
+import pytest
+import llm
+import llm_scheduler
+from config import cfg
+from executors import Overloaded
+from llm_scheduler import BATCH, INTERACTIVE, CircuitBreaker, LLMScheduler, TokenBucket, UpstreamUnavailable
+
+def test_slots_are_handed_out_by_priority():
+    async def main():
+        scheduler = LLMScheduler(concurrency=1, queue_size=10)
+        order = []
+        await scheduler.acquire(BATCH)
+
+        async def wait(name, priority):
+            await scheduler.acquire(priority)
+            order.append(name)
+            scheduler.release()
+
+        waiters = [asyncio.ensure_future(wait('batch', BATCH)), asyncio.ensure_future(wait('interactive', INTERACTIVE))]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*waiters)
+        return order
+
+    assert asyncio.run(main()) == ['interactive', 'batch']
+
+def test_rate_budget_is_handed_out_by_priority():
+    async def main():
+        bucket = TokenBucket(rate=20, burst=1)
+        await bucket.take(BATCH)  # Empties the bucket
+        order = []
+
+        async def wait(name, priority):
+            await bucket.take(priority)
+            order.append(name)
+
+        await asyncio.gather(wait('batch', BATCH), wait('interactive', INTERACTIVE))
+        return order
+
+    assert asyncio.run(main()) == ['interactive', 'batch']
+
+def test_pause_holds_every_waiter():
+    async def main():
+        bucket = TokenBucket(rate=0, burst=1)
+        bucket.pause(0.2)
+        started = time.monotonic()
+        await asyncio.gather(bucket.take(INTERACTIVE), bucket.take(BATCH))
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) >= 0.19
+
+def test_token_is_refunded_when_no_slot_is_free(monkeypatch):
+    monkeypatch.setattr(cfg, 'LLM_RATE_PER_MIN', 60.0)
+    monkeypatch.setattr(cfg, 'LLM_BURST', 3.0)
+
+    async def main():
+        scheduler = LLMScheduler(concurrency=1, queue_size=1)
+        bucket = scheduler.bucket('m')
+        async with scheduler.slot('m', INTERACTIVE):
+            queued = asyncio.ensure_future(scheduler.acquire(BATCH))
+            await asyncio.sleep(0)
+            before = bucket.tokens
+            with pytest.raises(Overloaded):
+                async with scheduler.slot('m', INTERACTIVE):
+                    pass
+            after = bucket.tokens
+        await queued
+        scheduler.release()
+        return before, after
+
+    before, after = asyncio.run(main())
+    assert after == pytest.approx(before, abs=0.01)
+
+def test_429_pauses_the_bucket_and_retries(monkeypatch):
+    monkeypatch.setattr(cfg, 'LLM_MAX_ATTEMPTS', 3)
+    monkeypatch.setattr(cfg, 'LLM_RATE_PER_MIN', 0.0)
+    scheduler = LLMScheduler(concurrency=2, queue_size=10)
+    monkeypatch.setattr(llm_scheduler, '_scheduler', scheduler)
+    calls = []
+
+    async def attempt(model):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            request = httpx.Request('POST', 'https://openrouter.test/chat')
+            response = httpx.Response(429, headers={'Retry-After': '0.2'}, request=request)
+            raise httpx.HTTPStatusError('rate limited', request=request, response=response)
+        return 'ok'
+
+    assert asyncio.run(llm._call('m', INTERACTIVE, attempt)) == 'ok'
+    assert calls[1] - calls[0] >= 0.19
+    assert scheduler.breaker('m').consecutive == 0
+
+def test_breaker_opens_then_half_opens():
+    breaker = CircuitBreaker('m', failures=2, cooldown=0.1)
+    breaker.failure()
+    breaker.check()  # One failure is not enough
+    breaker.failure()
+    with pytest.raises(UpstreamUnavailable):
+        breaker.check()
+
+    time.sleep(0.11)
+    breaker.check()  # The probe goes through
+    with pytest.raises(UpstreamUnavailable):
+        breaker.check()  # Everyone else waits for it
+    breaker.failure()  # Failed probe opens the circuit again
+    with pytest.raises(UpstreamUnavailable):
+        breaker.check()
+
+    time.sleep(0.11)
+    breaker.check()
+    breaker.success()
+    assert breaker.opened_at is None
+    breaker.check()
@@ -0,0 +1,45 @@
+import pytest
+from query_batcher import QueryBatcher
+
+class Recorder:
+    """encode() stand-in that records each batch and returns one vector per text"""
+
+    def __init__(self, failures: int = 0):
+        self.batches = []
+        self.failures = failures
+
+    def __call__(self, texts, model_name):
+        self.batches.append((model_name, list(texts)))
+        if len(self.batches) <= self.failures:
+            raise RuntimeError('model not loaded')
+        return [[float(len(t))] for t in texts]
+
+def test_concurrent_queries_share_one_encode():
+    encode = Recorder()
+    batcher = QueryBatcher(window_ms=50, max_batch=8, encode=encode)
+    futures = [batcher.submit(text, 'model-a') for text in ('a', 'bb', 'ccc')]
+    assert [f.result(timeout=2) for f in futures] == [[1.0], [2.0], [3.0]]
+    assert encode.batches == [('model-a', ['a', 'bb', 'ccc'])]
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    encode = Recorder()
+    batcher = QueryBatcher(window_ms=5000, max_batch=2, encode=encode)
+    futures = [batcher.submit(text, 'model-a') for text in ('a', 'b')]
+    assert [f.result(timeout=2) for f in futures] == [[1.0], [1.0]]
+
+def test_models_are_batched_separately():
+    encode = Recorder()
+    batcher = QueryBatcher(window_ms=50, max_batch=8, encode=encode)
+    futures = [batcher.submit('a', 'model-a'), batcher.submit('b', 'model-b')]
+    for f in futures:
+        f.result(timeout=2)
+    assert sorted(encode.batches) == [('model-a', ['a']), ('model-b', ['b'])]
+
+def test_encode_error_reaches_every_caller():
+    batcher = QueryBatcher(window_ms=20, max_batch=8, encode=Recorder(failures=1))
+    futures = [batcher.submit(text, 'model-a') for text in ('a', 'b')]
+    for f in futures:
+        with pytest.raises(RuntimeError):
+            f.result(timeout=2)
+    # The batcher thread survives and serves the next batch
+    assert batcher.embed('ccc', 'model-a') == [3.0]
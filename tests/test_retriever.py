@@ -0,0 +1,43 @@
+from retriever import fit_context, merge_adjacent
+
+OVERLAP = 'the landlord shall return the deposit within thirty days '
+
+def chunk(index, text, page, score, source='lease.pdf'):
+    return {'text': text, 'score': score,
+            'meta': {'source_file': source, 'chunk_index': index, 'page_start': page, 'page_end': page}}
+
+def test_adjacent_chunks_merge_with_overlap_kept_once():
+    first = chunk(3, 'Section 4. ' + OVERLAP, 2, 0.4)
+    second = chunk(4, OVERLAP + 'of the end of the lease.', 3, 0.2)
+    [passage] = merge_adjacent([second, first])
+    assert passage['text'] == 'Section 4. ' + OVERLAP + 'of the end of the lease.'
+    assert passage['merged'] == 2
+    assert passage['score'] == 0.2
+    assert (passage['meta']['page_start'], passage['meta']['page_end']) == (2, 3)
+
+def test_gaps_documents_and_duplicates_stay_apart():
+    cands = [chunk(1, 'one', 1, 0.1), chunk(3, 'three', 2, 0.2), chunk(1, 'one', 1, 0.3),
+             chunk(2, 'other two', 1, 0.4, source='loan.pdf')]
+    passages = merge_adjacent(cands)
+    assert [p['text'] for p in passages] == ['one', 'three', 'other two']
+
+def test_adjacent_chunks_without_overlap_are_joined_by_a_newline():
+    [passage] = merge_adjacent([chunk(0, 'first part', 1, 0.1), chunk(1, 'second part', 1, 0.2)])
+    assert passage['text'] == 'first part\nsecond part'
+
+def tokens(texts):
+    return [len(t) // 4 for t in texts]
+
+def test_fit_context_drops_what_does_not_fit():
+    passages = [chunk(0, 'a' * 400, 1, 0.1), chunk(5, 'b' * 800, 2, 0.2), chunk(9, 'c' * 40, 3, 0.3)]
+    report = {}
+    kept = fit_context(passages, tokens, 150, report)
+    assert [p['text'][0] for p in kept] == ['a', 'c']
+    assert report['context_dropped'] == 1
+
+def test_fit_context_always_keeps_the_top_passage():
+    top = chunk(0, 'a' * 4000, 1, 0.1)
+    [cut] = fit_context([top, chunk(1, 'b' * 40, 1, 0.2)], tokens, 100)
+    assert 0 < len(cut['text']) < 4000
+    [whole] = fit_context([top], tokens, 0)
+    assert whole['text'] == top['text']
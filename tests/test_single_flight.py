@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+from single_flight import SingleFlight, StreamFlight
+
+def test_concurrent_callers_share_one_execution():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'answer'
+
+    async def main():
+        flight = SingleFlight('test')
+        first = await asyncio.gather(flight.run('q', work), flight.run('q', work), flight.run('other', work))
+        second = await flight.run('q', work)  # Finished flights are not reused
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == [('answer', False), ('answer', True), ('answer', False)]
+    assert second == ('answer', False)
+    assert len(calls) == 3
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def work():
+        await asyncio.sleep(0.05)
+        return 'answer'
+
+    async def main():
+        flight = SingleFlight('test')
+        leader = asyncio.ensure_future(flight.run('q', work))
+        follower = asyncio.ensure_future(flight.run('q', work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == ('answer', True)
+
+def test_late_subscriber_replays_the_stream():
+    started = []
+
+    async def produce():
+        started.append(1)
+        for token in 'abc':
+            await asyncio.sleep(0.02)
+            yield token
+
+    async def collect(flight, delay):
+        await asyncio.sleep(delay)
+        return [event async for event in flight.subscribe('q', produce)]
+
+    async def main():
+        flight = StreamFlight('test')
+        return await asyncio.gather(collect(flight, 0), collect(flight, 0.03))
+
+    assert asyncio.run(main()) == [['a', 'b', 'c'], ['a', 'b', 'c']]
+    assert len(started) == 1
+
+def test_producer_stops_when_last_subscriber_leaves():
+    async def main():
+        flight = StreamFlight('test')
+        stopped = asyncio.Event()
+
+        async def produce():
+            try:
+                while True:
+                    await asyncio.sleep(0.01)
+                    yield 'token'
+            finally:
+                stopped.set()
+
+        first, second = flight.subscribe('q', produce), flight.subscribe('q', produce)
+        await first.__anext__()
+        await second.__anext__()
+        await first.aclose()
+        await asyncio.sleep(0.03)
+        still_running = not stopped.is_set()
+        await second.aclose()
+        await asyncio.wait_for(stopped.wait(), 1)
+        return still_running, flight.joinable('q')
+
+    assert asyncio.run(main()) == (True, False)
+
+def test_joined_chat_request_reports_its_own_wait(monkeypatch):
+    import pipeline
+    monkeypatch.setattr(pipeline.cfg, 'CHAT_COALESCE', True)
+
+    async def arun_rag(query, client, top_k, chat_history, route_top_n, report):
+        await asyncio.sleep(0.05)
+        report.update(rerank_ms=12.0, prompt_tokens=900, partial=True)
+        return 'answer'
+
+    monkeypatch.setattr(pipeline, 'arun_rag', arun_rag)
+
+    async def main():
+        leader, follower = {}, {}
+        await asyncio.gather(pipeline.coalesced_rag('What notice?', report=leader),
+                             pipeline.coalesced_rag('what  notice?', report=follower))
+        return leader, follower
+
+    leader, follower = asyncio.run(main())
+    assert leader == {'rerank_ms': 12.0, 'prompt_tokens': 900, 'partial': True, 'coalesced': False}
+    assert follower['coalesced'] is True and follower['partial'] is True
+    assert 'rerank_ms' not in follower and follower['coalesced_ms'] >= 40